@@ -1,4 +1,5 @@
 import os
+import stripe
 from flask import Flask, request
 from flask_cors import CORS
 
@@ -9,9 +10,17 @@ from routes.traffic import traffic_blueprint
 from routes.payments import payments_blueprint
 from routes.notification_api import notification_api
 from routes.trafikverket_proxy import trafikverket_proxy
+from models.traffic_ingester import start_traffic_ingester
+from models.camera_dataset import start_camera_dataset
+from models.traffic_stream import start_traffic_stream
+from models.metrics import install_request_metrics, instrument_stripe
 
 app = Flask(__name__)
 
+# Tidmät varje request samt alla Stripe-anrop, och exponera resultatet på /metrics (kräver METRICS_TOKEN)
+install_request_metrics(app)
+instrument_stripe(stripe)
+
 # Logga inkommande requests
 @app.before_request
 def debug():
@@ -25,6 +34,13 @@ app.register_blueprint(payments_blueprint)
 app.register_blueprint(notification_api)
 app.register_blueprint(trafikverket_proxy)
 
+# Starta bakgrundsinhämtningen av trafikdata så att trafik-routes kan svara ur minnet
+start_traffic_ingester()
+# Fartkamerorna läses in från snapshot-filen och uppdateras en gång per dygn
+start_camera_dataset()
+# Ändringar skickas ut till anslutna kartor via SSE (/api/traffic-info/stream)
+start_traffic_stream()
+
 # CORS-inställningar (tillåt API-åtkomst från frontend)
 CORS(app,
      supports_credentials=True,
@@ -57,7 +73,7 @@ CORS(app,
              "http://127.0.0.1:5500"
          ]}
      },
-     expose_headers=["Content-Type", "Authorization"],
+     expose_headers=["Content-Type", "Authorization", "X-Cache", "X-Cache-Age", "Age", "X-Change-Token", "X-Next-Cursor"],
      allow_headers=["Content-Type", "Authorization"],
      methods=["GET", "POST", "OPTIONS", "PUT", "DELETE", "PATCH"]
 )
@@ -70,7 +86,8 @@ def options_handler(path):
 def healthcheck():
     return "Backend is running", 200
 
-# Starta appen (Render-vänlig inställning)
+# Starta appen lokalt (Render-vänlig inställning). I produktion: `gunicorn app:app`, som läser
+# gunicorn.conf.py och kör gevent-arbetare (behövs för SSE-strömmen, se models/traffic_stream.py).
 if __name__ == '__main__':
     port = int(os.environ.get("PORT", 5000))
     app.run(debug=True, host="0.0.0.0", port=port)
@@ -0,0 +1,24 @@
+# gunicorn.conf.py
+
+# Produktionsinställningar för gunicorn. Läses automatiskt när gunicorn startas i backend-mappen:
+#
+#   gunicorn app:app
+#
+# Arbetarna körs med gevent, så att en ansluten karta på /api/traffic-info/stream (SSE) bara
+# kostar en greenlet och inte en tråd eller en hel arbetare. Vanliga förfrågningar delar på
+# samma arbetare och blockeras inte av vilande strömmar.
+
+import os
+
+bind = f"0.0.0.0:{os.getenv('PORT', '5000')}"
+workers = int(os.getenv("WEB_CONCURRENCY", "2"))
+worker_class = "gevent"
+# Max antal samtidiga anslutningar per arbetare (strömmar och vanliga förfrågningar tillsammans).
+# TRAFFIC_STREAM_MAX_CLIENTS ska ligga en bit under, så att det alltid finns plats för övriga anrop.
+worker_connections = int(os.getenv("GUNICORN_WORKER_CONNECTIONS", "10000"))
+# Gäller bara arbetarens livstecken; strömmar som ligger öppna länge avbryts inte.
+timeout = int(os.getenv("GUNICORN_TIMEOUT", "60"))
+graceful_timeout = 10
+# Inte preload_app: appen ska laddas efter gevents monkey-patchning i varje arbetare, så att
+# inhämtningens och notisjobbens trådar blir greenlets.
+preload_app = False
@@ -0,0 +1,40 @@
+# models/app_dirs.py
+
+# Appens egna kataloger för filer som backend skriver själv (snapshot-filer, köer). Filerna
+# läggs aldrig i den delade temp-katalogen, där sökvägen är förutsägbar, vem som helst kan
+# skriva och innehållet kan försvinna, utan i kataloger som bara backend-processens användare
+# kommer åt. Sökvägarna och var de ska ligga i drift beskrivs i INSTALLATION.md.
+
+import os
+
+
+def cache_dir():
+    """Katalog för filer som kan återskapas (snapshot-filer): $XDG_CACHE_HOME/trafik eller ~/.cache/trafik."""
+    base = os.getenv("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache")
+    return os.path.join(base, "trafik")
+
+
+def data_dir():
+    """
+    Katalog för filer som måste överleva omstarter och nya driftsättningar (köer och jobb):
+    $TRAFIK_DATA_DIR, annars $XDG_DATA_HOME/trafik eller ~/.local/share/trafik. På en värd där
+    hemkatalogen töms vid varje driftsättning ska TRAFIK_DATA_DIR peka på en beständig disk.
+    """
+    explicit = os.getenv("TRAFIK_DATA_DIR")
+    if explicit:
+        return explicit
+    base = os.getenv("XDG_DATA_HOME") or os.path.join(os.path.expanduser("~"), ".local", "share")
+    return os.path.join(base, "trafik")
+
+
+def ensure_private_dir(path):
+    """
+    Skapar katalogen som filen `path` ligger i med rättigheterna 0700 (bara backend-processens
+    användare) och returnerar katalogens sökväg.
+    """
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, mode=0o700, exist_ok=True)
+    # makedirs sätter inte rättigheterna på en katalog som redan finns.
+    if os.stat(directory).st_uid == os.getuid():
+        os.chmod(directory, 0o700)
+    return directory
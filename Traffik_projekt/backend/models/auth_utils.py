@@ -1,6 +1,7 @@
 from functools import wraps
 from flask import request, jsonify
 from models.supabase_client import supabase 
+from models.metrics import time_upstream
 
 # Dekorator som kräver att användare är inloggade. 
 def require_authenticated(f):
@@ -13,7 +14,8 @@ def require_authenticated(f):
 
         try:
             #Verifierar token med Supabase Auth.
-            user = supabase.auth.get_user(token).user
+            with time_upstream("supabase", "auth.get_user"):
+                user = supabase.auth.get_user(token).user
             if not user:
                 return jsonify({"error": "Ogiltig token"}), 401
             
@@ -39,7 +41,8 @@ def require_role(required_role):
 
             try:
                 #Verifierar token med Supabase. 
-                user = supabase.auth.get_user(token).user
+                with time_upstream("supabase", "auth.get_user"):
+                    user = supabase.auth.get_user(token).user
                 if not user:
                     return jsonify({"error": "Ogiltig token"}), 401
 
@@ -0,0 +1,163 @@
+# models/camera_dataset.py
+
+# Fartkamerorna (TrafficSafetyCamera) som en egen datamängd. De ändras bara några gånger i
+# månaden, så de hämtas sällan (standard en gång per dygn), sparas i en lokal snapshot-fil som
+# läses in vid start och läggs i traffic_store, där de slås upp per län direkt ur minnet.
+
+import os
+import json
+import logging
+import tempfile
+import threading
+import time
+
+from models import traffic_ingester
+from models.app_dirs import cache_dir, ensure_private_dir
+from models.traffic_store import traffic_store
+from models.reprojection import fill_wgs84_from_sweref
+from models.upstream import upstream
+
+# Hur ofta (sekunder) fartkamerorna hämtas på nytt från Trafikverket.
+TRAFFIC_CAMERA_REFRESH_SECONDS = float(os.getenv("TRAFFIC_CAMERA_REFRESH_SECONDS", str(24 * 60 * 60)))
+# Var den senaste hämtningen sparas, så att en omstart inte behöver fråga Trafikverket.
+TRAFFIC_CAMERA_SNAPSHOT_PATH = os.getenv(
+    "TRAFFIC_CAMERA_SNAPSHOT_PATH", os.path.join(cache_dir(), "camera_snapshot.json")
+)
+
+# Endast SWEREF99TM hämtas; WGS84 räknas fram lokalt (se models/reprojection.py).
+CAMERA_INCLUDES = ["Id", "Name", "Geometry.SWEREF99TM", "CountyNo", "IconId", "Bearing"]
+
+
+def build_camera_query():
+    """Bygger XML-frågan för alla fartkameror i Sverige."""
+    includes = "\n".join(f"        <INCLUDE>{field}</INCLUDE>" for field in CAMERA_INCLUDES)
+    return f"""
+<REQUEST>
+    <LOGIN authenticationkey="{traffic_ingester.TRAFIKVERKET_API_KEY}" />
+    <QUERY objecttype="TrafficSafetyCamera" namespace="Road.Infrastructure" schemaversion="1">
+        <FILTER />
+{includes}
+    </QUERY>
+</REQUEST>
+"""
+
+
+def fetch_cameras():
+    """Hämtar alla fartkameror från Trafikverket. Kastar httpx.HTTPError vid fel."""
+    response = upstream("trafikverket").post(
+        traffic_ingester.TRAFIKVERKET_API_URL,
+        content=build_camera_query().encode("utf-8"),
+        headers={"Content-Type": "text/xml"},
+        operation="TrafficSafetyCamera",
+        retry=True,
+        timeout=30,
+    )
+    response.raise_for_status()
+    cameras = []
+    for result in response.json().get("RESPONSE", {}).get("RESULT", []):
+        if "ERROR" in result:
+            raise ValueError(f"Trafikverket returned an error: {result['ERROR']}")
+        cameras.extend(result.get("TrafficSafetyCamera", []))
+    fill_wgs84_from_sweref([], cameras)
+    return cameras
+
+
+class CameraDataset:
+    """
+    Läser in snapshot-filen vid start och hämtar sedan om kamerorna när de är äldre än
+    `refresh_seconds`. Varje ny uppsättning läggs i `store` och skrivs till snapshot-filen.
+    """
+
+    def __init__(self, store, snapshot_path, refresh_seconds):
+        self.store = store
+        self.snapshot_path = snapshot_path
+        self.refresh_seconds = refresh_seconds
+        self.fetched_at = None  # Epoch-sekunder för när kamerorna hämtades från Trafikverket.
+        self.last_error = None
+        self._thread = None
+        self._stop = threading.Event()
+
+    def load_snapshot(self):
+        """Läser in snapshot-filen om den finns. Returnerar True om kameror lästes in."""
+        try:
+            with open(self.snapshot_path, encoding="utf-8") as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            return False
+        except (OSError, ValueError) as e:
+            logging.warning(f"Could not read camera snapshot {self.snapshot_path}: {e}")
+            return False
+        cameras = data.get("cameras", []) if isinstance(data, dict) else None
+        if not isinstance(cameras, list):
+            logging.warning(f"Could not read camera snapshot {self.snapshot_path}: not a camera snapshot.")
+            return False
+        self.store.replace_cameras(cameras)
+        self.fetched_at = data.get("fetched_at")
+        logging.info(f"Loaded {len(cameras)} cameras from snapshot {self.snapshot_path}.")
+        return True
+
+    def save_snapshot(self, cameras):
+        # Skriv till en temporär fil och byt namn, så att en avbruten skrivning aldrig lämnar en trasig fil.
+        directory = ensure_private_dir(self.snapshot_path)
+        fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".camera_snapshot_")
+        try:
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                json.dump({"fetched_at": self.fetched_at, "cameras": cameras}, f, ensure_ascii=False)
+            os.replace(tmp_path, self.snapshot_path)
+        except OSError:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+    def refresh(self):
+        """Hämtar kamerorna från Trafikverket, lägger dem i lagret och sparar snapshot-filen."""
+        cameras = fetch_cameras()
+        self.fetched_at = time.time()
+        self.store.replace_cameras(cameras)
+        try:
+            self.save_snapshot(cameras)
+        except OSError as e:
+            logging.warning(f"Could not write camera snapshot {self.snapshot_path}: {e}")
+        self.last_error = None
+        logging.info(f"Camera dataset refreshed: {len(cameras)} cameras.")
+
+    def seconds_until_refresh(self):
+        if self.fetched_at is None:
+            return 0
+        return max(0.0, self.fetched_at + self.refresh_seconds - time.time())
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._loop, name="camera-dataset", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _loop(self):
+        while not self._stop.wait(self.seconds_until_refresh()):
+            try:
+                self.refresh()
+            except Exception as e:
+                # Behåll de senaste kamerorna och försök igen om en stund.
+                self.last_error = str(e)
+                logging.error(f"Camera dataset refresh failed: {e}")
+                self._stop.wait(min(self.refresh_seconds, traffic_ingester.TRAFFIC_INGEST_INTERVAL_SECONDS * 5))
+
+
+camera_dataset = CameraDataset(traffic_store, TRAFFIC_CAMERA_SNAPSHOT_PATH, TRAFFIC_CAMERA_REFRESH_SECONDS)
+
+
+def start_camera_dataset():
+    """Läser in kamera-snapshoten och startar den långsamma uppdateringen om inhämtning är aktiverad."""
+    if not traffic_ingester.TRAFFIC_INGEST_ENABLED:
+        logging.info("Camera dataset disabled (TRAFFIC_INGEST_ENABLED=false).")
+        return
+    # Snapshoten läses in direkt så att kamerorna finns innan första förfrågan.
+    camera_dataset.load_snapshot()
+    if not traffic_ingester.TRAFIKVERKET_API_KEY:
+        # Utan API-nyckel går det ändå att servera kamerorna från en tidigare snapshot.
+        logging.error("Camera refresh not started: Trafikverket API key not configured.")
+        return
+    camera_dataset.start()
@@ -0,0 +1,139 @@
+# models/change_log.py
+
+# Ändringslogg över de senaste versionerna av traffic_store, så att en klient som redan har
+# kartan laddad kan fråga "vad har ändrats sedan version X?" i stället för att hämta om allt.
+# Loggen är begränsad till ett antal versioner; äldre tokens ger ett fullständigt svar.
+
+import os
+import threading
+import uuid
+from collections import deque
+
+# Hur många versioner bakåt som kan besvaras med en delta. Med standardintervallet för
+# inhämtningen (60 s) motsvarar 120 versioner ungefär två timmar.
+TRAFFIC_CHANGE_LOG_VERSIONS = int(os.getenv("TRAFFIC_CHANGE_LOG_VERSIONS", "120"))
+
+ADDED, UPDATED, REMOVED = "added", "updated", "removed"
+
+
+def diff_snapshots(old_snapshot, new_snapshot):
+    """Returnerar (tillagda, ändrade, borttagna) deviation-Id:n mellan två ögonblicksbilder."""
+    old, new = old_snapshot.deviations, new_snapshot.deviations
+    added = [dev_id for dev_id in new if dev_id not in old]
+    removed = [dev_id for dev_id in old if dev_id not in new]
+    # Oförändrade deviations är samma objekt efter en inkrementell uppdatering; efter en full
+    # inhämtning är de nya objekt och jämförs på innehåll.
+    updated = [
+        dev_id for dev_id, deviation in new.items()
+        if dev_id in old and old[dev_id] is not deviation and old[dev_id] != deviation
+    ]
+    return added, updated, removed
+
+
+def snapshot_changes(old_snapshot, new_snapshot):
+    """Samma som diff_snapshots, som {Id: ADDED/UPDATED/REMOVED}."""
+    added, updated, removed = diff_snapshots(old_snapshot, new_snapshot)
+    changes = dict.fromkeys(added, ADDED)
+    changes.update(dict.fromkeys(updated, UPDATED))
+    changes.update(dict.fromkeys(removed, REMOVED))
+    return changes
+
+
+def changes_payload(store, snapshot, changes, county_no=None, message_types=None):
+    """
+    Bygger svaret för en klient med givet län- och typfilter:
+
+        {"full": false, "added": [...], "updated": [...], "removed": [Id, ...]}
+
+    En deviation som inte längre matchar filtret räknas som borttagen. Med changes=None blir
+    svaret fullständigt (full=true): "added" innehåller alla deviations och "cameras" alla
+    fartkameror, och klienten ska ersätta det den har.
+    """
+    if changes is None:
+        return {
+            "full": True,
+            "added": store.query_deviations(county_no, message_types, snapshot=snapshot),
+            "updated": [],
+            "removed": [],
+            "cameras": store.query_cameras(county_no, snapshot=snapshot),
+        }
+    changed_ids = [dev_id for dev_id, change in changes.items() if change != REMOVED]
+    matching = store.query_deviations(county_no, message_types, snapshot=snapshot, deviation_ids=changed_ids)
+    matching_ids = {deviation["Id"] for deviation in matching}
+    return {
+        "full": False,
+        "added": [d for d in matching if changes[d["Id"]] == ADDED],
+        "updated": [d for d in matching if changes[d["Id"]] != ADDED],
+        # Borttagna, samt ändrade som inte längre matchar filtret. Nya som aldrig har
+        # matchat filtret behöver klienten inte få veta om.
+        "removed": [dev_id for dev_id, change in changes.items() if dev_id not in matching_ids and change != ADDED],
+    }
+
+
+class ChangeLog:
+    """
+    Registreras som lyssnare på traffic_store och sparar vilka deviations som lagts till,
+    ändrats och tagits bort i varje ny version.
+
+    Tokens har formen "<process-id>-<version>". Process-id:t byts vid omstart, så en token från
+    en tidigare process (där versionerna räknades från början) känns igen som utgången.
+    """
+
+    def __init__(self, max_versions=TRAFFIC_CHANGE_LOG_VERSIONS):
+        self.epoch = uuid.uuid4().hex[:8]
+        self._lock = threading.Lock()
+        self._entries = deque(maxlen=max_versions)  # (version, {Id: ADDED/UPDATED/REMOVED})
+        self._snapshot = None
+
+    def update(self, old_snapshot, new_snapshot):
+        changes = snapshot_changes(old_snapshot, new_snapshot)
+        with self._lock:
+            self._entries.append((new_snapshot.version, changes))
+            self._snapshot = new_snapshot
+
+    def token(self, version):
+        return f"{self.epoch}-{version}"
+
+    def _parse_token(self, token):
+        epoch, _, version = (token or "").rpartition("-")
+        if epoch != self.epoch or not version.isdigit():
+            return None
+        return int(version)
+
+    def changes_since(self, token):
+        """
+        Returnerar (ögonblicksbild, ändringar) där ändringar är {Id: ADDED/UPDATED/REMOVED} sedan
+        `token`, nettoberäknat över alla versioner däremellan. Ändringar är None om token är
+        okänd eller äldre än loggen; då behöver klienten hela datamängden från ögonblicksbilden.
+        """
+        version = self._parse_token(token)
+        with self._lock:
+            snapshot, entries = self._snapshot, list(self._entries)
+        if snapshot is None or version is None or version > snapshot.version:
+            return snapshot, None
+        if version == snapshot.version:
+            return snapshot, {}
+        # Loggen måste täcka alla versioner efter `version`.
+        if not entries or entries[0][0] > version + 1:
+            return snapshot, None
+
+        first_change = {}  # Id -> första ändringen efter `version`
+        for entry_version, changes in entries:
+            if entry_version <= version:
+                continue
+            for dev_id, change in changes.items():
+                first_change.setdefault(dev_id, change)
+
+        net = {}
+        for dev_id, change in first_change.items():
+            existed_before = change != ADDED
+            exists_now = dev_id in snapshot.deviations
+            if exists_now:
+                net[dev_id] = UPDATED if existed_before else ADDED
+            elif existed_before:
+                net[dev_id] = REMOVED
+            # Tillagd och borttagen igen efter `version`: klienten har aldrig sett den.
+        return snapshot, net
+
+
+traffic_change_log = ChangeLog()
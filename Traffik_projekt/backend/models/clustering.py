@@ -0,0 +1,185 @@
+# models/clustering.py
+
+# Förberäknad klustring av trafikhändelser och fartkameror per zoomnivå, på samma sätt som
+# JavaScript-biblioteket supercluster: punkterna klustras nivå för nivå från högsta zoom och
+# nedåt, och varje nivå indexeras så att en fråga bara blir ett uppslag.
+
+import math
+from collections import defaultdict
+
+from models.geometry import geometry_item, representative_position
+from models.spatial_index import GridIndex
+
+# Klustringsradie i pixlar och tile-storlek, samma standardvärden som supercluster/Leaflet.markercluster.
+CLUSTER_RADIUS_PX = 60
+TILE_EXTENT_PX = 512
+MIN_ZOOM = 0
+MAX_ZOOM = 16
+
+# Samma indelning som frontend (Map.js) använder för filtren.
+ROADWORK_TYPE_VALUES = {'Roadwork', 'MaintenanceWorks', 'ConstructionWork', 'RoadResurfacing'}
+CATEGORIES = ("accident", "roadwork", "camera", "other")
+
+
+def deviation_category(deviation):
+    message_type = deviation.get("MessageTypeValue")
+    if message_type == "Accident":
+        return "accident"
+    if message_type in ROADWORK_TYPE_VALUES:
+        return "roadwork"
+    return "other"
+
+
+def _lon_to_x(lon):
+    return lon / 360 + 0.5
+
+
+def _lat_to_y(lat):
+    sin = min(max(math.sin(lat * math.pi / 180), -0.9999), 0.9999)
+    y = 0.5 - 0.25 * math.log((1 + sin) / (1 - sin)) / math.pi
+    return min(max(y, 0.0), 1.0)
+
+
+def _x_to_lon(x):
+    return (x - 0.5) * 360
+
+
+def _y_to_lat(y):
+    y2 = (180 - y * 360) * math.pi / 180
+    return 360 * math.atan(math.exp(y2)) / math.pi - 90
+
+
+class _Node:
+    """En punkt eller ett kluster på en viss zoomnivå (koordinater i Web Mercator 0..1)."""
+
+    __slots__ = ("x", "y", "counts", "point_id", "kind")
+
+    def __init__(self, x, y, counts, point_id=None, kind=None):
+        self.x = x
+        self.y = y
+        self.counts = counts
+        self.point_id = point_id  # Bara satt för enskilda punkter.
+        self.kind = kind
+
+    @property
+    def size(self):
+        return sum(self.counts.values())
+
+
+class ClusterIndex:
+    """Klusterhierarki för alla zoomnivåer, byggd en gång per datauppdatering."""
+
+    def __init__(self, radius_px=CLUSTER_RADIUS_PX, extent_px=TILE_EXTENT_PX, min_zoom=MIN_ZOOM, max_zoom=MAX_ZOOM):
+        self.radius_px = radius_px
+        self.extent_px = extent_px
+        self.min_zoom = min_zoom
+        self.max_zoom = max_zoom
+        self.version = None
+        self._levels = {}
+
+    def load(self, points, version=None):
+        """
+        `points` är en lista med (lon, lat, kategori, Id, typ) där typ är 'deviation' eller 'camera'.
+        Bygger alla nivåer och ersätter den tidigare hierarkin.
+        """
+        nodes = []
+        for lon, lat, category, point_id, kind in points:
+            counts = dict.fromkeys(CATEGORIES, 0)
+            counts[category] += 1
+            nodes.append(_Node(_lon_to_x(lon), _lat_to_y(lat), counts, point_id, kind))
+
+        levels = {self.max_zoom + 1: self._index_level(nodes, self.max_zoom + 1)}
+        for zoom in range(self.max_zoom, self.min_zoom - 1, -1):
+            nodes = self._cluster(nodes, zoom)
+            levels[zoom] = self._index_level(nodes, zoom)
+        self._levels = levels
+        self.version = version
+
+    def _cluster(self, nodes, zoom):
+        # Sökradie i Mercator-enheter på denna zoomnivå. Närliggande noder hittas via ett
+        # rutnät med cellstorlek = radien, så bara de 3x3 närmaste cellerna behöver jämföras.
+        radius = self.radius_px / (self.extent_px * 2 ** zoom)
+        buckets = defaultdict(list)
+        for i, node in enumerate(nodes):
+            buckets[(int(node.x / radius), int(node.y / radius))].append(i)
+
+        visited = [False] * len(nodes)
+        clustered = []
+        radius_sq = radius * radius
+        for i, node in enumerate(nodes):
+            if visited[i]:
+                continue
+            visited[i] = True
+            cx, cy = int(node.x / radius), int(node.y / radius)
+            members = [node]
+            for dx in (-1, 0, 1):
+                for dy in (-1, 0, 1):
+                    for j in buckets.get((cx + dx, cy + dy), ()):
+                        if visited[j]:
+                            continue
+                        other = nodes[j]
+                        if (other.x - node.x) ** 2 + (other.y - node.y) ** 2 <= radius_sq:
+                            visited[j] = True
+                            members.append(other)
+            if len(members) == 1:
+                clustered.append(node)
+                continue
+            # Klustrets position är det viktade medelvärdet av medlemmarna.
+            total = sum(m.size for m in members)
+            counts = dict.fromkeys(CATEGORIES, 0)
+            for m in members:
+                for category, count in m.counts.items():
+                    counts[category] += count
+            clustered.append(_Node(
+                sum(m.x * m.size for m in members) / total,
+                sum(m.y * m.size for m in members) / total,
+                counts,
+            ))
+        return clustered
+
+    def _index_level(self, nodes, zoom):
+        # Cellstorlek som motsvarar ungefär en tile på denna nivå.
+        tile_degrees = 360 / 2 ** min(zoom, 12)
+        grid = GridIndex(cell_size=(tile_degrees, tile_degrees / 2))
+        features, entries = [], []
+        for i, node in enumerate(nodes):
+            lon, lat = _x_to_lon(node.x), _y_to_lat(node.y)
+            entries.append((i, (lon, lat, lon, lat)))
+            features.append(self._feature(node, lon, lat))
+        grid.insert_many(entries)
+        return grid, features
+
+    def _feature(self, node, lon, lat):
+        position = [round(lon, 5), round(lat, 5)]
+        if node.point_id is not None:
+            properties = {"cluster": False, "id": node.point_id, "kind": node.kind, "count": 1}
+            properties.update(node.counts)
+            return {"type": "Feature", "geometry": {"type": "Point", "coordinates": position}, "properties": properties}
+        properties = {"cluster": True, "count": node.size}
+        properties.update(node.counts)
+        return {"type": "Feature", "geometry": {"type": "Point", "coordinates": position}, "properties": properties}
+
+    def get_clusters(self, bbox, zoom):
+        """Returnerar GeoJSON-features (kluster och enskilda punkter) inom `bbox` för en zoomnivå."""
+        zoom = max(self.min_zoom, min(int(zoom), self.max_zoom + 1))
+        level = self._levels.get(zoom)
+        if level is None:
+            return []
+        grid, features = level
+        return [features[i] for i in sorted(grid.query(bbox))]
+
+
+def snapshot_cluster_points(snapshot, geometry_cache):
+    """Plockar ut en position per deviation och kamera i en TrafficSnapshot, för ClusterIndex.load."""
+    objects = [("deviation", d) for d in snapshot.deviations.values()]
+    objects += [("camera", c) for c in snapshot.cameras.values()]
+    geometries = geometry_cache.get_many([geometry_item(kind, obj) for kind, obj in objects])
+
+    points = []
+    for (kind, obj), geometry in zip(objects, geometries):
+        position = representative_position(geometry)
+        if position is None:
+            continue
+        category = "camera" if kind == "camera" else deviation_category(obj)
+        points.append((position[0], position[1], category, obj.get("Id"), kind))
+    return points
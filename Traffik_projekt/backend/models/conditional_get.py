@@ -0,0 +1,71 @@
+# models/conditional_get.py
+
+# Villkorliga GET-förfrågningar (ETag / If-None-Match) för trafik-endpoints.
+# ETag:en räknas fram ur datan (senaste VersionTime och vilka Id:n som ingår) i stället för
+# ur den kodade svarskroppen, så en klient som redan har svaret får 304 utan att något kodas.
+
+import hashlib
+import json
+
+from flask import Response, request
+
+from models.traffic_store import parse_trafikverket_time
+
+
+def dataset_etag(deviations, cameras=(), variant=()):
+    """
+    Stark validator för en mängd deviations och kameror. Trafikverket sätter ny VersionTime
+    vid varje ändring, så senaste VersionTime plus mängden Id:n räcker för deviations.
+    Kameror saknar VersionTime och hashas på alla sina fält, så att t.ex. ett nytt namn eller
+    en ny hastighetsgräns ger ny ETag. `variant` ska innehålla allt annat som påverkar
+    svarskroppen (län, typer, format, fält ...).
+    """
+    digest = hashlib.sha1(repr(variant).encode("utf-8"))
+    latest = max((parse_trafikverket_time(d.get("VersionTime")) or 0 for d in deviations), default=0)
+    digest.update(repr(latest).encode("utf-8"))
+    for dev_id in sorted(str(d.get("Id")) for d in deviations):
+        digest.update(dev_id.encode("utf-8"))
+        digest.update(b"\0")
+    for camera in sorted(cameras, key=lambda c: str(c.get("Id"))):
+        digest.update(json.dumps(camera, sort_keys=True, ensure_ascii=False, default=str).encode("utf-8"))
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+
+def response_etag(response_data, variant=()):
+    """dataset_etag för ett svar i Trafikverkets format (RESPONSE.RESULT[].Situation[].Deviation[])."""
+    deviations, cameras = [], []
+    for result in response_data.get("RESPONSE", {}).get("RESULT", []):
+        for situation in result.get("Situation", []):
+            deviation_list = situation.get("Deviation", [])
+            deviations.extend(deviation_list if isinstance(deviation_list, list) else [deviation_list])
+        cameras.extend(result.get("TrafficSafetyCamera", []))
+    return dataset_etag(deviations, cameras, variant)
+
+
+def cache_control(max_age, stale_seconds=0):
+    """
+    Cache-Control för delade cachar (CDN) och webbläsare. Svaret skickas med Age, så max-age är
+    datans hela livslängd (t.ex. inhämtningsintervallet) – cachen drar själv av åldern.
+    """
+    value = f"public, max-age={max(0, int(max_age))}"
+    if stale_seconds:
+        value += f", stale-while-revalidate={int(stale_seconds)}"
+    return value
+
+
+def conditional_response(etag, render, mimetype, max_age, stale_seconds=0, age=None):
+    """
+    Returnerar 304 Not Modified om klientens If-None-Match matchar `etag`, annars 200 med
+    kroppen från `render` (en sträng eller en funktion som returnerar en). Båda svaren får
+    ETag, Cache-Control och Age.
+    """
+    if request.if_none_match.contains_weak(etag):
+        response = Response(status=304)
+    else:
+        response = Response(render() if callable(render) else render, mimetype=mimetype)
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = cache_control(max_age, stale_seconds)
+    if age is not None:
+        response.headers['Age'] = str(int(age))
+    return response
@@ -0,0 +1,136 @@
+# models/field_projection.py
+
+# Fältprojektion för /api/traffic-info: vilka fält en klient vill ha (via profile= eller fields=),
+# vilka INCLUDE-rader som då behövs i Situation-frågan till Trafikverket, och ett platt svarsschema
+# ({"deviations": [...], "cameras": [...]}) i stället för Trafikverkets nästlade RESPONSE-träd.
+
+from models.geometry import geometry_cache, geometry_item, representative_position
+
+# Fält som kan väljas för deviations. Namnen är desamma som i Trafikverkets svar, utom de
+# två geometrifälten som ersätter Geometry: Position ([lon, lat]) och Line ([[lon, lat], ...]).
+DEVIATION_FIELDS = (
+    "Id", "Header", "CreationTime", "CountyNo", "LocationDescriptor", "RoadNumber", "RoadName",
+    "PositionalDescription", "MessageType", "MessageTypeValue", "IconId", "StartTime", "EndTime",
+    "Message", "AffectedDirection", "SeverityText", "TemporaryLimit", "ValidUntilFurtherNotice",
+    "WebLink", "NumberOfLanesRestricted", "TrafficRestrictionType", "VersionTime",
+    "Position", "Line",
+)
+CAMERA_FIELDS = ("Id", "Name", "CountyNo", "IconId", "Bearing", "Position")
+
+# Fördefinierade urval som motsvarar kartans två lägen i Map.js.
+PROFILES = {
+    # Bannerläget visar bara rubrik, typ och län i popupen.
+    "banner": (
+        ("Id", "Header", "MessageType", "MessageTypeValue", "CountyNo", "IconId", "Position"),
+        ("Id", "Name", "CountyNo", "IconId", "Position"),
+    ),
+    # Utökat läge visar alla detaljer, inklusive linjen för händelser som sträcker sig längs en väg.
+    "expanded": (
+        ("Id", "Header", "MessageType", "MessageTypeValue", "CountyNo", "IconId", "Message",
+         "SeverityText", "RoadNumber", "RoadName", "LocationDescriptor", "AffectedDirection",
+         "StartTime", "EndTime", "ValidUntilFurtherNotice", "WebLink", "VersionTime", "Position", "Line"),
+        CAMERA_FIELDS,
+    ),
+}
+
+# Geometrin hämtas bara i SWEREF99TM; WGS84 räknas fram lokalt (se models/reprojection.py).
+# Punkt och linje hämtas alltid tillsammans: Position faller tillbaka på linjen, och geometricachen
+# nycklas per deviation så en ofullständig geometri får inte hamna där.
+_DEVIATION_GEOMETRY_INCLUDES = ["Deviation.Geometry.Point.SWEREF99TM", "Deviation.Geometry.Line.SWEREF99TM"]
+_GEOMETRY_FIELDS = ("Position", "Line")
+
+
+def resolve_fields(profile=None, fields=None):
+    """
+    Returnerar (deviation-fält, kamera-fält) som tupler för en profil och/eller en kommaseparerad
+    fältlista. `fields` har företräde framför `profile` och gäller både deviations och kameror
+    (okända fält för kameror ignoreras). Id tas alltid med. Kastar ValueError vid okänd profil
+    eller okända fält.
+    """
+    if fields:
+        requested = [f.strip() for f in fields.split(",") if f.strip()]
+        unknown = [f for f in requested if f not in DEVIATION_FIELDS and f not in CAMERA_FIELDS]
+        if unknown:
+            raise ValueError(f"Unknown fields: {', '.join(unknown)}")
+        requested = set(requested) | {"Id"}
+        return (
+            tuple(f for f in DEVIATION_FIELDS if f in requested),
+            tuple(f for f in CAMERA_FIELDS if f in requested),
+        )
+    if profile not in PROFILES:
+        raise ValueError(f"Unknown profile '{profile}'")
+    return PROFILES[profile]
+
+
+def deviation_includes(deviation_fields):
+    """
+    INCLUDE-rader för Situation-frågan. VersionTime tas alltid med eftersom geometricachen
+    nycklas på den.
+    """
+    includes = [f"Deviation.{field}" for field in deviation_fields if field not in _GEOMETRY_FIELDS]
+    if any(field in _GEOMETRY_FIELDS for field in deviation_fields):
+        includes += _DEVIATION_GEOMETRY_INCLUDES
+    if "VersionTime" not in deviation_fields:
+        includes.append("Deviation.VersionTime")
+    return includes
+
+
+def with_geometry(projection):
+    """Lägger till Position och Line för deviations, för svar som behöver geometrin (bbox, GeoJSON)."""
+    deviation_fields, camera_fields = projection
+    return deviation_fields + tuple(f for f in _GEOMETRY_FIELDS if f not in deviation_fields), camera_fields
+
+
+def _project(obj, fields, geometry):
+    projected = {}
+    for field in fields:
+        if field == "Position":
+            position = representative_position(geometry)
+            if position is not None:
+                projected["Position"] = position
+        elif field == "Line":
+            line = _line_coordinates(geometry)
+            if line:
+                projected["Line"] = line
+        elif field in obj:
+            projected[field] = obj[field]
+    return projected
+
+
+def _line_coordinates(geometry):
+    if not geometry:
+        return None
+    if geometry["type"] == "LineString":
+        return geometry["coordinates"]
+    for part in geometry.get("geometries", []):
+        if part["type"] == "LineString":
+            return part["coordinates"]
+    return None
+
+
+def build_flat_response(response_data, deviation_fields, camera_fields, cache=None):
+    """
+    Plattar ut ett svar i Trafikverkets format till {"deviations": [...], "cameras": [...]} med
+    bara de valda fälten. Position är punkten om den finns, annars linjens första koordinat.
+    Fält som saknas på ett objekt utelämnas i stället för att skickas som null.
+    """
+    cache = cache or geometry_cache
+    deviations, cameras = [], []
+    for result in response_data.get("RESPONSE", {}).get("RESULT", []):
+        for situation in result.get("Situation", []):
+            deviation_list = situation.get("Deviation", [])
+            deviations.extend(deviation_list if isinstance(deviation_list, list) else [deviation_list])
+        cameras.extend(result.get("TrafficSafetyCamera", []))
+
+    # Geometrier behöver bara slås upp om något geometrifält är valt.
+    deviation_geometries = [None] * len(deviations)
+    if "Position" in deviation_fields or "Line" in deviation_fields:
+        deviation_geometries = cache.get_many([geometry_item("deviation", d) for d in deviations])
+    camera_geometries = [None] * len(cameras)
+    if "Position" in camera_fields:
+        camera_geometries = cache.get_many([geometry_item("camera", c) for c in cameras])
+
+    return {
+        "deviations": [_project(d, deviation_fields, g) for d, g in zip(deviations, deviation_geometries)],
+        "cameras": [_project(c, camera_fields, g) for c, g in zip(cameras, camera_geometries)],
+    }
@@ -0,0 +1,214 @@
+# models/geometry.py
+
+# Parsning av Trafikverkets WKT-geometrier (POINT/LINESTRING i WGS84) och uppbyggnad av
+# kompakt GeoJSON. Geometrier parsas en gång på servern och cachas per deviation, så att
+# varken webbläsaren eller nästa förfrågan behöver parsa samma WKT-sträng igen.
+
+import logging
+import re
+import threading
+
+# Antal decimaler i GeoJSON-koordinaterna (5 decimaler ≈ 1 meter).
+COORDINATE_PRECISION = 5
+
+LINESTRING_PATTERN = re.compile(r'LINESTRING\s*\((.*)\)', re.IGNORECASE | re.DOTALL)
+COORDINATE_PAIR_PATTERN = re.compile(r'(-?\d+\.?\d*)\s+(-?\d+\.?\d*)')
+
+# Helperfunktion för att parsa WKT (Well-Known Text) POINT-strängar.
+# WKT är ett textbaserat format för att representera geografiska objekt.
+def parse_wgs84_point(wkt_string):
+    """
+    Parsar en WKT POINT-sträng (t.ex. "POINT (lon lat)") och returnerar koordinaterna
+    som en lista [lat, lon] som Leaflet (och många andra kartbibliotek) förväntar sig.
+    Validerar även koordinaternas intervall.
+    """
+    if not wkt_string or not isinstance(wkt_string, str):
+        return None
+    # Använder reguljära uttryck för att hitta numeriska värden inom parenteserna.
+    match = re.search(r'POINT\s*\(\s*(-?\d+\.?\d*)\s+(-?\d+\.?\d*)\s*\)', wkt_string.strip(), re.IGNORECASE)
+    if match:
+        try:
+            lon = float(match.group(1)) # Longitud är det första värdet i WKT POINT.
+            lat = float(match.group(2)) # Latitud är det andra värdet.
+            # Validerar att koordinaterna ligger inom giltiga intervall.
+            if -90 <= lat <= 90 and -180 <= lon <= 180:
+                return [lat, lon]  # Returnerar [lat, lon] som Leaflet behöver.
+            else:
+                logging.warning(f"Parsed WGS84 coordinates out of bounds: Lat {lat}, Lon {lon}")
+                return None
+        except ValueError:
+            logging.warning(f"Could not convert WGS84 POINT coordinates to float: {wkt_string}")
+            return None
+        except Exception as e:
+            logging.error(f"Unexpected error parsing WGS84 POINT {wkt_string}: {e}")
+            return None
+    else:
+        # Loggar en varning om strängen inte matchar förväntat format.
+        if wkt_string.strip() and not wkt_string.strip().upper().startswith("POINT"):
+            logging.warning(f"WGS84 WKT string did not match expected POINT format: {wkt_string}")
+        return None
+
+def parse_wgs84_linestring(wkt_string):
+    """
+    Parsar en WKT LINESTRING-sträng (t.ex. "LINESTRING (lon lat, lon lat, ...)") och returnerar
+    en lista med [lat, lon]-par. Par utanför giltiga intervall hoppas över.
+    """
+    if not wkt_string or not isinstance(wkt_string, str):
+        return None
+    match = LINESTRING_PATTERN.search(wkt_string.strip())
+    if not match:
+        if wkt_string.strip() and not wkt_string.strip().upper().startswith("LINESTRING"):
+            logging.warning(f"WGS84 WKT string did not match expected LINESTRING format: {wkt_string[:200]}")
+        return None
+    coordinates = []
+    # Alla koordinatpar i linjen hittas med ett enda findall-anrop.
+    for lon_str, lat_str in COORDINATE_PAIR_PATTERN.findall(match.group(1)):
+        lon, lat = float(lon_str), float(lat_str)
+        if -90 <= lat <= 90 and -180 <= lon <= 180:
+            coordinates.append([lat, lon])
+        else:
+            logging.warning(f"Parsed WGS84 line coordinate out of bounds: Lat {lat}, Lon {lon}")
+    return coordinates or None
+
+
+def _to_geojson_position(lat_lon):
+    # GeoJSON använder ordningen [lon, lat], till skillnad från Leaflet.
+    return [round(lat_lon[1], COORDINATE_PRECISION), round(lat_lon[0], COORDINATE_PRECISION)]
+
+
+def _parse_geojson_geometry(point_wkt, line_wkt):
+    """Gör om WKT-punkt och/eller WKT-linje till ett GeoJSON-geometriobjekt (eller None)."""
+    geometries = []
+    point = parse_wgs84_point(point_wkt) if point_wkt else None
+    if point:
+        geometries.append({"type": "Point", "coordinates": _to_geojson_position(point)})
+    line = parse_wgs84_linestring(line_wkt) if line_wkt else None
+    if line:
+        geometries.append({"type": "LineString", "coordinates": [_to_geojson_position(p) for p in line]})
+
+    if not geometries:
+        return None
+    if len(geometries) == 1:
+        return geometries[0]
+    return {"type": "GeometryCollection", "geometries": geometries}
+
+
+def representative_position(geometry):
+    """
+    Returnerar en [lon, lat]-position för en GeoJSON-geometri: punkten om den finns, annars
+    linjens första koordinat (samma val som kartan i Map.js gör). None om geometri saknas.
+    """
+    if not geometry:
+        return None
+    if geometry["type"] == "Point":
+        return geometry["coordinates"]
+    if geometry["type"] == "LineString":
+        return geometry["coordinates"][0] if geometry["coordinates"] else None
+    for part in geometry.get("geometries", []):
+        position = representative_position(part)
+        if position is not None:
+            return position
+    return None
+
+
+def _deviation_wkt(deviation):
+    geometry = deviation.get("Geometry") or {}
+    return (geometry.get("Point") or {}).get("WGS84"), (geometry.get("Line") or {}).get("WGS84")
+
+
+def _camera_wkt(camera):
+    return (camera.get("Geometry") or {}).get("WGS84"), None
+
+
+class GeometryCache:
+    """
+    Cache för parsade geometrier. Deviations nycklas på (Id, VersionTime) så att en ändrad
+    deviation parsas om, medan oförändrade aldrig parsas två gånger. Kameror saknar VersionTime
+    och nycklas i stället på (Id, WKT-strängen).
+    """
+
+    def __init__(self, max_entries=50000):
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._geometries = {}
+
+    def get_many(self, items):
+        """
+        `items` är en lista med (nyckel, punkt-WKT, linje-WKT). Returnerar en lista med
+        GeoJSON-geometrier i samma ordning. Alla geometrier som saknas i cachen parsas i
+        en och samma omgång innan resultatet sätts ihop.
+        """
+        with self._lock:
+            cached = [self._geometries.get(key, _MISSING) for key, _, _ in items]
+
+        missing = [(i, item) for i, item in enumerate(items) if cached[i] is _MISSING]
+        if missing:
+            parsed = {key: _parse_geojson_geometry(point_wkt, line_wkt) for _, (key, point_wkt, line_wkt) in missing}
+            with self._lock:
+                if len(self._geometries) + len(parsed) > self.max_entries:
+                    self._geometries.clear()
+                self._geometries.update(parsed)
+            for i, (key, _, _) in missing:
+                cached[i] = parsed[key]
+        return cached
+
+    def retain(self, keys):
+        """Tar bort alla poster vars nyckel inte finns i `keys` (t.ex. borttagna deviations)."""
+        keys = set(keys)
+        with self._lock:
+            self._geometries = {key: geometry for key, geometry in self._geometries.items() if key in keys}
+
+    def __len__(self):
+        return len(self._geometries)
+
+
+_MISSING = object()
+
+# Delad geometricache för hela processen.
+geometry_cache = GeometryCache()
+
+
+def geometry_item(kind, obj):
+    """Returnerar (cachenyckel, punkt-WKT, linje-WKT) för en deviation eller kamera."""
+    if kind == "deviation":
+        point_wkt, line_wkt = _deviation_wkt(obj)
+        return ("deviation", obj.get("Id"), obj.get("VersionTime")), point_wkt, line_wkt
+    point_wkt, line_wkt = _camera_wkt(obj)
+    return ("camera", obj.get("Id"), point_wkt), point_wkt, line_wkt
+
+
+def snapshot_geometry_keys(snapshot):
+    """Returnerar geometricachens nycklar för alla objekt i en TrafficSnapshot."""
+    keys = [geometry_item("deviation", d)[0] for d in snapshot.deviations.values()]
+    keys += [geometry_item("camera", c)[0] for c in snapshot.cameras.values()]
+    return keys
+
+
+def build_feature_collection(response_data, cache=None, deviation_fields=None, camera_fields=None):
+    """
+    Bygger en kompakt GeoJSON FeatureCollection av ett svar i Trafikverkets format
+    (RESPONSE.RESULT[].Situation[].Deviation[] och RESPONSE.RESULT[].TrafficSafetyCamera[]).
+    Geometrin ersätts av numeriska koordinater; övriga fält ligger kvar i `properties`,
+    eller bara de i `deviation_fields`/`camera_fields` om de anges.
+    """
+    cache = cache or geometry_cache
+    deviations, cameras = [], []
+    for result in response_data.get("RESPONSE", {}).get("RESULT", []):
+        for situation in result.get("Situation", []):
+            deviation_list = situation.get("Deviation", [])
+            deviations.extend(deviation_list if isinstance(deviation_list, list) else [deviation_list])
+        cameras.extend(result.get("TrafficSafetyCamera", []))
+
+    items = [geometry_item("deviation", d) for d in deviations] + [geometry_item("camera", c) for c in cameras]
+    geometries = cache.get_many(items)
+
+    features = []
+    for obj, kind, geometry in zip(deviations + cameras, ["deviation"] * len(deviations) + ["camera"] * len(cameras), geometries):
+        fields = deviation_fields if kind == "deviation" else camera_fields
+        if fields is None:
+            properties = {key: value for key, value in obj.items() if key != "Geometry"}
+        else:
+            properties = {key: obj[key] for key in fields if key in obj and key != "Geometry"}
+        properties["kind"] = kind
+        features.append({"type": "Feature", "id": obj.get("Id"), "geometry": geometry, "properties": properties})
+    return {"type": "FeatureCollection", "features": features}
@@ -0,0 +1,273 @@
+# models/metrics.py
+
+# Enkel mätning av svarstider i Prometheus-format. Varje inkommande förfrågan tidmäts från
+# before_request till after_request, och varje utgående anrop (Supabase, Trafikverket, Stripe,
+# SMS/e-post) tidmäts separat och märks med den blueprint och endpoint som gjorde anropet.
+# Allt hålls i minnet; en observation kostar ett låsanrop och en binärsökning bland hinkarna.
+
+import bisect
+import hmac
+import os
+import re
+import threading
+import time
+import weakref
+from contextlib import contextmanager
+from urllib.parse import urlsplit
+
+from flask import Response, abort, g, has_request_context, request
+
+# Token som krävs för att läsa /metrics (Authorization: Bearer <token>). Utan token är
+# endpointen avstängd och svarar 404.
+METRICS_TOKEN = os.getenv("METRICS_TOKEN")
+
+# Hinkgränser i sekunder, från snabba minnesuppslag till långsamma externa anrop.
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names, values, extra=()):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    pairs += [f'{name}="{_escape(value)}"' for name, value in extra]
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def inc(self, amount=1, **labels):
+        key = tuple(str(labels.get(name, "")) for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            items = sorted(self._values.items())
+        for key, value in items:
+            lines.append(f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._lock = threading.Lock()
+        self._series = {}  # etiketter -> [antal per hink (+Inf sist), summa, antal]
+
+    def observe(self, value, **labels):
+        key = tuple(str(labels.get(name, "")) for name in self.labelnames)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            items = sorted((key, (list(s[0]), s[1], s[2])) for key, s in self._series.items())
+        for key, (counts, total, count) in items:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += bucket_count
+                labels = _format_labels(self.labelnames, key, [("le", _format_value(float(bound)))])
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labelnames, key)} {_format_value(total)}")
+            lines.append(f"{self.name}_count{_format_labels(self.labelnames, key)} {count}")
+        return lines
+
+
+REQUEST_DURATION = Histogram(
+    "http_request_duration_seconds", "Time spent handling incoming HTTP requests.",
+    ("blueprint", "endpoint", "method", "status"),
+)
+REQUESTS_TOTAL = Counter(
+    "http_requests_total", "Incoming HTTP requests.",
+    ("blueprint", "endpoint", "method", "status"),
+)
+UPSTREAM_DURATION = Histogram(
+    "upstream_request_duration_seconds", "Time spent in outbound calls, per upstream service and operation.",
+    ("service", "operation", "blueprint", "endpoint"),
+)
+UPSTREAM_ERRORS = Counter(
+    "upstream_errors_total", "Outbound calls that raised or returned a 5xx status.",
+    ("service", "operation", "blueprint", "endpoint"),
+)
+UPSTREAM_RETRIES = Counter(
+    "upstream_retries_total", "Outbound calls retried after a transient failure (see models/upstream.py).",
+    ("service", "operation"),
+)
+
+REGISTRY = [REQUEST_DURATION, REQUESTS_TOTAL, UPSTREAM_DURATION, UPSTREAM_ERRORS, UPSTREAM_RETRIES]
+
+
+def render_metrics():
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+def _caller_labels():
+    # Inom en förfrågan: blueprint och endpoint. Annars (bakgrundstrådar): trådens namn.
+    if has_request_context():
+        return request.blueprint or "app", request.endpoint or "unmatched"
+    return "background", threading.current_thread().name
+
+
+@contextmanager
+def time_upstream(service, operation):
+    """
+    Tidmäter ett utgående anrop:
+
+        with time_upstream("trafikverket", "Situation"):
+            response = requests.post(...)
+    """
+    blueprint, endpoint = _caller_labels()
+    started = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        UPSTREAM_ERRORS.inc(service=service, operation=operation, blueprint=blueprint, endpoint=endpoint)
+        raise
+    finally:
+        UPSTREAM_DURATION.observe(
+            time.perf_counter() - started,
+            service=service, operation=operation, blueprint=blueprint, endpoint=endpoint,
+        )
+
+
+def _httpx_operation(http_request):
+    # T.ex. "GET /rest/v1/users" eller "POST /auth/v1/token". Filter ligger i query-strängen,
+    # så sökvägen har begränsat antal värden (tabellnamn och auth-endpoints).
+    return f"{http_request.method} {http_request.url.path}"
+
+
+def _httpx_hooks(service):
+    def on_request(http_request):
+        http_request.metrics_started = time.perf_counter()
+
+    def on_response(http_response):
+        http_request = http_response.request
+        started = getattr(http_request, "metrics_started", None)
+        if started is None:
+            return
+        blueprint, endpoint = _caller_labels()
+        operation = _httpx_operation(http_request)
+        UPSTREAM_DURATION.observe(
+            time.perf_counter() - started,
+            service=service, operation=operation, blueprint=blueprint, endpoint=endpoint,
+        )
+        if http_response.status_code >= 500:
+            UPSTREAM_ERRORS.inc(service=service, operation=operation, blueprint=blueprint, endpoint=endpoint)
+
+    return on_request, on_response
+
+
+# httpx-klienter som redan har tidmätning, så att hooks inte läggs till två gånger.
+_instrumented_clients = weakref.WeakSet()
+
+
+def instrument_httpx_client(http_client, service):
+    """Lägger till tidmätning på en httpx-klient via dess event hooks (tid till svarshuvuden)."""
+    if http_client in _instrumented_clients:
+        return http_client
+    _instrumented_clients.add(http_client)
+    on_request, on_response = _httpx_hooks(service)
+    hooks = http_client.event_hooks
+    hooks["request"] = list(hooks.get("request", [])) + [on_request]
+    hooks["response"] = list(hooks.get("response", [])) + [on_response]
+    http_client.event_hooks = hooks
+    return http_client
+
+
+def instrument_supabase(client, service="supabase"):
+    """
+    Tidmäter alla tabellfrågor och rpc-anrop som görs via en Supabase-klient, med event hooks
+    på PostgREST-klientens httpx-session (client.postgrest.session). Klienten skapar en ny
+    PostgREST-klient vid in- och utloggning; en egen lyssnare på auth-händelserna, som körs
+    efter klientens, instrumenterar den nya. Bara publika delar av supabase-py används, så
+    auth-anropen fångas inte här (auth-klienten exponerar inte sin httpx-klient); de tidmäts
+    i stället där de görs, med time_upstream("supabase", "auth.<metod>").
+    """
+    instrument_httpx_client(client.postgrest.session, service)
+
+    def on_auth_state_change(event, session):
+        instrument_httpx_client(client.postgrest.session, service)
+
+    client.auth.on_auth_state_change(on_auth_state_change)
+    return client
+
+
+# Stripe-Id:n i sökvägen (t.ex. /v1/subscriptions/sub_1N...) byts mot {id} för att hålla nere antalet etiketter.
+STRIPE_ID_PATTERN = re.compile(r"/[a-z]+_[A-Za-z0-9]+")
+
+
+def instrument_stripe(stripe_module, service="stripe"):
+    """Tidmäter alla anrop från stripe-biblioteket genom att sätta en instrumenterad standardklient."""
+    http_client = stripe_module.new_default_http_client(
+        verify_ssl_certs=stripe_module.verify_ssl_certs, proxy=stripe_module.proxy
+    )
+    request_with_retries = http_client.request_with_retries
+
+    def timed_request_with_retries(method, url, *args, **kwargs):
+        operation = f"{method.upper()} {STRIPE_ID_PATTERN.sub('/{id}', urlsplit(url).path)}"
+        with time_upstream(service, operation):
+            return request_with_retries(method, url, *args, **kwargs)
+
+    http_client.request_with_retries = timed_request_with_retries
+    stripe_module.default_http_client = http_client
+    return http_client
+
+
+def install_request_metrics(app):
+    """
+    Tidmäter varje förfrågan i `app` och lägger till endpointen /metrics, som kräver
+    METRICS_TOKEN (svarar 404 om token saknas eller är fel).
+    """
+
+    @app.before_request
+    def _start_request_timer():
+        g.metrics_started = time.perf_counter()
+
+    @app.after_request
+    def _observe_request(response):
+        started = g.pop("metrics_started", None)
+        if started is not None:
+            labels = {
+                "blueprint": request.blueprint or "app",
+                "endpoint": request.endpoint or "unmatched",
+                "method": request.method,
+                "status": response.status_code,
+            }
+            REQUEST_DURATION.observe(time.perf_counter() - started, **labels)
+            REQUESTS_TOTAL.inc(**labels)
+        return response
+
+    @app.route("/metrics")
+    def metrics():
+        supplied = request.headers.get("Authorization", "")
+        if not METRICS_TOKEN or not hmac.compare_digest(supplied.encode("utf-8"), f"Bearer {METRICS_TOKEN}".encode("utf-8")):
+            abort(404)
+        return Response(render_metrics(), mimetype="text/plain; version=0.0.4")
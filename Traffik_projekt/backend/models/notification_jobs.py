@@ -0,0 +1,160 @@
+# models/notification_jobs.py
+
+# Bakgrundsjobb för notisutskicken. /api/send_sms_for_deviation och /api/send_email_for_deviation
+# validerar anropet, lägger upp ett jobb och svarar 202 direkt; mottagaruppslagningen och
+# utskicket görs av en trådpool i bakgrunden. Jobbens status och förlopp (mottagare, skickade,
+# misslyckade) sparas i en SQLite-fil, så att /api/notification-jobs/<id> kan besvaras av vilken
+# gunicorn-arbetare som helst på samma maskin.
+#
+# Ett anrop för en händelse som redan har ett pågående jobb i samma kanal får det jobbets id i
+# stället för ett nytt jobb, så omförsök från pollern eller frontend dubblar inte arbetet.
+
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from models.app_dirs import data_dir, ensure_private_dir
+
+# Var jobben sparas (på beständig disk, se INSTALLATION.md), antal jobb som körs samtidigt och
+# hur länge klara jobb sparas (sekunder).
+NOTIFY_JOBS_PATH = os.getenv("NOTIFY_JOBS_PATH", os.path.join(data_dir(), "notification_jobs.sqlite3"))
+NOTIFY_JOB_WORKERS = int(os.getenv("NOTIFY_JOB_WORKERS", "4"))
+NOTIFY_JOB_MAX_AGE_SECONDS = float(os.getenv("NOTIFY_JOB_MAX_AGE_SECONDS", str(24 * 60 * 60)))
+# Ett pågående jobb som inte har uppdaterats på så här länge (t.ex. för att processen startades
+# om) räknas inte längre som pågående, och ett nytt anrop får ett nytt jobb.
+NOTIFY_JOB_STALE_SECONDS = float(os.getenv("NOTIFY_JOB_STALE_SECONDS", "600"))
+
+QUEUED, RUNNING, DONE, FAILED = "queued", "running", "done", "failed"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS notification_jobs (
+    id TEXT PRIMARY KEY,
+    channel TEXT NOT NULL,
+    dev_id TEXT NOT NULL,
+    county_no TEXT NOT NULL,
+    status TEXT NOT NULL,
+    resolved INTEGER,
+    sent INTEGER NOT NULL DEFAULT 0,
+    failed INTEGER NOT NULL DEFAULT 0,
+    message TEXT,
+    error TEXT,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS notification_jobs_active ON notification_jobs (channel, dev_id, status);
+"""
+
+COLUMNS = ("id", "channel", "dev_id", "county_no", "status", "resolved", "sent", "failed",
+           "message", "error", "created_at", "updated_at")
+
+
+class NotificationJobs:
+    """
+    Jobbregister och trådpool för notisutskick. Ett jobb är en dict: {"id", "channel",
+    "devId", "countyNo", "status", "resolved", "sent", "failed", "message", "error",
+    "createdAt", "updatedAt"}. "resolved" är None tills mottagarna har hämtats.
+    """
+
+    def __init__(self, path=NOTIFY_JOBS_PATH, workers=NOTIFY_JOB_WORKERS, clock=time.time):
+        self.path = path
+        self.clock = clock
+        if path != ":memory:":
+            ensure_private_dir(path)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=10)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(SCHEMA)
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="notification-job")
+
+    def _row(self, job_id):
+        row = self._conn.execute(
+            f"SELECT {', '.join(COLUMNS)} FROM notification_jobs WHERE id = ?", (job_id,)
+        ).fetchone()
+        if row is None:
+            return None
+        job = dict(zip(COLUMNS, row))
+        return {
+            "id": job["id"],
+            "channel": job["channel"],
+            "devId": job["dev_id"],
+            "countyNo": job["county_no"],
+            "status": job["status"],
+            "resolved": job["resolved"],
+            "sent": job["sent"],
+            "failed": job["failed"],
+            "message": job["message"],
+            "error": job["error"],
+            "createdAt": job["created_at"],
+            "updatedAt": job["updated_at"],
+        }
+
+    def get(self, job_id):
+        with self._lock:
+            return self._row(job_id)
+
+    def create(self, channel, dev_id, county_no):
+        """
+        Lägger upp ett köat jobb. Returnerar (jobb, True), eller (pågående jobb, False) om
+        händelsen redan har ett jobb i kanalen som inte är klart.
+        """
+        now = self.clock()
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._conn.execute(
+                    "DELETE FROM notification_jobs WHERE status IN (?, ?) AND updated_at < ?",
+                    (DONE, FAILED, now - NOTIFY_JOB_MAX_AGE_SECONDS),
+                )
+                active = self._conn.execute(
+                    "SELECT id FROM notification_jobs WHERE channel = ? AND dev_id = ? AND status IN (?, ?) "
+                    "AND updated_at >= ? ORDER BY created_at DESC LIMIT 1",
+                    (channel, str(dev_id), QUEUED, RUNNING, now - NOTIFY_JOB_STALE_SECONDS),
+                ).fetchone()
+                if active is None:
+                    job_id = uuid.uuid4().hex
+                    self._conn.execute(
+                        "INSERT INTO notification_jobs (id, channel, dev_id, county_no, status, created_at, updated_at) "
+                        "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                        (job_id, channel, str(dev_id), str(county_no), QUEUED, now, now),
+                    )
+                else:
+                    job_id = active[0]
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+            return self._row(job_id), active is None
+
+    def update(self, job_id, **values):
+        """Sätter kolumner (status, resolved, message, error) och updated_at."""
+        values["updated_at"] = self.clock()
+        assignments = ", ".join(f"{column} = :{column}" for column in values)
+        with self._lock:
+            self._conn.execute(f"UPDATE notification_jobs SET {assignments} WHERE id = :id", {**values, "id": job_id})
+
+    def add_progress(self, job_id, sent=0, failed=0):
+        """Räknar upp skickade och misslyckade mottagare (anropas efter varje grupp)."""
+        with self._lock:
+            self._conn.execute(
+                "UPDATE notification_jobs SET sent = sent + ?, failed = failed + ?, updated_at = ? WHERE id = ?",
+                (sent, failed, self.clock(), job_id),
+            )
+
+    def submit(self, job_id, func, *args):
+        """
+        Kör func(job_id, *args) i trådpoolen. Jobbet markeras som pågående när det startar och
+        som misslyckat om func kastar ett undantag; annars sätter func själv slutstatus.
+        """
+        def run():
+            self.update(job_id, status=RUNNING)
+            try:
+                func(job_id, *args)
+            except Exception as e:
+                print(f"Fel i notisjobb {job_id}:", e)
+                self.update(job_id, status=FAILED, error=str(e)[:1000])
+
+        return self._executor.submit(run)
@@ -0,0 +1,186 @@
+# models/outbox.py
+
+# Lokal, beständig kö (outbox) mellan pollerns upptäckt av nya händelser och utskicket av
+# notiser. Pollern lägger ett jobb per händelse i en SQLite-fil och går vidare direkt;
+# separata utskicksarbetare hämtar jobben, skickar och markerar dem som klara. Ett jobb som
+# misslyckas försöks igen med exponentiell väntetid, och efter för många försök flyttas det
+# till död-status (dead letter) i stället för att försökas varje cykel för evigt.
+#
+# Ett hämtat jobb är reserverat i `visibility_timeout` sekunder. Kraschar arbetaren (eller
+# processen) innan jobbet är klart blir det synligt igen och hämtas av en annan arbetare.
+
+import os
+import json
+import sqlite3
+import threading
+import time
+
+from models.app_dirs import data_dir, ensure_private_dir
+
+# Var kön sparas. Filen ska ligga på en beständig disk, så att inga upptäckta händelser tappas
+# vid en omstart eller ny driftsättning (se INSTALLATION.md).
+POLLER_OUTBOX_PATH = os.getenv("POLLER_OUTBOX_PATH", os.path.join(data_dir(), "poller_outbox.sqlite3"))
+# Antal försök innan ett jobb blir dött.
+POLLER_OUTBOX_MAX_ATTEMPTS = int(os.getenv("POLLER_OUTBOX_MAX_ATTEMPTS", "5"))
+# Hur länge (sekunder) ett hämtat jobb är reserverat för arbetaren.
+POLLER_OUTBOX_VISIBILITY_SECONDS = float(os.getenv("POLLER_OUTBOX_VISIBILITY_SECONDS", "180"))
+# Väntetid före första omförsöket; fördubblas per försök upp till max.
+POLLER_OUTBOX_RETRY_SECONDS = float(os.getenv("POLLER_OUTBOX_RETRY_SECONDS", "30"))
+POLLER_OUTBOX_MAX_RETRY_SECONDS = float(os.getenv("POLLER_OUTBOX_MAX_RETRY_SECONDS", "3600"))
+
+PENDING, DEAD = "pending", "dead"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS outbox_jobs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    job_key TEXT NOT NULL UNIQUE,
+    payload TEXT NOT NULL,
+    status TEXT NOT NULL DEFAULT 'pending',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    available_at REAL NOT NULL,
+    leased_until REAL,
+    last_error TEXT,
+    created_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS outbox_jobs_available ON outbox_jobs (status, available_at);
+"""
+
+
+def retry_delay(attempts, base=POLLER_OUTBOX_RETRY_SECONDS, maximum=POLLER_OUTBOX_MAX_RETRY_SECONDS):
+    """Väntetid före nästa försök efter `attempts` misslyckade försök."""
+    return min(maximum, base * 2 ** max(0, attempts - 1))
+
+
+class Outbox:
+    """
+    Jobbkö i en SQLite-fil. Ett jobb är en dict: {"id", "key", "payload", "attempts"}.
+    `key` är unik bland jobben som finns kvar, så samma händelse köas bara en gång.
+    Metoderna är trådsäkra; i asyncio-kod anropas de med asyncio.to_thread.
+    """
+
+    def __init__(self, path=POLLER_OUTBOX_PATH, max_attempts=POLLER_OUTBOX_MAX_ATTEMPTS,
+                 visibility_timeout=POLLER_OUTBOX_VISIBILITY_SECONDS, clock=time.time):
+        self.path = path
+        self.max_attempts = max_attempts
+        self.visibility_timeout = visibility_timeout
+        self.clock = clock
+        if path != ":memory:":
+            ensure_private_dir(path)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(SCHEMA)
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    def enqueue(self, key, payload):
+        """Lägger till ett jobb. Returnerar False om ett jobb med samma nyckel redan finns."""
+        now = self.clock()
+        with self._lock:
+            cursor = self._conn.execute(
+                "INSERT OR IGNORE INTO outbox_jobs (job_key, payload, available_at, created_at) VALUES (?, ?, ?, ?)",
+                (key, json.dumps(payload, ensure_ascii=False), now, now),
+            )
+        return cursor.rowcount == 1
+
+    def lease(self):
+        """
+        Hämtar och reserverar det äldsta jobbet som är redo (inte reserverat och inte i
+        väntan på omförsök). Returnerar None om inget jobb är redo.
+        """
+        now = self.clock()
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                while True:
+                    row = self._conn.execute(
+                        "SELECT id, job_key, payload, attempts FROM outbox_jobs "
+                        "WHERE status = ? AND available_at <= ? AND (leased_until IS NULL OR leased_until <= ?) "
+                        "ORDER BY available_at, id LIMIT 1",
+                        (PENDING, now, now),
+                    ).fetchone()
+                    if row is None or row[3] < self.max_attempts:
+                        break
+                    # Sista försöket tog aldrig slut (arbetaren dog eller reservationen gick ut).
+                    self._conn.execute(
+                        "UPDATE outbox_jobs SET status = ?, leased_until = NULL, last_error = ? WHERE id = ?",
+                        (DEAD, "visibility timeout expired", row[0]),
+                    )
+                if row is not None:
+                    self._conn.execute(
+                        "UPDATE outbox_jobs SET leased_until = ?, attempts = attempts + 1 WHERE id = ?",
+                        (now + self.visibility_timeout, row[0]),
+                    )
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        if row is None:
+            return None
+        return {"id": row[0], "key": row[1], "payload": json.loads(row[2]), "attempts": row[3] + 1}
+
+    def complete(self, job):
+        """Tar bort ett klart jobb."""
+        with self._lock:
+            self._conn.execute("DELETE FROM outbox_jobs WHERE id = ?", (job["id"],))
+
+    def fail(self, job, error, payload=None):
+        """
+        Registrerar ett misslyckat försök. Jobbet försöks igen efter retry_delay(), eller blir
+        dött om det har gjorts max_attempts försök. `payload` ersätter jobbets data, t.ex. för
+        att komma ihåg steg som redan är gjorda. Returnerar True om jobbet blev dött.
+        """
+        dead = job["attempts"] >= self.max_attempts
+        values = {
+            "status": DEAD if dead else PENDING,
+            "available_at": self.clock() + (0 if dead else retry_delay(job["attempts"])),
+            "last_error": str(error)[:1000],
+            "payload": json.dumps(payload if payload is not None else job["payload"], ensure_ascii=False),
+        }
+        with self._lock:
+            self._conn.execute(
+                "UPDATE outbox_jobs SET status = :status, available_at = :available_at, leased_until = NULL, "
+                "last_error = :last_error, payload = :payload WHERE id = :id",
+                {**values, "id": job["id"]},
+            )
+        return dead
+
+    def dead_jobs(self, limit=100):
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT id, job_key, payload, attempts, last_error FROM outbox_jobs WHERE status = ? "
+                "ORDER BY created_at LIMIT ?",
+                (DEAD, limit),
+            ).fetchall()
+        return [
+            {"id": r[0], "key": r[1], "payload": json.loads(r[2]), "attempts": r[3], "last_error": r[4]}
+            for r in rows
+        ]
+
+    def requeue_dead(self):
+        """Lägger tillbaka alla döda jobb i kön med nollställda försök. Returnerar antalet."""
+        with self._lock:
+            cursor = self._conn.execute(
+                "UPDATE outbox_jobs SET status = ?, attempts = 0, available_at = ?, leased_until = NULL "
+                "WHERE status = ?",
+                (PENDING, self.clock(), DEAD),
+            )
+        return cursor.rowcount
+
+    def depth(self):
+        """Köns storlek: {"ready", "waiting" (väntar på omförsök), "leased", "dead"}."""
+        now = self.clock()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT "
+                "SUM(status = :pending AND (leased_until IS NULL OR leased_until <= :now) AND available_at <= :now), "
+                "SUM(status = :pending AND (leased_until IS NULL OR leased_until <= :now) AND available_at > :now), "
+                "SUM(status = :pending AND leased_until > :now), "
+                "SUM(status = :dead) "
+                "FROM outbox_jobs",
+                {"pending": PENDING, "dead": DEAD, "now": now},
+            ).fetchone()
+        return dict(zip(("ready", "waiting", "leased", "dead"), (value or 0 for value in row)))
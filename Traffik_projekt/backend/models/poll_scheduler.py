@@ -0,0 +1,179 @@
+# models/poll_scheduler.py
+
+# Schemaläggning av pollern per län. Varje län har en egen nästa tidpunkt och ett eget
+# intervall: intervallet halveras när länet nyligen fått nya händelser och förlängs stegvis
+# när det är lugnt, och under rusningstid kortas det ytterligare. Alla län som är aktuella
+# hämtas i samma /trafikinfo-förfrågan, och antalet förfrågningar hålls inom en global budget
+# per timme.
+
+import os
+import time
+from collections import deque
+from datetime import datetime
+
+# Gränserna (sekunder) för de anpassade intervallen.
+POLLER_MIN_INTERVAL_SECONDS = float(os.getenv("POLLER_MIN_INTERVAL_SECONDS", "120"))
+POLLER_MAX_INTERVAL_SECONDS = float(os.getenv("POLLER_MAX_INTERVAL_SECONDS", "1800"))
+# Faktor för intervallet efter en hämtning utan respektive med nya händelser.
+POLLER_BACKOFF_FACTOR = float(os.getenv("POLLER_BACKOFF_FACTOR", "1.5"))
+POLLER_BOOST_FACTOR = float(os.getenv("POLLER_BOOST_FACTOR", "0.5"))
+# Rusningstid (lokal tid, måndag–fredag) som "start-slut" i hela timmar, kommaseparerat.
+POLLER_RUSH_HOURS = os.getenv("POLLER_RUSH_HOURS", "7-9,15-18")
+POLLER_RUSH_FACTOR = float(os.getenv("POLLER_RUSH_FACTOR", "0.5"))
+# Max antal förfrågningar mot /trafikinfo per timme, för alla län tillsammans.
+POLLER_REQUEST_BUDGET_PER_HOUR = int(os.getenv("POLLER_REQUEST_BUDGET_PER_HOUR", "60"))
+# Län som blir aktuella inom den här andelen av sitt intervall hämtas med i samma förfrågan.
+POLLER_LOOKAHEAD_FRACTION = float(os.getenv("POLLER_LOOKAHEAD_FRACTION", "0.25"))
+
+BUDGET_WINDOW_SECONDS = 60 * 60
+
+
+def parse_rush_hours(value):
+    """"7-9,15-18" -> [(7, 9), (15, 18)]. Kastar ValueError vid felaktigt format."""
+    ranges = []
+    for part in (value or "").split(","):
+        if not part.strip():
+            continue
+        start, _, end = part.partition("-")
+        start, end = int(start), int(end)
+        if not 0 <= start < end <= 24:
+            raise ValueError(f"Invalid rush hour range: {part}")
+        ranges.append((start, end))
+    return ranges
+
+
+class _CountyState:
+    def __init__(self, county_no, interval, next_due):
+        self.county_no = county_no
+        self.interval = interval      # Anpassat intervall, utan rusningsfaktor.
+        self.next_due = next_due      # time.monotonic()
+        self.seen = None              # Id:n i förra hämtningen; None före första.
+        self.polls = 0
+        self.new_deviations = 0
+        self.last_polled = None
+        self.last_new_at = None
+        self.total_gap = 0.0          # Summerad tid mellan hämtningar, för snittet.
+        self.total_lateness = 0.0     # Summerad tid efter next_due när hämtningen gjordes.
+
+
+class CountyScheduler:
+    """
+    Håller nästa tidpunkt per län och väljer vilka län som ska hämtas. `base_interval` är
+    startintervallet för alla län. Tiderna är time.monotonic(); `clock` och `wall_clock` kan
+    bytas ut i tester.
+    """
+
+    def __init__(self, county_nos, base_interval,
+                 min_interval=POLLER_MIN_INTERVAL_SECONDS, max_interval=POLLER_MAX_INTERVAL_SECONDS,
+                 budget_per_hour=POLLER_REQUEST_BUDGET_PER_HOUR, rush_hours=POLLER_RUSH_HOURS,
+                 clock=time.monotonic, wall_clock=datetime.now):
+        self.base_interval = base_interval
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.budget_per_hour = budget_per_hour
+        self.rush_hours = parse_rush_hours(rush_hours)
+        self.clock = clock
+        self.wall_clock = wall_clock
+        now = clock()
+        self.counties = {county_no: _CountyState(county_no, base_interval, now) for county_no in county_nos}
+        self._requests = deque()          # Tidpunkter för förfrågningar inom budgetfönstret.
+        self.requests_per_poll = 1        # Antal sidor i senaste hämtningen, som uppskattning.
+
+    def is_rush_hour(self):
+        now = self.wall_clock()
+        return now.weekday() < 5 and any(start <= now.hour < end for start, end in self.rush_hours)
+
+    def effective_interval(self, state):
+        interval = state.interval
+        if self.is_rush_hour():
+            interval *= POLLER_RUSH_FACTOR
+        return max(self.min_interval, min(self.max_interval, interval))
+
+    def _trim_budget(self, now):
+        while self._requests and self._requests[0] <= now - BUDGET_WINDOW_SECONDS:
+            self._requests.popleft()
+
+    def budget_left(self):
+        self._trim_budget(self.clock())
+        return self.budget_per_hour - len(self._requests)
+
+    def seconds_until_due(self):
+        """Sekunder tills nästa hämtning får göras (något län är aktuellt och budgeten räcker)."""
+        now = self.clock()
+        wait = max(0.0, min(state.next_due for state in self.counties.values()) - now)
+        self._trim_budget(now)
+        over = len(self._requests) + self.requests_per_poll - self.budget_per_hour
+        if over > 0 and self._requests:
+            # Vänta tills tillräckligt många förfrågningar har fallit ur fönstret.
+            oldest = self._requests[min(over, len(self._requests)) - 1]
+            wait = max(wait, oldest + BUDGET_WINDOW_SECONDS - now)
+        return wait
+
+    def take_due(self):
+        """
+        Returnerar länen som ska hämtas nu: de som är aktuella samt de som blir det inom
+        POLLER_LOOKAHEAD_FRACTION av sitt intervall (de följer med i samma förfrågan).
+        Tom lista om inget län är aktuellt eller budgeten är slut.
+        """
+        if self.seconds_until_due() > 0:
+            return []
+        now = self.clock()
+        return sorted(
+            state.county_no for state in self.counties.values()
+            if state.next_due - now <= self.effective_interval(state) * POLLER_LOOKAHEAD_FRACTION
+        )
+
+    def record_poll(self, deviations_by_county, requests=1):
+        """
+        Registrerar en lyckad hämtning: {län: [deviation, ...]} och antalet förfrågningar den
+        krävde. Ett län med nya händelser får kortare intervall, ett utan får längre.
+        """
+        now = self.clock()
+        self._requests.extend([now] * requests)
+        self.requests_per_poll = max(1, requests)
+        for county_no, deviations in deviations_by_county.items():
+            state = self.counties.get(county_no)
+            if state is None:
+                continue
+            ids = {dev.get("Id") for dev in deviations if dev.get("Id")}
+            new = len(ids - state.seen) if state.seen is not None else 0
+            state.seen = ids
+            if state.last_polled is not None:
+                state.total_gap += now - state.last_polled
+            state.total_lateness += max(0.0, now - state.next_due)
+            state.last_polled = now
+            state.polls += 1
+            if new:
+                state.new_deviations += new
+                state.last_new_at = now
+                state.interval = max(self.min_interval, state.interval * POLLER_BOOST_FACTOR)
+            else:
+                state.interval = min(self.max_interval, state.interval * POLLER_BACKOFF_FACTOR)
+            state.next_due = now + self.effective_interval(state)
+
+    def record_failure(self, county_nos, requests=1):
+        """En misslyckad hämtning: försök igen efter minsta intervallet, utan att ändra intervallen."""
+        now = self.clock()
+        self._requests.extend([now] * requests)
+        for county_no in county_nos:
+            if county_no in self.counties:
+                self.counties[county_no].next_due = now + self.min_interval
+
+    def stats(self):
+        """Tidsstatistik per län, sorterad på län."""
+        now = self.clock()
+        rows = []
+        for county_no in sorted(self.counties):
+            state = self.counties[county_no]
+            gaps = state.polls - 1
+            rows.append({
+                "county_no": county_no,
+                "interval": round(self.effective_interval(state), 1),
+                "next_due_in": round(max(0.0, state.next_due - now), 1),
+                "polls": state.polls,
+                "new_deviations": state.new_deviations,
+                "avg_gap": round(state.total_gap / gaps, 1) if gaps > 0 else None,
+                "avg_lateness": round(state.total_lateness / state.polls, 1) if state.polls else None,
+                "last_new_ago": round(now - state.last_new_at, 1) if state.last_new_at is not None else None,
+            })
+        return rows
@@ -0,0 +1,124 @@
+# models/reprojection.py
+
+# Omprojicering av Trafikverkets SWEREF99TM-koordinater (EPSG:3006) till WGS84 (EPSG:4326).
+# Alla koordinater i ett svar samlas i NumPy-arrayer och transformeras i ett enda anrop,
+# vilket gör att vi inte behöver be Trafikverket om båda koordinatsystemen.
+
+import logging
+import re
+import numpy as np
+from pyproj import Transformer # För koordinattransformationer (SWEREF99TM till WGS84).
+from pyproj.exceptions import CRSError # Specifik felhantering för pyproj.
+
+# Initierar en koordinattransformator från SWEREF99TM (EPSG:3006) till WGS84 (EPSG:4326).
+# `always_xy=True` säkerställer att utdata alltid är (longitud, latitud).
+try:
+    transformer_sweref_to_wgs84 = Transformer.from_crs("EPSG:3006", "EPSG:4326", always_xy=True)
+except CRSError as e:
+    # Loggar ett fel om transformatorn inte kan skapas (t.ex. om CRS-definitioner saknas).
+    logging.error(f"Could not create pyproj Transformer: {e}")
+    transformer_sweref_to_wgs84 = None # Sätter till None om det misslyckas.
+
+# Ungefärlig utbredning av Sverige i WGS84 (min_lon, min_lat, max_lon, max_lat).
+# WGS84-koordinater utanför denna ruta räknas som felaktiga och räknas om från SWEREF99TM.
+SWEDEN_WGS84_BOUNDS = (10.0, 54.5, 24.5, 69.5)
+
+WKT_COORDINATES_PATTERN = re.compile(r'\((.*)\)', re.DOTALL)
+COORDINATE_PAIR_PATTERN = re.compile(r'(-?\d+\.?\d*)\s+(-?\d+\.?\d*)')
+
+
+def _wkt_coordinates(wkt_string):
+    """Returnerar alla (x, y)-par i en WKT POINT/LINESTRING som float-tupler."""
+    if not wkt_string or not isinstance(wkt_string, str):
+        return []
+    match = WKT_COORDINATES_PATTERN.search(wkt_string)
+    if not match:
+        return []
+    return [(float(x), float(y)) for x, y in COORDINATE_PAIR_PATTERN.findall(match.group(1))]
+
+
+def _wgs84_is_valid(wkt_string):
+    coordinates = _wkt_coordinates(wkt_string)
+    if not coordinates:
+        return False
+    min_lon, min_lat, max_lon, max_lat = SWEDEN_WGS84_BOUNDS
+    return all(min_lon <= lon <= max_lon and min_lat <= lat <= max_lat for lon, lat in coordinates)
+
+
+def _geometry_slots(deviations, cameras):
+    """
+    Går igenom alla geometrier och returnerar (geometri-dict, WKT-typ) för varje plats där
+    WGS84 saknas eller ligger utanför Sverige men SWEREF99TM finns.
+    """
+    slots = []
+    for deviation in deviations:
+        geometry = deviation.get("Geometry") or {}
+        for kind, wkt_type in (("Point", "POINT"), ("Line", "LINESTRING")):
+            part = geometry.get(kind)
+            if part and part.get("SWEREF99TM") and not _wgs84_is_valid(part.get("WGS84")):
+                slots.append((part, wkt_type))
+    for camera in cameras:
+        geometry = camera.get("Geometry")
+        if geometry and geometry.get("SWEREF99TM") and not _wgs84_is_valid(geometry.get("WGS84")):
+            slots.append((geometry, "POINT"))
+    return slots
+
+
+def fill_wgs84_from_sweref(deviations, cameras, transformer=None):
+    """
+    Fyller i `WGS84` (som WKT) på alla geometrier där det saknas eller är ogiltigt, genom att
+    omprojicera SWEREF99TM. Alla koordinater transformeras i ett enda Transformer.transform-anrop.
+    Objekten ändras på plats. Returnerar antalet geometrier som fylldes i.
+    """
+    transformer = transformer or transformer_sweref_to_wgs84
+    if transformer is None:
+        return 0
+
+    slots = _geometry_slots(deviations, cameras)
+    if not slots:
+        return 0
+
+    # Samla alla koordinater i en enda sträng och låt NumPy parsa allt på en gång.
+    # För varje geometri sparas hur många koordinatpar den har, så att resultatet kan delas upp igen.
+    texts, counts = [], []
+    for part, _ in slots:
+        match = WKT_COORDINATES_PATTERN.search(part["SWEREF99TM"])
+        inner = match.group(1) if match else ""
+        texts.append(inner.replace(",", " "))
+        counts.append(inner.count(",") + 1 if inner.strip() else 0)
+    try:
+        values = np.fromstring(" ".join(texts), sep=" ")
+    except ValueError:
+        # NumPy 2 kastar ValueError på tecken som inte är tal, t.ex. parenteserna i en
+        # MULTILINESTRING eller ett trasigt värde.
+        values = None
+    if values is None or values.size != 2 * sum(counts):
+        # Någon WKT-sträng hade oväntat format; parsa geometri för geometri i stället.
+        pairs = [_wkt_coordinates(part["SWEREF99TM"]) for part, _ in slots]
+        counts = [len(p) for p in pairs]
+        values = np.asarray([v for p in pairs for xy in p for v in xy], dtype=np.float64)
+    xy = values.reshape(-1, 2)
+
+    lons, lats = transformer.transform(xy[:, 0], xy[:, 1])
+    pair_strings = [f"{lon:.6f} {lat:.6f}" for lon, lat in zip(lons.tolist(), lats.tolist())]
+
+    filled = 0
+    start = 0
+    for (part, wkt_type), count in zip(slots, counts):
+        if count:
+            part["WGS84"] = _format_wkt(part["SWEREF99TM"], wkt_type, pair_strings[start:start + count])
+            filled += 1
+        start += count
+    return filled
+
+
+def _format_wkt(sweref_wkt, wkt_type, pair_strings):
+    """
+    WGS84-WKT med de omräknade paren. Enkla geometrier skrivs som "TYP (par, par)"; övriga
+    (t.ex. MULTILINESTRING) behåller sin struktur och paren byts ut i tur och ordning.
+    """
+    match = WKT_COORDINATES_PATTERN.search(sweref_wkt)
+    if match and "(" not in match.group(1) and sweref_wkt.lstrip().upper().startswith(wkt_type):
+        return f"{wkt_type} ({', '.join(pair_strings)})"
+    replacements = iter(pair_strings)
+    return COORDINATE_PAIR_PATTERN.sub(lambda _: next(replacements), sweref_wkt)
@@ -0,0 +1,95 @@
+# models/sent_index.py
+
+# Lokalt index över vilka händelser (external_id) som redan har notifierats, för pollern.
+# I stället för en fråga mot notifications per händelse och cykel läses de senaste notiserna
+# in i ett svep vid start, nya läggs till när pollern skriver dem, och händelser som inte
+# finns i indexet kontrolleras med en gemensam in_-fråga per cykel.
+
+import os
+import threading
+import time
+from datetime import datetime
+
+# Hur länge (sekunder) ett external_id ligger kvar i indexet. /trafikinfo returnerar bara
+# händelser från senaste dygnet, så äldre notiser behöver pollern aldrig fråga om.
+POLLER_SENT_INDEX_MAX_AGE_SECONDS = float(os.getenv("POLLER_SENT_INDEX_MAX_AGE_SECONDS", str(3 * 24 * 60 * 60)))
+# Rader per sida vid inläsningen (PostgREST returnerar som mest 1000 rader per fråga som standard).
+LOAD_PAGE_SIZE = 1000
+# Max antal Id:n per in_-fråga, så att URL:en håller sig kort.
+IN_QUERY_CHUNK = 200
+# Rader som räknas som notifierade: pollerns egna rader saknar status, utskicken från
+# notification_api har "sent" eller "failed". Misslyckade utskick ska skickas om, inte
+# hoppas över. (neq ensamt räcker inte, eftersom NULL aldrig matchar neq i PostgREST.)
+NOT_FAILED_FILTER = "status.is.null,status.neq.failed"
+
+
+def _parse_time(value):
+    try:
+        return datetime.fromisoformat(value).timestamp()
+    except (TypeError, ValueError):
+        return time.time()
+
+
+class SentNotificationIndex:
+    """
+    external_id -> när notisen skrevs (epoch-sekunder), för rader i tabellen notifications.
+    Trådsäkert: utskicksarbetarna lägger till medan pollcykeln kontrollerar och rensar.
+    """
+
+    def __init__(self, supabase, max_age_seconds=POLLER_SENT_INDEX_MAX_AGE_SECONDS):
+        self.supabase = supabase
+        self.max_age_seconds = max_age_seconds
+        self._sent = {}
+        self._lock = threading.Lock()
+        self.queries = 0  # Antal frågor mot Supabase sedan start, för loggning.
+
+    def __len__(self):
+        return len(self._sent)
+
+    def __contains__(self, external_id):
+        return external_id in self._sent
+
+    def load(self):
+        """Läser in alla notiser inom max_age_seconds (utom misslyckade), sida för sida."""
+        since = datetime.fromtimestamp(time.time() - self.max_age_seconds).astimezone().isoformat()
+        start = 0
+        while True:
+            res = self.supabase.table("notifications").select("external_id, created_at") \
+                .gte("created_at", since).or_(NOT_FAILED_FILTER).order("created_at").range(start, start + LOAD_PAGE_SIZE - 1).execute()
+            self.queries += 1
+            with self._lock:
+                for row in res.data:
+                    if row.get("external_id"):
+                        self._sent[row["external_id"]] = _parse_time(row.get("created_at"))
+            if len(res.data) < LOAD_PAGE_SIZE:
+                return len(self._sent)
+            start += LOAD_PAGE_SIZE
+
+    def add(self, external_id):
+        with self._lock:
+            self._sent[external_id] = time.time()
+
+    def trim(self):
+        cutoff = time.time() - self.max_age_seconds
+        with self._lock:
+            self._sent = {external_id: at for external_id, at in self._sent.items() if at >= cutoff}
+
+    def refresh(self, external_ids):
+        """
+        Kontrollerar de external_id som inte finns i indexet med en in_-fråga (per 200 Id:n) och
+        lägger till dem som redan har notiser som inte misslyckades, t.ex. skrivna av en annan
+        process. Returnerar antalet frågor som gjordes.
+        """
+        self.trim()
+        with self._lock:
+            unknown = sorted({external_id for external_id in external_ids if external_id and external_id not in self._sent})
+        queries = 0
+        for i in range(0, len(unknown), IN_QUERY_CHUNK):
+            res = self.supabase.table("notifications").select("external_id, created_at") \
+                .in_("external_id", unknown[i:i + IN_QUERY_CHUNK]).or_(NOT_FAILED_FILTER).execute()
+            queries += 1
+            with self._lock:
+                for row in res.data:
+                    self._sent[row["external_id"]] = _parse_time(row.get("created_at"))
+        self.queries += queries
+        return queries
@@ -0,0 +1,215 @@
+# models/spatial_index.py
+
+# Rumsligt index över trafikhändelser och fartkameror, för att kunna svara på
+# bounding box-frågor (kartans synliga område) utan att gå igenom alla objekt.
+
+import math
+import threading
+from collections import defaultdict
+
+from models.geometry import geometry_item
+
+# Cellstorlek i grader. 0.1° lon x 0.05° lat är ungefär 5 x 5 km i mellersta Sverige,
+# vilket ger få objekt per cell även i Stockholm och Göteborg.
+DEFAULT_CELL_SIZE = (0.1, 0.05)
+
+
+def geometry_extent(geometry):
+    """Returnerar (min_lon, min_lat, max_lon, max_lat) för en GeoJSON-geometri, eller None."""
+    if not geometry:
+        return None
+    if geometry["type"] == "GeometryCollection":
+        extents = [e for e in (geometry_extent(g) for g in geometry["geometries"]) if e]
+        if not extents:
+            return None
+        return (
+            min(e[0] for e in extents), min(e[1] for e in extents),
+            max(e[2] for e in extents), max(e[3] for e in extents),
+        )
+    positions = [geometry["coordinates"]] if geometry["type"] == "Point" else geometry["coordinates"]
+    if not positions:
+        return None
+    lons = [p[0] for p in positions]
+    lats = [p[1] for p in positions]
+    return min(lons), min(lats), max(lons), max(lats)
+
+
+def extents_intersect(a, b):
+    return a[0] <= b[2] and b[0] <= a[2] and a[1] <= b[3] and b[1] <= a[3]
+
+
+class GridIndex:
+    """
+    Enkel rutnätsindexering. Varje objekt läggs i alla celler som dess utbredning täcker
+    (linjer kan alltså ligga i flera celler). En fråga tittar bara i cellerna som täcker
+    frågerutan, så kostnaden beror på kartytans storlek och antalet träffar – inte på hur
+    många händelser som finns totalt. Objekt kan läggas till och tas bort ett och ett.
+    """
+
+    def __init__(self, cell_size=DEFAULT_CELL_SIZE):
+        self.cell_width, self.cell_height = cell_size
+        self._lock = threading.Lock()
+        self._cells = defaultdict(set)  # (cx, cy) -> {nyckel}
+        self._extents = {}              # nyckel -> utbredning
+
+    def _cell_range(self, extent):
+        min_lon, min_lat, max_lon, max_lat = extent
+        return (
+            range(math.floor(min_lon / self.cell_width), math.floor(max_lon / self.cell_width) + 1),
+            range(math.floor(min_lat / self.cell_height), math.floor(max_lat / self.cell_height) + 1),
+        )
+
+    def insert(self, key, extent):
+        with self._lock:
+            self._remove_locked(key)
+            self._extents[key] = extent
+            xs, ys = self._cell_range(extent)
+            for cx in xs:
+                for cy in ys:
+                    self._cells[(cx, cy)].add(key)
+
+    def insert_many(self, entries):
+        """Lägger in många (nyckel, utbredning) på en gång, t.ex. vid uppbyggnad av ett nytt index."""
+        with self._lock:
+            for key, extent in entries:
+                self._remove_locked(key)
+                self._extents[key] = extent
+                xs, ys = self._cell_range(extent)
+                for cx in xs:
+                    for cy in ys:
+                        self._cells[(cx, cy)].add(key)
+
+    def remove(self, key):
+        with self._lock:
+            self._remove_locked(key)
+
+    def _remove_locked(self, key):
+        extent = self._extents.pop(key, None)
+        if extent is None:
+            return
+        xs, ys = self._cell_range(extent)
+        for cx in xs:
+            for cy in ys:
+                cell = self._cells.get((cx, cy))
+                if cell is not None:
+                    cell.discard(key)
+                    if not cell:
+                        del self._cells[(cx, cy)]
+
+    def query(self, bbox):
+        """Returnerar nycklarna för alla objekt vars utbredning skär `bbox`."""
+        xs, ys = self._cell_range(bbox)
+        with self._lock:
+            if len(xs) * len(ys) > len(self._cells):
+                # Stor frågeruta (t.ex. hela Sverige): billigare att gå igenom de celler som finns.
+                candidates = set().union(*self._cells.values()) if self._cells else set()
+            else:
+                candidates = set()
+                for cx in xs:
+                    for cy in ys:
+                        cell = self._cells.get((cx, cy))
+                        if cell:
+                            candidates |= cell
+            return {key for key in candidates if extents_intersect(self._extents[key], bbox)}
+
+    def __len__(self):
+        return len(self._extents)
+
+
+class SnapshotSpatialIndex:
+    """
+    Håller ett GridIndex i synk med traffic_store. Vid varje uppdatering jämförs objektens
+    geometrinycklar (Id + VersionTime för deviations) och bara nya, ändrade och borttagna
+    objekt läggs in eller tas bort – indexet byggs aldrig om från början.
+    """
+
+    def __init__(self, geometry_cache, cell_size=DEFAULT_CELL_SIZE):
+        self.grid = GridIndex(cell_size)
+        self._geometry_cache = geometry_cache
+        self._indexed = {}  # (typ, Id) -> geometrinyckel som är indexerad
+        # Versionen av lagret som indexet motsvarar; None medan det uppdateras.
+        self.version = None
+
+    def update(self, old_snapshot, new_snapshot):
+        self.version = None
+        current = {}
+        objects = {}
+        for kind, collection in (("deviation", new_snapshot.deviations), ("camera", new_snapshot.cameras)):
+            for obj_id, obj in collection.items():
+                item = geometry_item(kind, obj)
+                current[(kind, obj_id)] = item[0]
+                objects[(kind, obj_id)] = item
+
+        for index_key in [k for k in self._indexed if k not in current]:
+            self.grid.remove(index_key)
+            del self._indexed[index_key]
+
+        changed = [index_key for index_key, geometry_key in current.items() if self._indexed.get(index_key) != geometry_key]
+        if not changed:
+            self.version = new_snapshot.version
+            return
+        geometries = self._geometry_cache.get_many([objects[index_key] for index_key in changed])
+        for index_key, geometry in zip(changed, geometries):
+            extent = geometry_extent(geometry)
+            if extent is None:
+                # Objekt utan position (t.ex. länsövergripande händelser) kan inte hittas via bbox.
+                self.grid.remove(index_key)
+            else:
+                self.grid.insert(index_key, extent)
+            self._indexed[index_key] = current[index_key]
+        self.version = new_snapshot.version
+
+    def query(self, bbox):
+        """Returnerar (deviation-Id:n, kamera-Id:n) inom `bbox`."""
+        deviation_ids, camera_ids = set(), set()
+        for kind, obj_id in self.grid.query(bbox):
+            (deviation_ids if kind == "deviation" else camera_ids).add(obj_id)
+        return deviation_ids, camera_ids
+
+
+def parse_bbox(value):
+    """
+    Parsar en bbox-parameter "minLon,minLat,maxLon,maxLat" till en tuple med floats.
+    Kastar ValueError om formatet är ogiltigt.
+    """
+    parts = [float(p) for p in value.split(",")]
+    if len(parts) != 4:
+        raise ValueError("bbox must have four comma-separated numbers")
+    min_lon, min_lat, max_lon, max_lat = parts
+    if min_lon > max_lon or min_lat > max_lat:
+        raise ValueError("bbox min values must not exceed max values")
+    if not (-180 <= min_lon <= 180 and -180 <= max_lon <= 180 and -90 <= min_lat <= 90 and -90 <= max_lat <= 90):
+        raise ValueError("bbox out of range")
+    return min_lon, min_lat, max_lon, max_lat
+
+
+def filter_response_by_bbox(response_data, bbox, geometry_cache):
+    """
+    Filtrerar ett svar i Trafikverkets format på `bbox` genom att gå igenom alla objekt.
+    Används innan traffic_store har data, och medan det rumsliga indexet byggs om efter en
+    ny version (då kan indexet inte frågas).
+    """
+    results = []
+    for result in response_data.get("RESPONSE", {}).get("RESULT", []):
+        result = dict(result)
+        if "Situation" in result:
+            situations = []
+            for situation in result["Situation"]:
+                deviations = situation.get("Deviation", [])
+                deviations = deviations if isinstance(deviations, list) else [deviations]
+                geometries = geometry_cache.get_many([geometry_item("deviation", d) for d in deviations])
+                inside = [d for d, g in zip(deviations, geometries) if _inside(g, bbox)]
+                if inside:
+                    situations.append({**situation, "Deviation": inside})
+            result["Situation"] = situations
+        if "TrafficSafetyCamera" in result:
+            cameras = result["TrafficSafetyCamera"]
+            geometries = geometry_cache.get_many([geometry_item("camera", c) for c in cameras])
+            result["TrafficSafetyCamera"] = [c for c, g in zip(cameras, geometries) if _inside(g, bbox)]
+        results.append(result)
+    return {**response_data, "RESPONSE": {**response_data.get("RESPONSE", {}), "RESULT": results}}
+
+
+def _inside(geometry, bbox):
+    extent = geometry_extent(geometry)
+    return extent is not None and extents_intersect(extent, bbox)
@@ -0,0 +1,127 @@
+# models/store_snapshot.py
+
+# Snapshot-fil av traffic_store för snabba omstarter. Inhämtningen skriver regelbundet de
+# aktuella situationerna (med deviations), kamerorna och Trafikverkets LASTCHANGEID till en
+# JSON-fil. Vid start läses filen in och lagret byggs upp från den, så att förfrågningar kan
+# besvaras direkt medan första hämtningen – som då kan vara ett delta i stället för hela
+# datamängden – körs i bakgrunden.
+#
+# Filen innehåller bara data i Trafikverkets format, inga Python-objekt. Lagrets egna index
+# byggs när snapshoten installeras; det rumsliga indexet och klusterhierarkin byggs om i en
+# bakgrundstråd (se routes/traffic.py), så att inläsningen inte väntar på dem.
+
+import os
+import json
+import logging
+import tempfile
+import time
+
+from models.app_dirs import cache_dir, ensure_private_dir
+from models.traffic_store import TrafficSnapshot
+
+# Var snapshot-filen sparas. Tom sträng stänger av både skrivning och inläsning.
+TRAFFIC_STORE_SNAPSHOT_PATH = os.getenv(
+    "TRAFFIC_STORE_SNAPSHOT_PATH", os.path.join(cache_dir(), "store_snapshot.json")
+)
+# Hur ofta (sekunder) filen skrivs om, som mest. Skrivs bara efter en lyckad inhämtning.
+TRAFFIC_STORE_SNAPSHOT_INTERVAL_SECONDS = float(os.getenv("TRAFFIC_STORE_SNAPSHOT_INTERVAL_SECONDS", "300"))
+# Äldre filer än så här läses inte in; då väntar vi hellre på en ny hämtning.
+TRAFFIC_STORE_SNAPSHOT_MAX_AGE_SECONDS = float(os.getenv("TRAFFIC_STORE_SNAPSHOT_MAX_AGE_SECONDS", str(24 * 60 * 60)))
+
+# Räknas upp när filens innehåll ändras, så att gamla filer ignoreras.
+SNAPSHOT_FORMAT = 3
+
+
+class StoreSnapshotFile:
+    """Läser och skriver snapshot-filen för ett DeviationStore."""
+
+    def __init__(self, path, interval_seconds=TRAFFIC_STORE_SNAPSHOT_INTERVAL_SECONDS,
+                 max_age_seconds=TRAFFIC_STORE_SNAPSHOT_MAX_AGE_SECONDS):
+        self.path = path
+        self.interval_seconds = interval_seconds
+        self.max_age_seconds = max_age_seconds
+        self.saved_at = None  # time.monotonic() för senaste skrivningen.
+
+    def save(self, snapshot, situation_change_id=None):
+        """Skriver filen atomärt (temporär fil + namnbyte). Kastar OSError vid fel."""
+        data = {
+            "format": SNAPSHOT_FORMAT,
+            "saved_at": time.time(),
+            "created_at": snapshot.created_at,
+            "situation_change_id": situation_change_id,
+            "situations": snapshot.situation_items(),
+            "cameras": list(snapshot.cameras.values()),
+        }
+        directory = ensure_private_dir(self.path)
+        fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".store_snapshot_")
+        try:
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                json.dump(data, f, ensure_ascii=False, separators=(",", ":"))
+            os.replace(tmp_path, self.path)
+        except (OSError, TypeError, ValueError):
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        self.saved_at = time.monotonic()
+
+    def save_if_due(self, snapshot, situation_change_id=None):
+        """Skriver filen om det har gått minst `interval_seconds` sedan förra gången."""
+        if self.saved_at is not None and time.monotonic() - self.saved_at < self.interval_seconds:
+            return False
+        started = time.perf_counter()
+        try:
+            self.save(snapshot, situation_change_id)
+        except (OSError, TypeError, ValueError) as e:
+            logging.warning(f"Could not write store snapshot {self.path}: {e}")
+            return False
+        logging.info(f"Store snapshot written to {self.path} in {(time.perf_counter() - started) * 1000:.1f} ms.")
+        return True
+
+    def load(self):
+        """
+        Läser filen. Returnerar dess innehåll som dict, eller None om filen saknas, är trasig,
+        har ett annat format eller är för gammal.
+        """
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError) as e:
+            logging.warning(f"Could not read store snapshot {self.path}: {e}")
+            return None
+        if not isinstance(data, dict) or data.get("format") != SNAPSHOT_FORMAT:
+            logging.info(f"Ignoring store snapshot {self.path}: unsupported format.")
+            return None
+        if not isinstance(data.get("situations"), list) or not isinstance(data.get("cameras"), list):
+            logging.warning(f"Ignoring store snapshot {self.path}: missing situations or cameras.")
+            return None
+        age = time.time() - (data.get("saved_at") or 0)
+        if age > self.max_age_seconds:
+            logging.info(f"Ignoring store snapshot {self.path}: {age:.0f}s old.")
+            return None
+        return data
+
+
+def load_store_snapshot(store, snapshot_file):
+    """
+    Läser in snapshot-filen i `store`. Lyssnarna körs som vid en vanlig uppdatering; de tunga
+    indexen (rumsligt index, kluster) byggs i bakgrunden.
+    Returnerar det sparade LASTCHANGEID:t, eller None om ingen snapshot lästes in.
+    """
+    started = time.perf_counter()
+    data = snapshot_file.load()
+    if data is None:
+        return None
+    try:
+        snapshot = TrafficSnapshot(data["situations"], data["cameras"], version=0)
+    except (AttributeError, TypeError) as e:
+        logging.warning(f"Ignoring store snapshot {snapshot_file.path}: {e}")
+        return None
+    snapshot.created_at = data.get("created_at") or data["saved_at"]
+    store.install_snapshot(snapshot)
+    logging.info(
+        f"Loaded store snapshot {snapshot_file.path} in {(time.perf_counter() - started) * 1000:.1f} ms "
+        f"(data from {time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(snapshot.created_at))})."
+    )
+    return data.get("situation_change_id")
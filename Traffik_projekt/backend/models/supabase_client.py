@@ -14,6 +14,7 @@ supabase = create_client(url, key)
 from supabase import create_client, Client
 import os
 from dotenv import load_dotenv
+from models.metrics import instrument_supabase
 
 # Ladda miljövariabler
 load_dotenv()
@@ -34,6 +35,8 @@ if not url or not key:
 # Skapa Supabase-klienten
 try:
     supabase: Client = create_client(url, key)
+    # Tidmät tabellfrågor (se /metrics)
+    instrument_supabase(supabase)
     print(" Supabase-klient skapad.")
 except Exception as e:
     print("Fel vid skapande av Supabase-klient:", str(e))
\ No newline at end of file
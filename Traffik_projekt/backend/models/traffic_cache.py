@@ -0,0 +1,117 @@
+# models/traffic_cache.py
+
+# En enkel processlokal cache för färdiga ögonblicksbilder (snapshots) från Trafikverket.
+# Den används för att samma län/meddelandetyp inte ska hämtas om och om igen när många
+# kartor laddas samtidigt (t.ex. när en artikel med den inbäddade kartan sprids).
+
+import logging
+import threading
+import time
+
+# Statusvärden som skickas tillbaka till anroparen (och vidare i svarshuvudet X-Cache).
+CACHE_HIT = "HIT"              # Färsk post fanns i cachen.
+CACHE_STALE = "STALE"          # Gammal post returnerades medan en uppdatering körs i bakgrunden.
+CACHE_MISS = "MISS"            # Ingen användbar post, denna förfrågan hämtade från källan.
+CACHE_COALESCED = "COALESCED"  # Ingen användbar post, men förfrågan väntade på en pågående hämtning.
+
+
+class _InFlight:
+    """Håller reda på en pågående hämtning så att andra trådar kan vänta på samma resultat."""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.value = None
+        self.error = None
+
+
+class SnapshotCache:
+    """
+    TTL-cache med stale-while-revalidate och single-flight.
+
+    - Inom `ttl_seconds` returneras posten direkt.
+    - Mellan `ttl_seconds` och `ttl_seconds + stale_seconds` returneras den gamla posten
+      medan en (och endast en) bakgrundstråd hämtar en ny.
+    - Saknas en användbar post gör den första förfrågan hämtningen och alla samtidiga
+      förfrågningar med samma nyckel väntar på just den hämtningen.
+    """
+
+    def __init__(self, ttl_seconds, stale_seconds=0, max_entries=256):
+        self.ttl_seconds = ttl_seconds
+        self.stale_seconds = stale_seconds
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._entries = {}   # nyckel -> (värde, hämtad_tid)
+        self._in_flight = {} # nyckel -> _InFlight
+
+    def get(self, key, fetcher):
+        """
+        Returnerar (värde, status, ålder_i_sekunder) för `key`.
+        `fetcher` anropas utan argument när ett nytt värde behövs.
+        Fel från `fetcher` kastas vidare till alla som väntade på hämtningen.
+        """
+        with self._lock:
+            now = time.monotonic()
+            entry = self._entries.get(key)
+            if entry is not None:
+                value, fetched_at = entry
+                age = now - fetched_at
+                if age < self.ttl_seconds:
+                    return value, CACHE_HIT, age
+                if age < self.ttl_seconds + self.stale_seconds:
+                    # Starta en bakgrundsuppdatering om ingen redan pågår.
+                    if key not in self._in_flight:
+                        in_flight = _InFlight()
+                        self._in_flight[key] = in_flight
+                        threading.Thread(
+                            target=self._run_fetch,
+                            args=(key, fetcher, in_flight),
+                            daemon=True,
+                        ).start()
+                    return value, CACHE_STALE, age
+
+            in_flight = self._in_flight.get(key)
+            is_leader = in_flight is None
+            if is_leader:
+                in_flight = _InFlight()
+                self._in_flight[key] = in_flight
+
+        if is_leader:
+            self._run_fetch(key, fetcher, in_flight)
+        else:
+            in_flight.done.wait()
+
+        if in_flight.error is not None:
+            raise in_flight.error
+        return in_flight.value, CACHE_MISS if is_leader else CACHE_COALESCED, 0.0
+
+    def invalidate(self, key=None):
+        """Tömmer en enskild nyckel, eller hela cachen om ingen nyckel anges."""
+        with self._lock:
+            if key is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(key, None)
+
+    def _run_fetch(self, key, fetcher, in_flight):
+        try:
+            value = fetcher()
+        except Exception as e:
+            in_flight.error = e
+            logging.warning(f"Snapshot cache refresh failed for {key}: {e}")
+        else:
+            in_flight.value = value
+            with self._lock:
+                self._entries[key] = (value, time.monotonic())
+                self._evict_if_needed()
+        finally:
+            with self._lock:
+                self._in_flight.pop(key, None)
+            in_flight.done.set()
+
+    def _evict_if_needed(self):
+        # Anropas med låset taget. Tar bort de äldsta posterna när cachen är full.
+        overflow = len(self._entries) - self.max_entries
+        if overflow > 0:
+            oldest = sorted(self._entries.items(), key=lambda item: item[1][1])[:overflow]
+            for old_key, _ in oldest:
+                del self._entries[old_key]
@@ -0,0 +1,256 @@
+# models/traffic_ingester.py
+
+# Bakgrundsinhämtning av hela Sveriges trafikhändelser (Situation) från Trafikverket.
+# Resultatet läggs i traffic_store så att API-routes kan svara direkt ur minnet.
+# Fartkamerorna ändras sällan och hämtas separat (se models/camera_dataset.py).
+
+import os
+import logging
+import threading
+import time
+from dotenv import load_dotenv
+
+from models.traffic_store import traffic_store
+from models.reprojection import fill_wgs84_from_sweref
+from models.upstream import upstream
+from models.store_snapshot import TRAFFIC_STORE_SNAPSHOT_PATH, StoreSnapshotFile, load_store_snapshot
+
+load_dotenv()
+
+TRAFIKVERKET_API_KEY = os.getenv("TRAFIKVERKET_API_KEY") or os.getenv("TRV_API_KEY")
+TRAFIKVERKET_API_URL = os.getenv("TRAFIKVERKET_API_URL", "https://api.trafikinfo.trafikverket.se/v2/data.json")
+# Hur ofta (sekunder) hela datamängden hämtas.
+TRAFFIC_INGEST_INTERVAL_SECONDS = float(os.getenv("TRAFFIC_INGEST_INTERVAL_SECONDS", "60"))
+# "incremental" hämtar bara ändringar sedan förra LASTCHANGEID, "full" hämtar allt varje gång.
+TRAFFIC_INGEST_MODE = os.getenv("TRAFFIC_INGEST_MODE", "incremental").lower()
+# Sätt till "false" för att stänga av bakgrundsinhämtningen (t.ex. i tester).
+TRAFFIC_INGEST_ENABLED = os.getenv("TRAFFIC_INGEST_ENABLED", "true").lower() == "true"
+
+# Alla fält som används av /api/traffic-info och /trafikinfo.
+# Endast SWEREF99TM hämtas för geometrier; WGS84 räknas fram lokalt (se models/reprojection.py).
+DEVIATION_INCLUDES = [
+    "Deviation.Id", "Deviation.Header", "Deviation.CreationTime", "Deviation.CountyNo",
+    "Deviation.Geometry.Point.SWEREF99TM", "Deviation.Geometry.Line.SWEREF99TM",
+    "Deviation.LocationDescriptor", "Deviation.RoadNumber", "Deviation.RoadName",
+    "Deviation.PositionalDescription", "Deviation.MessageType", "Deviation.MessageTypeValue",
+    "Deviation.IconId", "Deviation.StartTime", "Deviation.EndTime", "Deviation.Message",
+    "Deviation.AffectedDirection", "Deviation.SeverityText", "Deviation.TemporaryLimit",
+    "Deviation.ValidUntilFurtherNotice", "Deviation.WebLink", "Deviation.NumberOfLanesRestricted",
+    "Deviation.TrafficRestrictionType", "Deviation.VersionTime",
+]
+
+
+def _includes_xml(fields):
+    return "\n".join(f"        <INCLUDE>{field}</INCLUDE>" for field in fields)
+
+
+class ChangeIdRejected(Exception):
+    """Trafikverket accepterade inte det sparade change id:t; en full omsynkning krävs."""
+
+
+class FetchResult:
+    """Resultatet av en hämtning: situationerna, nytt change id samt mätvärden för cykeln."""
+
+    def __init__(self, situations, situation_change_id, bytes_received, parse_seconds):
+        self.situations = situations
+        self.situation_change_id = situation_change_id
+        self.bytes_received = bytes_received
+        self.parse_seconds = parse_seconds
+
+
+def _change_attributes(change_id):
+    # changeid="0" ger hela datamängden plus ett LASTCHANGEID att fortsätta från.
+    # includedeletedobjects gör att borttagna objekt kommer med (Deleted=true) i deltat.
+    if change_id is None:
+        return ""
+    return f' changeid="{change_id}" includedeletedobjects="true"'
+
+
+def build_ingest_query(situation_change_id=None):
+    """
+    Bygger XML-frågan för hela Sverige: alla situationer med deviations.
+    Med ett change id returnerar Trafikverket bara objekt som ändrats sedan dess.
+    """
+    return f"""
+<REQUEST>
+    <LOGIN authenticationkey="{TRAFIKVERKET_API_KEY}" />
+    <QUERY objecttype="Situation" namespace="Road.TrafficInfo" schemaversion="1.5"{_change_attributes(situation_change_id)}>
+        <FILTER>
+            <EXISTS name="Deviation" value="true" />
+        </FILTER>
+        <INCLUDE>Id</INCLUDE>
+        <INCLUDE>Deleted</INCLUDE>
+{_includes_xml(DEVIATION_INCLUDES)}
+    </QUERY>
+</REQUEST>
+"""
+
+
+def fetch_dataset(situation_change_id=None):
+    """
+    Hämtar hela datamängden (utan change id), en full omsynkning (change id "0")
+    eller ett delta (tidigare LASTCHANGEID). Kastar ChangeIdRejected om Trafikverket
+    inte godtar change id:t.
+    """
+    incremental = situation_change_id not in (None, "0")
+    response = upstream("trafikverket").post(
+        TRAFIKVERKET_API_URL,
+        content=build_ingest_query(situation_change_id).encode("utf-8"),
+        headers={"Content-Type": "text/xml"},
+        operation="Situation.delta" if incremental else "Situation.full",
+        retry=True,
+        timeout=30,
+    )
+    if incremental and response.status_code == 400:
+        raise ChangeIdRejected(response.text[:200])
+    response.raise_for_status()
+
+    parse_started = time.perf_counter()
+    results = response.json().get("RESPONSE", {}).get("RESULT", [])
+
+    situations = []
+    situation_last_change_id = None
+    for result in results:
+        if "ERROR" in result:
+            if incremental:
+                raise ChangeIdRejected(str(result["ERROR"]))
+            raise ValueError(f"Trafikverket returned an error: {result['ERROR']}")
+        # Ett tomt delta innehåller inget Situation-fält, bara INFO.
+        situations.extend(result.get("Situation", []))
+        situation_last_change_id = result.get("INFO", {}).get("LASTCHANGEID") or situation_last_change_id
+
+    # Omprojicera alla SWEREF99TM-koordinater till WGS84 i ett svep (räknas in i parse-tiden).
+    deviations = []
+    for situation in situations:
+        deviation_list = situation.get("Deviation") or []
+        deviations.extend(deviation_list if isinstance(deviation_list, list) else [deviation_list])
+    fill_wgs84_from_sweref(deviations, [])
+
+    return FetchResult(
+        situations,
+        situation_last_change_id or situation_change_id,
+        bytes_received=len(response.content),
+        parse_seconds=time.perf_counter() - parse_started,
+    )
+
+
+class TrafficIngester:
+    """
+    Kör en hämtning direkt vid start och sedan var `interval_seconds` i en daemon-tråd.
+
+    I läget "incremental" sparas det LASTCHANGEID som Trafikverket returnerar och nästa cykel
+    hämtar bara ändrade/borttagna objekt. Om change id:t avvisas görs en full omsynkning.
+    I läget "full" hämtas hela datamängden varje gång.
+
+    Med `snapshot_file` skrivs lagret (och LASTCHANGEID) regelbundet till disk efter en lyckad
+    cykel, så att nästa start kan läsa in det direkt (se models/store_snapshot.py).
+    """
+
+    def __init__(self, store, interval_seconds, mode="incremental", snapshot_file=None):
+        self.store = store
+        self.interval_seconds = interval_seconds
+        self.mode = mode
+        self.snapshot_file = snapshot_file
+        self._thread = None
+        self._stop = threading.Event()
+        self.situation_change_id = None
+        self.last_success_at = None
+        self.last_error = None
+        self.last_cycle = None  # Mätvärden från senaste cykeln (se _record_cycle).
+
+    def run_once(self):
+        started = time.monotonic()
+        if self.mode != "incremental":
+            result = fetch_dataset()
+            apply_started = time.perf_counter()
+            self.store.replace_all(result.situations)
+            kind = "full"
+        elif self.situation_change_id is None or not self.store.ready:
+            result = self._resync()
+            apply_started = time.perf_counter()
+            self.store.replace_all(result.situations)
+            kind = "resync"
+        else:
+            try:
+                result = fetch_dataset(self.situation_change_id)
+                kind = "delta"
+            except ChangeIdRejected as e:
+                logging.warning(f"Trafikverket rejected change id {self.situation_change_id}, doing full resync: {e}")
+                result = self._resync()
+                kind = "resync"
+            apply_started = time.perf_counter()
+            if kind == "delta":
+                self.store.apply_changes(result.situations)
+            else:
+                self.store.replace_all(result.situations)
+
+        if self.mode == "incremental":
+            self.situation_change_id = result.situation_change_id
+        self._record_cycle(kind, result, time.perf_counter() - apply_started, time.monotonic() - started)
+
+    def _resync(self):
+        return fetch_dataset(situation_change_id="0")
+
+    def _record_cycle(self, kind, result, apply_seconds, total_seconds):
+        self.last_success_at = time.time()
+        self.last_error = None
+        self.last_cycle = {
+            "kind": kind,
+            "objects": len(result.situations),
+            "bytes": result.bytes_received,
+            "parse_seconds": result.parse_seconds,
+            "apply_seconds": apply_seconds,
+            "total_seconds": total_seconds,
+        }
+        logging.info(
+            f"Traffic ingest ({kind}) finished in {total_seconds:.2f}s: "
+            f"{self.last_cycle['objects']} objects, {result.bytes_received} bytes, "
+            f"parse {result.parse_seconds * 1000:.1f} ms, apply {apply_seconds * 1000:.1f} ms."
+        )
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._loop, name="traffic-ingester", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _loop(self):
+        while not self._stop.is_set():
+            try:
+                self.run_once()
+                if self.snapshot_file is not None:
+                    self.snapshot_file.save_if_due(self.store.snapshot, self.situation_change_id)
+            except Exception as e:
+                # Behåll den senaste lyckade datan och försök igen vid nästa intervall.
+                self.last_error = str(e)
+                logging.error(f"Traffic ingest failed: {e}")
+            self._stop.wait(self.interval_seconds)
+
+
+traffic_ingester = TrafficIngester(
+    traffic_store, TRAFFIC_INGEST_INTERVAL_SECONDS, TRAFFIC_INGEST_MODE,
+    snapshot_file=StoreSnapshotFile(TRAFFIC_STORE_SNAPSHOT_PATH) if TRAFFIC_STORE_SNAPSHOT_PATH else None,
+)
+
+
+def start_traffic_ingester():
+    """
+    Läser in den senaste snapshot-filen (om någon) och startar bakgrundsinhämtningen om den
+    är aktiverad och en API-nyckel finns.
+    """
+    if not TRAFFIC_INGEST_ENABLED:
+        logging.info("Traffic ingester disabled (TRAFFIC_INGEST_ENABLED=false).")
+        return
+    # Läses in synkront så att lagret är redo innan första förfrågan; första cykeln kan då
+    # fortsätta från det sparade LASTCHANGEID:t i stället för att hämta allt.
+    if traffic_ingester.snapshot_file is not None:
+        situation_change_id = load_store_snapshot(traffic_store, traffic_ingester.snapshot_file)
+        if traffic_ingester.mode == "incremental":
+            traffic_ingester.situation_change_id = situation_change_id
+    if not TRAFIKVERKET_API_KEY:
+        logging.error("Traffic ingester not started: Trafikverket API key not configured.")
+        return
+    traffic_ingester.start()
@@ -0,0 +1,321 @@
+# models/traffic_store.py
+
+# Processlokalt lager för trafikhändelser (Deviation) och fartkameror från Trafikverket.
+# Datan fylls på av bakgrundsinhämtningen (se models/traffic_ingester.py) och läses av
+# /api/traffic-info och /trafikinfo utan att något anrop till Trafikverket behövs.
+
+import logging
+import threading
+import time
+from collections import defaultdict
+from datetime import datetime
+
+
+def parse_trafikverket_time(value):
+    """Parsar en tidsstämpel från Trafikverket (ISO 8601) till epoch-sekunder, eller None."""
+    if not value or not isinstance(value, str):
+        return None
+    try:
+        return datetime.fromisoformat(value).timestamp()
+    except ValueError:
+        return None
+
+
+def _as_list(value):
+    # Trafikverket returnerar ibland ett enskilt objekt/värde i stället för en lista.
+    if value is None:
+        return []
+    return value if isinstance(value, list) else [value]
+
+
+class TrafficSnapshot:
+    """
+    Oföränderlig ögonblicksbild av hela datamängden med färdiga index.
+    En ny instans byggs vid varje uppdatering och byts in atomärt, så läsare behöver inget lås.
+    """
+
+    def __init__(self, situations, cameras, version):
+        self.version = version
+        self.created_at = time.time()
+
+        self.deviations = {}             # Deviation.Id -> deviation
+        self.situation_of = {}           # Deviation.Id -> Situation.Id
+        self.situations = {}             # Situation.Id -> [Deviation.Id]
+        self.by_county = defaultdict(set)
+        self.by_message_type = defaultdict(set)
+        self.start_time = {}             # Deviation.Id -> StartTime som epoch-sekunder
+
+        for situation in situations:
+            if situation.get("Deleted"):
+                continue
+            situation_id = situation.get("Id")
+            deviation_ids = []
+            for deviation in _as_list(situation.get("Deviation")):
+                dev_id = deviation.get("Id")
+                if not dev_id:
+                    continue
+                deviation_ids.append(dev_id)
+                self.deviations[dev_id] = deviation
+                self.situation_of[dev_id] = situation_id or dev_id
+                for county_no in _as_list(deviation.get("CountyNo")):
+                    self.by_county[county_no].add(dev_id)
+                message_type = deviation.get("MessageTypeValue")
+                if message_type:
+                    self.by_message_type[message_type].add(dev_id)
+                self.start_time[dev_id] = parse_trafikverket_time(deviation.get("StartTime"))
+            if deviation_ids:
+                self.situations[situation_id or deviation_ids[0]] = deviation_ids
+
+        # Samma sortering som Trafikverket-frågan använde (Deviation.CreationTime DESC), med Id
+        # som avgörare så att ordningen är total (behövs för markörerna i /trafikinfo).
+        # Förberäknad så att uppslag bara behöver sortera på en heltalsrang.
+        ordered = sorted(
+            self.deviations.values(),
+            key=lambda d: (d.get("CreationTime") or "", d.get("Id") or ""),
+            reverse=True,
+        )
+        self.rank = {d["Id"]: i for i, d in enumerate(ordered)}
+
+        self.cameras = {}
+        self.cameras_by_county = defaultdict(list)
+        for camera in cameras:
+            camera_id = camera.get("Id")
+            if not camera_id or camera.get("Deleted"):
+                continue
+            self.cameras[camera_id] = camera
+            for county_no in _as_list(camera.get("CountyNo")):
+                self.cameras_by_county[county_no].append(camera)
+
+    def situation_items(self):
+        """Returnerar situationerna som dictar i Trafikverkets format, för att kunna bygga om lagret."""
+        return [
+            {"Id": situation_id, "Deviation": [self.deviations[dev_id] for dev_id in dev_ids]}
+            for situation_id, dev_ids in self.situations.items()
+        ]
+
+
+class DeviationStore:
+    """Håller den aktuella TrafficSnapshot och erbjuder uppslag per län, meddelandetyp och Id."""
+
+    def __init__(self):
+        self._write_lock = threading.Lock()
+        self._snapshot = TrafficSnapshot([], [], version=0)
+        self.ready = False  # Blir True efter första lyckade inhämtningen.
+        self._listeners = []
+
+    def add_listener(self, callback):
+        """Registrerar `callback(old_snapshot, new_snapshot)` som anropas efter varje uppdatering."""
+        self._listeners.append(callback)
+
+    def _notify(self, old_snapshot, new_snapshot):
+        for callback in self._listeners:
+            try:
+                callback(old_snapshot, new_snapshot)
+            except Exception as e:
+                logging.error(f"Traffic store listener {callback} failed: {e}", exc_info=True)
+
+    @property
+    def snapshot(self):
+        return self._snapshot
+
+    def replace_all(self, situations, cameras=None):
+        """
+        Ersätter hela datamängden med en ny inhämtning. Med cameras=None behålls de nuvarande
+        fartkamerorna (de hämtas separat, se models/camera_dataset.py).
+        """
+        with self._write_lock:
+            previous = self._snapshot
+            if cameras is None:
+                cameras = list(previous.cameras.values())
+            snapshot = TrafficSnapshot(situations, cameras, version=previous.version + 1)
+            self._snapshot = snapshot
+            self.ready = True
+            self._notify(previous, snapshot)
+        logging.info(
+            f"Traffic store updated to version {snapshot.version}: "
+            f"{len(snapshot.deviations)} deviations, {len(snapshot.cameras)} cameras."
+        )
+        return snapshot
+
+    def install_snapshot(self, snapshot):
+        """
+        Byter in en TrafficSnapshot som byggts utanför lagret (t.ex. från snapshot-filen vid
+        start). Den får nästa versionsnummer men behåller sin created_at, så att Age i svaren
+        visar hur gammal datan faktiskt är.
+        """
+        with self._write_lock:
+            previous = self._snapshot
+            snapshot.version = previous.version + 1
+            self._snapshot = snapshot
+            self.ready = True
+            self._notify(previous, snapshot)
+        logging.info(
+            f"Traffic store installed snapshot as version {snapshot.version}: "
+            f"{len(snapshot.deviations)} deviations, {len(snapshot.cameras)} cameras."
+        )
+        return snapshot
+
+    def replace_cameras(self, cameras):
+        """
+        Ersätter fartkamerorna men behåller trafikhändelserna. Påverkar inte `ready`,
+        som bara styrs av att trafikhändelser har hämtats.
+        """
+        with self._write_lock:
+            previous = self._snapshot
+            snapshot = TrafficSnapshot(previous.situation_items(), cameras, version=previous.version + 1)
+            self._snapshot = snapshot
+            self._notify(previous, snapshot)
+        logging.info(f"Traffic store cameras replaced (version {snapshot.version}): {len(snapshot.cameras)} cameras.")
+        return snapshot
+
+    def apply_changes(self, changed_situations, changed_cameras=()):
+        """
+        Applicerar en inkrementell ändring från Trafikverket (objekt ändrade sedan förra change id).
+        Objekt med Deleted=True tas bort, övriga ersätter tidigare objekt med samma Id.
+        Returnerar antalet (ändrade, borttagna) objekt. Versionen räknas bara upp om något ändrats.
+        """
+        if not changed_situations and not changed_cameras:
+            return 0, 0
+
+        with self._write_lock:
+            current = self._snapshot
+            situations = {situation["Id"]: situation for situation in current.situation_items()}
+            cameras = dict(current.cameras)
+            changed = removed = 0
+
+            for objects, target in ((changed_situations, situations), (changed_cameras, cameras)):
+                for obj in objects:
+                    obj_id = obj.get("Id")
+                    if not obj_id:
+                        continue
+                    if obj.get("Deleted"):
+                        if target.pop(obj_id, None) is not None:
+                            removed += 1
+                    else:
+                        target[obj_id] = obj
+                        changed += 1
+
+            snapshot = TrafficSnapshot(list(situations.values()), list(cameras.values()), version=current.version + 1)
+            self._snapshot = snapshot
+            self._notify(current, snapshot)
+        logging.info(
+            f"Traffic store delta applied (version {snapshot.version}): "
+            f"{changed} changed, {removed} removed objects."
+        )
+        return changed, removed
+
+    def get_deviation(self, dev_id):
+        return self._snapshot.deviations.get(dev_id)
+
+    def query_deviations(self, county_no=None, message_types=None, started_after=None, snapshot=None, deviation_ids=None):
+        """
+        Returnerar deviations som matchar filtren, sorterade på CreationTime (nyast först).
+        `message_types` är en samling MessageTypeValue; tom/None betyder alla typer.
+        `started_after` är epoch-sekunder; deviations som startade tidigare eller saknar
+        StartTime utesluts (samma regel som /trafikinfo använder mot Trafikverket direkt).
+        `deviation_ids` begränsar svaret till dessa Id:n (t.ex. träffar från det rumsliga indexet).
+        """
+        snapshot = snapshot or self._snapshot
+        if county_no is not None:
+            candidates = snapshot.by_county.get(county_no, set())
+        else:
+            candidates = None
+
+        if deviation_ids is not None:
+            candidates = set(deviation_ids) if candidates is None else candidates & set(deviation_ids)
+            candidates = {dev_id for dev_id in candidates if dev_id in snapshot.deviations}
+
+        if message_types:
+            by_type = set()
+            for message_type in message_types:
+                by_type |= snapshot.by_message_type.get(message_type, set())
+            candidates = by_type if candidates is None else candidates & by_type
+
+        if candidates is None:
+            candidates = snapshot.deviations.keys()
+
+        if started_after is not None:
+            start_times = snapshot.start_time
+            candidates = [
+                dev_id for dev_id in candidates
+                if start_times.get(dev_id) is not None and start_times[dev_id] > started_after
+            ]
+
+        ordered_ids = sorted(candidates, key=snapshot.rank.__getitem__)
+        return [snapshot.deviations[dev_id] for dev_id in ordered_ids]
+
+    def query_cameras(self, county_no=None, snapshot=None, camera_ids=None):
+        snapshot = snapshot or self._snapshot
+        if county_no is None:
+            cameras = list(snapshot.cameras.values())
+        else:
+            cameras = list(snapshot.cameras_by_county.get(county_no, []))
+        if camera_ids is not None:
+            cameras = [camera for camera in cameras if camera["Id"] in camera_ids]
+        return cameras
+
+    def build_response(self, county_no=None, message_types=None, snapshot=None, deviation_ids=None, camera_ids=None):
+        """
+        Bygger ett svar i samma form som Trafikverkets API (RESPONSE.RESULT[].Situation[].Deviation[]),
+        så att frontend kan läsa det precis som tidigare.
+        """
+        snapshot = snapshot or self._snapshot
+        deviations = self.query_deviations(county_no, message_types, snapshot=snapshot, deviation_ids=deviation_ids)
+
+        grouped = {}
+        for deviation in deviations:
+            situation_id = snapshot.situation_of.get(deviation["Id"])
+            grouped.setdefault(situation_id, []).append(deviation)
+
+        return {
+            "RESPONSE": {
+                "RESULT": [
+                    {"Situation": [{"Id": sid, "Deviation": devs} for sid, devs in grouped.items()]},
+                    {"TrafficSafetyCamera": self.query_cameras(county_no, snapshot=snapshot, camera_ids=camera_ids)},
+                ]
+            }
+        }
+
+
+class BackgroundListener:
+    """
+    Lyssnare som kör `callback(snapshot)` i en egen tråd, för härledda index som tar tid att
+    bygga (rumsligt index, kluster). Varken inläsningen av snapshot-filen vid start eller
+    inhämtningen behöver då vänta på dem. Kommer flera versioner medan en byggs, byggs bara
+    den senaste.
+    """
+
+    def __init__(self, callback, name):
+        self.callback = callback
+        self.name = name
+        self._pending = None
+        self._condition = threading.Condition()
+        self._thread = None
+
+    def __call__(self, old_snapshot, new_snapshot):
+        with self._condition:
+            self._pending = new_snapshot
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+                self._thread.start()
+            self._condition.notify()
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while self._pending is None:
+                    self._condition.wait()
+                snapshot, self._pending = self._pending, None
+            started = time.perf_counter()
+            try:
+                self.callback(snapshot)
+            except Exception as e:
+                logging.error(f"Background listener {self.name} failed: {e}", exc_info=True)
+                continue
+            logging.info(
+                f"{self.name} built for version {snapshot.version} in {(time.perf_counter() - started) * 1000:.1f} ms."
+            )
+
+
+# Delad instans för hela processen.
+traffic_store = DeviationStore()
@@ -0,0 +1,186 @@
+# models/traffic_stream.py
+
+# Server-Sent Events: skickar ändringar i traffic_store (tillagda, ändrade och borttagna
+# deviations) till anslutna kartor så fort inhämtningen har fått dem. Strömmen serveras av
+# Flask-appen (/api/traffic-info/stream i routes/traffic.py), med samma CORS-regler som övriga
+# /api-routes.
+#
+# I produktion körs appen med gunicorns gevent-arbetare (se gunicorn.conf.py). En vilande ström
+# är då en greenlet som väntar på sin kö, inte en tråd, så tusentals kartor kan vara anslutna
+# per arbetare. Utan gevent (t.ex. `python app.py`) håller varje ström en tråd, och då tas bara
+# ett fåtal emot; en synkron arbetare tar inte emot några alls. Klienter utöver gränsen får 503
+# och hämtar ändringarna via /api/traffic-info/changes.
+
+import os
+import json
+import logging
+import queue
+import threading
+
+from models.change_log import changes_payload, snapshot_changes, traffic_change_log
+from models.traffic_store import traffic_store
+
+# "false" stänger av strömmen (routen svarar då 503 och kartan använder /changes).
+TRAFFIC_STREAM_ENABLED = os.getenv("TRAFFIC_STREAM_ENABLED", "true").lower() == "true"
+# Max antal samtidiga strömmar per process med gevent. Ska vara lägre än gunicorns
+# worker_connections, så att vanliga förfrågningar alltid får plats.
+TRAFFIC_STREAM_MAX_CLIENTS = int(os.getenv("TRAFFIC_STREAM_MAX_CLIENTS", "5000"))
+# Max antal strömmar per process utan gevent, där varje ström håller en tråd.
+TRAFFIC_STREAM_THREADED_MAX_CLIENTS = int(os.getenv("TRAFFIC_STREAM_THREADED_MAX_CLIENTS", "4"))
+# Hur ofta en kommentarsrad skickas på vilande anslutningar, så att proxyer inte stänger dem.
+TRAFFIC_STREAM_HEARTBEAT_SECONDS = float(os.getenv("TRAFFIC_STREAM_HEARTBEAT_SECONDS", "20"))
+# Max antal händelser som får vänta hos en klient. En klient som inte hinner läsa kopplas
+# bort och återansluter med Last-Event-ID.
+TRAFFIC_STREAM_QUEUE_SIZE = 100
+# Hur länge (millisekunder) webbläsaren väntar innan den återansluter.
+TRAFFIC_STREAM_RETRY_MS = 5000
+
+
+def running_evented():
+    """True om processen körs med gevent (trådar och köer är då greenlets)."""
+    try:
+        from gevent import monkey
+    except ImportError:
+        return False
+    return monkey.is_module_patched("threading")
+
+
+def format_event(event, data, event_id=None):
+    """Kodar en SSE-händelse. `data` är redan JSON-kodad."""
+    lines = []
+    if event_id is not None:
+        lines.append(f"id: {event_id}")
+    lines.append(f"event: {event}")
+    lines.append(f"data: {data}")
+    return ("\n".join(lines) + "\n\n").encode("utf-8")
+
+
+class _Client:
+    def __init__(self, county_no, message_types, version):
+        self.filters = (county_no, message_types)
+        self.version = version  # Senaste versionen som klienten har fått.
+        self.queue = queue.Queue(maxsize=TRAFFIC_STREAM_QUEUE_SIZE)
+        self.dropped = False
+
+
+class TrafficStream:
+    """
+    Håller de anslutna klienterna och delar ut ändringar från traffic_store.
+
+    Registreras som lyssnare på lagret; lyssnaren körs i inhämtningstråden och lägger
+    händelserna i klienternas köer. Varje händelse kodas en gång per filterkombination
+    (län, meddelandetyper) och skickas sedan till alla klienter med samma filter.
+    """
+
+    def __init__(self, store, change_log, max_clients=TRAFFIC_STREAM_MAX_CLIENTS,
+                 threaded_max_clients=TRAFFIC_STREAM_THREADED_MAX_CLIENTS):
+        self.store = store
+        self.change_log = change_log
+        self.max_clients = max_clients
+        self.threaded_max_clients = threaded_max_clients
+        self._clients = set()
+        self._lock = threading.Lock()
+        self._started = False
+
+    @property
+    def client_count(self):
+        return len(self._clients)
+
+    def capacity(self, multithread):
+        """
+        Antal strömmar som processen tar emot. `multithread` är WSGI-miljöns wsgi.multithread;
+        en synkron arbetare (False) skulle låsas helt av en ström och tar därför inte emot någon.
+        """
+        if running_evented():
+            return self.max_clients
+        return self.threaded_max_clients if multithread else 0
+
+    def on_snapshot(self, old_snapshot, new_snapshot):
+        changes = snapshot_changes(old_snapshot, new_snapshot)
+        if changes:
+            self._publish(new_snapshot, changes)
+
+    def _publish(self, snapshot, changes):
+        encoded = {}
+        with self._lock:
+            for client in list(self._clients):
+                if snapshot.version <= client.version:
+                    continue  # Redan med i klientens första svar.
+                if client.filters not in encoded:
+                    payload = changes_payload(self.store, snapshot, changes, *client.filters)
+                    if payload["added"] or payload["updated"] or payload["removed"]:
+                        token = self.change_log.token(snapshot.version)
+                        payload["token"] = token
+                        encoded[client.filters] = format_event(
+                            "changes", json.dumps(payload, ensure_ascii=False, separators=(",", ":")), token
+                        )
+                    else:
+                        encoded[client.filters] = None
+                client.version = snapshot.version
+                if encoded[client.filters] is None:
+                    continue
+                try:
+                    client.queue.put_nowait(encoded[client.filters])
+                except queue.Full:
+                    client.dropped = True
+
+    def _initial_event(self, since, county_no, message_types):
+        """Första händelsen: ändringar sedan `since`, eller hela datamängden om den är okänd/för gammal."""
+        snapshot, changes = self.change_log.changes_since(since)
+        token = self.change_log.token(snapshot.version)
+        if not since:
+            # Ny klient som redan har hämtat datan via /api/traffic-info: bara aktuell token.
+            return snapshot.version, format_event("ready", json.dumps({"token": token}), token)
+        payload = changes_payload(self.store, snapshot, changes, county_no, message_types)
+        payload["token"] = token
+        event = "reset" if payload["full"] else "changes"
+        return snapshot.version, format_event(event, json.dumps(payload, ensure_ascii=False, separators=(",", ":")), token)
+
+    def open(self, since, county_no, message_types, multithread=True):
+        """
+        Registrerar en ny klient. Returnerar (klient, första händelsen), eller None om strömmen
+        är avstängd eller redan är full (se capacity).
+        """
+        capacity = self.capacity(multithread)
+        with self._lock:
+            if not self._started or len(self._clients) >= capacity:
+                return None
+            # Under låset, så att ingen ny version hinner delas ut mellan första händelsen och registreringen.
+            version, first_event = self._initial_event(since, county_no, message_types)
+            client = _Client(county_no, message_types, version)
+            self._clients.add(client)
+        return client, first_event
+
+    def close(self, client):
+        with self._lock:
+            self._clients.discard(client)
+
+    def events(self, client, first_event):
+        """Svarskroppen för en klient: första händelsen, sedan ändringar och heartbeats tills anslutningen stängs."""
+        try:
+            yield f"retry: {TRAFFIC_STREAM_RETRY_MS}\n\n".encode("utf-8") + first_event
+            while not client.dropped:
+                try:
+                    yield client.queue.get(timeout=TRAFFIC_STREAM_HEARTBEAT_SECONDS)
+                except queue.Empty:
+                    yield b": heartbeat\n\n"
+        finally:
+            # Körs även när klienten stänger anslutningen (skrivningen misslyckas och generatorn stängs).
+            self.close(client)
+
+    def start(self):
+        if self._started:
+            return
+        self.store.add_listener(self.on_snapshot)
+        self._started = True
+
+
+traffic_stream = TrafficStream(traffic_store, traffic_change_log)
+
+
+def start_traffic_stream():
+    """Börjar dela ut ändringar till /api/traffic-info/stream om TRAFFIC_STREAM_ENABLED är satt."""
+    if not TRAFFIC_STREAM_ENABLED:
+        logging.info("Traffic stream disabled (TRAFFIC_STREAM_ENABLED=false).")
+        return
+    traffic_stream.start()
@@ -0,0 +1,194 @@
+# models/upstream.py
+
+# Delade HTTP-klienter för alla utgående anrop (Trafikverket, SMS- och e-postservern, vår egen
+# /trafikinfo från pollern). Varje tjänst har en httpx-klient med egen anslutningspool och
+# keep-alive (HTTP/2 när servern stöder det), så TCP- och TLS-handskakningen görs en gång i
+# stället för vid varje anrop. Alla anrop har strikta timeouts och ett begränsat antal
+# omförsök med slumpad väntetid (jitter).
+
+import os
+import asyncio
+import logging
+import random
+import threading
+import time
+
+import httpx
+
+from models.metrics import UPSTREAM_RETRIES, time_upstream
+
+# Max tid (sekunder) för att etablera en anslutning respektive vänta på data.
+UPSTREAM_CONNECT_TIMEOUT_SECONDS = float(os.getenv("UPSTREAM_CONNECT_TIMEOUT_SECONDS", "3"))
+UPSTREAM_READ_TIMEOUT_SECONDS = float(os.getenv("UPSTREAM_READ_TIMEOUT_SECONDS", "20"))
+# Antal omförsök efter det första anropet, och basen för den exponentiella väntetiden.
+UPSTREAM_MAX_RETRIES = int(os.getenv("UPSTREAM_MAX_RETRIES", "2"))
+UPSTREAM_BACKOFF_SECONDS = float(os.getenv("UPSTREAM_BACKOFF_SECONDS", "0.25"))
+UPSTREAM_MAX_BACKOFF_SECONDS = 5.0
+
+# Statuskoder som tyder på ett tillfälligt fel hos mottagaren.
+RETRY_STATUS_CODES = {429, 502, 503, 504}
+
+try:
+    import h2  # noqa: F401  HTTP/2 kräver paketet h2.
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
+
+
+def backoff_delay(attempt, base=UPSTREAM_BACKOFF_SECONDS, cap=UPSTREAM_MAX_BACKOFF_SECONDS):
+    """Väntetid före omförsök nummer `attempt` (1, 2, ...): "full jitter" upp till base * 2^(attempt-1)."""
+    return random.uniform(0, min(cap, base * 2 ** (attempt - 1)))
+
+
+class UpstreamClient:
+    """
+    En pool av keep-alive-anslutningar till en extern tjänst.
+
+    Omförsök görs alltid vid anslutningsfel (då har inget skickats). Vid timeouts, avbrutna
+    anslutningar och statuskoderna i RETRY_STATUS_CODES görs omförsök bara om anropet är
+    idempotent: GET, eller retry=True för t.ex. Trafikverkets POST-frågor som bara läser data.
+    """
+
+    def __init__(self, service, max_retries=UPSTREAM_MAX_RETRIES, connect_timeout=UPSTREAM_CONNECT_TIMEOUT_SECONDS,
+                 read_timeout=UPSTREAM_READ_TIMEOUT_SECONDS, max_connections=20):
+        self.service = service
+        self.max_retries = max_retries
+        self._client = httpx.Client(
+            http2=HTTP2_AVAILABLE,
+            timeout=httpx.Timeout(read_timeout, connect=connect_timeout),
+            limits=httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections, keepalive_expiry=60),
+        )
+
+    def request(self, method, url, operation=None, retry=None, timeout=None, **kwargs):
+        """
+        Skickar ett anrop och returnerar ett httpx.Response (även för 4xx/5xx; anropa
+        raise_for_status() vid behov). Kastar httpx.HTTPError om alla försök misslyckas.
+        """
+        operation = operation or method.upper()
+        idempotent = method.upper() in ("GET", "HEAD", "OPTIONS") if retry is None else retry
+        if timeout is not None:
+            kwargs["timeout"] = timeout
+
+        with time_upstream(self.service, operation):
+            attempt = 0
+            while True:
+                try:
+                    response = self._client.request(method, url, **kwargs)
+                except (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout) as e:
+                    error = e
+                except httpx.TransportError as e:
+                    if not idempotent:
+                        raise
+                    error = e
+                else:
+                    if not (idempotent and response.status_code in RETRY_STATUS_CODES):
+                        return response
+                    error = None
+
+                attempt += 1
+                if attempt > self.max_retries:
+                    if error is not None:
+                        raise error
+                    return response
+                delay = backoff_delay(attempt)
+                UPSTREAM_RETRIES.inc(service=self.service, operation=operation)
+                logging.warning(
+                    f"Upstream {self.service} {operation} failed "
+                    f"({error or response.status_code}), retry {attempt}/{self.max_retries} in {delay:.2f}s"
+                )
+                time.sleep(delay)
+
+    def get(self, url, **kwargs):
+        return self.request("GET", url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request("POST", url, **kwargs)
+
+    def close(self):
+        self._client.close()
+
+
+class AsyncUpstreamClient:
+    """
+    Samma som UpstreamClient men med httpx.AsyncClient, för asyncio-kod (t.ex. pollern i
+    läget POLLER_MODE=async). En klient hör till den event-loop där den först används.
+    """
+
+    def __init__(self, service, max_retries=UPSTREAM_MAX_RETRIES, connect_timeout=UPSTREAM_CONNECT_TIMEOUT_SECONDS,
+                 read_timeout=UPSTREAM_READ_TIMEOUT_SECONDS, max_connections=20):
+        self.service = service
+        self.max_retries = max_retries
+        self._client = httpx.AsyncClient(
+            http2=HTTP2_AVAILABLE,
+            timeout=httpx.Timeout(read_timeout, connect=connect_timeout),
+            limits=httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections, keepalive_expiry=60),
+        )
+
+    async def request(self, method, url, operation=None, retry=None, timeout=None, **kwargs):
+        """Som UpstreamClient.request, men väntar med asyncio.sleep mellan försöken."""
+        operation = operation or method.upper()
+        idempotent = method.upper() in ("GET", "HEAD", "OPTIONS") if retry is None else retry
+        if timeout is not None:
+            kwargs["timeout"] = timeout
+
+        with time_upstream(self.service, operation):
+            attempt = 0
+            while True:
+                try:
+                    response = await self._client.request(method, url, **kwargs)
+                except (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout) as e:
+                    error = e
+                except httpx.TransportError as e:
+                    if not idempotent:
+                        raise
+                    error = e
+                else:
+                    if not (idempotent and response.status_code in RETRY_STATUS_CODES):
+                        return response
+                    error = None
+
+                attempt += 1
+                if attempt > self.max_retries:
+                    if error is not None:
+                        raise error
+                    return response
+                delay = backoff_delay(attempt)
+                UPSTREAM_RETRIES.inc(service=self.service, operation=operation)
+                logging.warning(
+                    f"Upstream {self.service} {operation} failed "
+                    f"({error or response.status_code}), retry {attempt}/{self.max_retries} in {delay:.2f}s"
+                )
+                await asyncio.sleep(delay)
+
+    async def get(self, url, **kwargs):
+        return await self.request("GET", url, **kwargs)
+
+    async def post(self, url, **kwargs):
+        return await self.request("POST", url, **kwargs)
+
+    async def aclose(self):
+        await self._client.aclose()
+
+
+_clients = {}
+_clients_lock = threading.Lock()
+_async_clients = {}
+
+
+def upstream(service):
+    """Returnerar processens delade UpstreamClient för `service` (skapas vid första anropet)."""
+    client = _clients.get(service)
+    if client is None:
+        with _clients_lock:
+            client = _clients.get(service)
+            if client is None:
+                client = _clients[service] = UpstreamClient(service)
+    return client
+
+
+def async_upstream(service):
+    """Returnerar processens delade AsyncUpstreamClient för `service` (anropas från event-loopen)."""
+    client = _async_clients.get(service)
+    if client is None:
+        client = _async_clients[service] = AsyncUpstreamClient(service)
+    return client
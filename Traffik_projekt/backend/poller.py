@@ -1,8 +1,15 @@
 import os
+import asyncio
+import threading
 import time
-import requests
+from contextlib import contextmanager
+from urllib.parse import urljoin
 from supabase import create_client
 from dotenv import load_dotenv
+from models.outbox import Outbox
+from models.poll_scheduler import CountyScheduler
+from models.sent_index import SentNotificationIndex
+from models.upstream import async_upstream, upstream
 
 #  Ladda miljövariabler från .env
 load_dotenv()
@@ -20,11 +27,72 @@ if not SUPABASE_URL or not SUPABASE_KEY:
 
 #  Initiera klient
 supabase = create_client(SUPABASE_URL, SUPABASE_KEY)
-INTERVAL_SECONDS = 600  # 10 minuter
+# Redan notifierade händelser; läses in vid start och kompletteras med en fråga per cykel.
+sent_index = SentNotificationIndex(supabase)
+# Upptäckta händelser köas här och skickas av utskicksarbetarna (se dispatch_worker).
+outbox = Outbox()
+INTERVAL_SECONDS = 600  # 10 minuter; startintervall per län, som CountyScheduler sedan anpassar
+# Hur ofta (sekunder) schemats statistik per län skrivs ut.
+POLLER_STATS_SECONDS = float(os.getenv("POLLER_STATS_SECONDS", "3600"))
 
-def already_sent(dev_id):
-    res = supabase.table("notifications").select("external_id").eq("external_id", dev_id).execute()
-    return len(res.data) > 0
+# "sync" (standard) behandlar län och händelser en i taget (poll). "async" behandlar dem
+# parallellt (se poll_async) och måste slås på uttryckligen.
+POLLER_MODE = os.getenv("POLLER_MODE", "sync").lower()
+# Max antal samtidiga anrop per tjänst i läget "async".
+POLLER_SUPABASE_CONCURRENCY = int(os.getenv("POLLER_SUPABASE_CONCURRENCY", "8"))
+POLLER_TRAFIKINFO_CONCURRENCY = int(os.getenv("POLLER_TRAFIKINFO_CONCURRENCY", "2"))
+# Antal utskicksarbetare, dvs. max antal samtidiga SMS-utskick (i båda lägena).
+POLLER_SMS_CONCURRENCY = int(os.getenv("POLLER_SMS_CONCURRENCY", "4"))
+# Hur länge (sekunder) en arbetare väntar innan den tittar i en tom kö igen.
+POLLER_DISPATCH_IDLE_SECONDS = float(os.getenv("POLLER_DISPATCH_IDLE_SECONDS", "2"))
+# Utskicksrouten svarar 202 med ett jobb; hur ofta (sekunder) arbetaren som mest frågar efter
+# jobbets status och hur länge den väntar innan försöket räknas som misslyckat. Första frågan
+# görs efter JOB_FIRST_POLL_SECONDS och väntetiden fördubblas sedan upp till POLLER_JOB_POLL_SECONDS.
+POLLER_JOB_POLL_SECONDS = float(os.getenv("POLLER_JOB_POLL_SECONDS", "1"))
+JOB_FIRST_POLL_SECONDS = 0.05
+POLLER_JOB_TIMEOUT_SECONDS = float(os.getenv("POLLER_JOB_TIMEOUT_SECONDS", "120"))
+
+
+class CycleTimer:
+    """
+    Mäter en pollcykel: total tid samt summerad tid och antal per steg. I läget "async" körs
+    stegen parallellt, så summan för ett steg kan bli större än cykelns totala tid.
+    """
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.stages = {}  # steg -> [sekunder, antal]
+
+    @contextmanager
+    def stage(self, name):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            entry = self.stages.setdefault(name, [0.0, 0])
+            entry[0] += time.perf_counter() - started
+            entry[1] += 1
+
+    def report(self):
+        total = time.perf_counter() - self.started
+        stages = ", ".join(f"{name} {seconds:.2f}s ({count})" for name, (seconds, count) in self.stages.items())
+        print(f"⏱️ Pollcykel klar på {total:.2f}s: {stages}")
+        return total
+
+def load_sent_index():
+    try:
+        count = sent_index.load()
+    except Exception as e:
+        # Inte kritiskt: refresh_sent_index frågar då efter alla händelser i första cykeln.
+        print(f" Kunde inte läsa in skickade notiser: {e}")
+        return
+    print(f"📒 {count} tidigare notiser inlästa")
+
+def refresh_sent_index(deviations_by_county):
+    """Kontrollerar alla händelser som inte finns i sent_index med en gemensam fråga."""
+    dev_ids = {dev.get("Id") for deviations in deviations_by_county.values() for dev in deviations}
+    queries = sent_index.refresh(dev_ids)
+    print(f"📒 {len(dev_ids)} händelser, {queries} Supabase-frågor för dubblettkontroll")
 
 def get_subscribers(county_no):
     # Hämta location_id för länet
@@ -38,50 +106,357 @@ def get_subscribers(county_no):
     res = supabase.table("subscriptions").select("user_id").eq("location_id", location_id).eq("active", True).execute()
     return [row["user_id"] for row in res.data]
 
-def poll():
-    for county_no in range(1, 26):  # Län 1–25
-        print(f"📡 Hämtar data för län {county_no}...")
-        try:
-            res = requests.get(TRAFIKINFO_URL, params={"county": county_no})
-            res.raise_for_status()
-            deviations = res.json()
+COUNTIES = range(1, 26)  # Län 1–25
+# Antal händelser per sida från /trafikinfo (max 500).
+PAGE_SIZE = 500
+
+def fetch_deviations_by_county(county_nos):
+    """
+    Hämtar alla händelser för länen, sida för sida via X-Next-Cursor, och delar upp dem per
+    län på CountyNo. En händelse som berör flera län hamnar under vart och ett av dem.
+    Returnerar ({län: [händelse, ...]}, antal förfrågningar).
+    """
+    by_county = {county_no: [] for county_no in county_nos}
+    params = {"county": ",".join(map(str, county_nos)), "limit": PAGE_SIZE}
+    requests = 0
+    while True:
+        requests += 1
+        res = upstream("trafikinfo").get(TRAFIKINFO_URL, params=params)
+        res.raise_for_status()
+        for dev in res.json():
+            for county_no in {int(c) for c in dev.get("CountyNo", [])}:
+                if county_no in by_county:
+                    by_county[county_no].append(dev)
+        next_cursor = res.headers.get("X-Next-Cursor")
+        if not next_cursor:
+            return by_county, requests
+        params["after"] = next_cursor
+
+def send_headers():
+    headers = {"Content-Type": "application/json"}
+    if API_KEY:  # httpx godtar inte None som värde
+        headers["X-API-KEY"] = API_KEY
+    return headers
+
+def report_schedule(scheduler):
+    print(f"🗓️ Schema per län (budget kvar {scheduler.budget_left()}/{scheduler.budget_per_hour} förfrågningar/h):")
+    for row in scheduler.stats():
+        print(
+            f"   Län {row['county_no']:>2}: intervall {row['interval']:.0f}s, nästa om {row['next_due_in']:.0f}s, "
+            f"{row['polls']} hämtningar, {row['new_deviations']} nya händelser, "
+            f"snittavstånd {row['avg_gap']}s, snittförsening {row['avg_lateness']}s"
+        )
+
+def poll(scheduler):
+    county_nos = scheduler.take_due()
+    if not county_nos:
+        return
+    timer = CycleTimer()
+    print(f"📡 Hämtar data för {len(county_nos)} län: {', '.join(map(str, county_nos))}...")
+    try:
+        with timer.stage("fetch"):
+            deviations_by_county, requests = fetch_deviations_by_county(county_nos)
+    except Exception as e:
+        scheduler.record_failure(county_nos)
+        print(f" Fel vid polling: {e}")
+        return
+    scheduler.record_poll(deviations_by_county, requests)
 
+    try:
+        with timer.stage("dedupe"):
+            refresh_sent_index(deviations_by_county)
+    except Exception as e:
+        print(f" Fel vid polling: {e}")
+        return
+
+    for county_no, deviations in deviations_by_county.items():
+        try:
             for dev in deviations:
                 dev_id = dev.get("Id")
-                if not dev_id or already_sent(dev_id):
+                if not dev_id:
+                    continue
+                if dev_id in sent_index:
                     continue
 
-                subscribers = get_subscribers(county_no)
+                with timer.stage("subscribers"):
+                    subscribers = get_subscribers(county_no)
                 if not subscribers:
                     continue
 
-                print(f"🚧 Skickar SMS för {dev_id} till {len(subscribers)} prenumeranter...")
+                with timer.stage("enqueue"):
+                    enqueue_notification(dev, county_no, len(subscribers))
+
+        except Exception as e:
+            print(f" Fel vid polling av län {county_no}: {e}")
+    timer.report()
+    report_outbox()
+
+
+# --- Utskick ---
+# Pollcykeln lägger bara jobb i outboxen; arbetarna skickar. Ett långsamt eller trasigt
+# SMS-API bromsar därför inte upptäckten, och misslyckade utskick försöks igen med backoff.
+
+class DispatchError(Exception):
+    pass
+
+def enqueue_notification(dev, county_no, subscriber_count):
+    # En händelse köas en gång, även om den berör flera län (samma som tidigare: första länet vinner).
+    # Händelsen följer med, eftersom /api/send_sms_for_deviation bygger SMS-texten av den.
+    if outbox.enqueue(dev["Id"], {"devId": dev["Id"], "countyNo": county_no, "deviation": dev}):
+        print(f"📥 SMS för {dev['Id']} köat till {subscriber_count} prenumeranter (län {county_no})")
+
+def report_outbox():
+    depth = outbox.depth()
+    print(f"📬 Utskickskö: {depth['ready']} redo, {depth['leased']} pågår, "
+          f"{depth['waiting']} väntar på omförsök, {depth['dead']} döda")
+
+def record_notification(payload):
+    supabase.table("notifications").insert({
+        "external_id": payload["devId"],
+        "county_id": payload["countyNo"]
+    }).execute()
+    sent_index.add(payload["devId"])
+
+def finish_job(job, error=None):
+    if error is None:
+        outbox.complete(job)
+        print(f" SMS för {job['key']} skickat och notis loggad")
+    elif outbox.fail(job, error, payload=job["payload"]):
+        print(f"☠️ SMS för {job['key']} gav upp efter {job['attempts']} försök: {error}")
+    else:
+        print(f" Fel vid SMS för {job['key']} (försök {job['attempts']}): {error}")
+
+def send_request_body(payload):
+    return {
+        "devId": payload["devId"],
+        "countyNo": payload["countyNo"],
+        "deviation": payload.get("deviation", {})
+    }
 
-                headers = {
-                    "Content-Type": "application/json",
-                    "X-API-KEY": API_KEY
-                }
+def accept_send_response(payload, send_res):
+    """
+    Tolkar svaret på utskicksanropet. 202 ger ett jobb att vänta på ("jobUrl" sparas med
+    outbox-jobbet, så att ett omförsök fortsätter vänta i stället för att skicka igen);
+    andra lyckade svar betyder att utskicket redan är klart.
+    """
+    if not send_res.is_success:
+        raise DispatchError(f"{send_res.status_code} - {send_res.text}")
+    if send_res.status_code == 202:
+        payload["jobUrl"] = urljoin(SEND_SMS_URL, send_res.json()["statusUrl"])
+    else:
+        payload["sent"] = True
 
-                send_res = requests.post(SEND_SMS_URL, json={
-                    "devId": dev_id,
-                    "countyNo": county_no
-                }, headers=headers)
+def accept_job_status(payload, status_res):
+    """
+    Tolkar svaret från /api/notification-jobs/<id>. Ett klart jobb sätter "sent". Ett
+    misslyckat eller försvunnet jobb kastar DispatchError; nästa försök gör då ett nytt
+    utskicksanrop, som bara skickar till dem som inte redan fått SMS:et.
+    """
+    if status_res.status_code == 404:
+        payload.pop("jobUrl", None)
+        raise DispatchError("Utskicksjobbet finns inte längre")
+    status_res.raise_for_status()
+    status = status_res.json()
+    if status["status"] == "done":
+        payload.pop("jobUrl", None)
+        payload["sent"] = True
+    elif status["status"] == "failed":
+        payload.pop("jobUrl", None)
+        raise DispatchError(f"Utskicksjobbet misslyckades: {status.get('error')}")
 
-                if send_res.ok:
-                    supabase.table("notifications").insert({
-                        "external_id": dev_id,
-                        "county_id": county_no
-                    }).execute()
-                    print(" SMS skickat och notis loggad")
-                else:
-                    print(f" Fel vid SMS: {send_res.status_code} - {send_res.text}")
+def dispatch_job(job):
+    payload = job["payload"]
+    # "sent" sparas med jobbet om bara loggningen misslyckas, så att omförsöket inte skickar SMS:et igen.
+    if not payload.get("sent") and not payload.get("jobUrl"):
+        send_res = upstream("notification_api").post(SEND_SMS_URL, json=send_request_body(payload),
+                                                     headers=send_headers(), operation="send_sms_for_deviation")
+        accept_send_response(payload, send_res)
+    deadline = time.monotonic() + POLLER_JOB_TIMEOUT_SECONDS
+    delay = JOB_FIRST_POLL_SECONDS
+    while not payload.get("sent"):
+        if time.monotonic() > deadline:
+            raise DispatchError(f"Utskicksjobbet är inte klart efter {POLLER_JOB_TIMEOUT_SECONDS:.0f} s")
+        time.sleep(delay)
+        delay = min(POLLER_JOB_POLL_SECONDS, delay * 2)
+        status_res = upstream("notification_api").get(payload["jobUrl"], headers=send_headers(),
+                                                      operation="notification_job")
+        accept_job_status(payload, status_res)
+    record_notification(payload)
 
+def dispatch_worker():
+    while True:
+        job = outbox.lease()
+        if job is None:
+            time.sleep(POLLER_DISPATCH_IDLE_SECONDS)
+            continue
+        try:
+            dispatch_job(job)
         except Exception as e:
-            print(f" Fel vid polling av län {county_no}: {e}")
+            finish_job(job, e)
+        else:
+            finish_job(job)
 
-if __name__ == "__main__":
-    print(" Startar trafiknotis-poller")
+def start_dispatch_workers():
+    for i in range(POLLER_SMS_CONCURRENCY):
+        threading.Thread(target=dispatch_worker, name=f"dispatch-{i}", daemon=True).start()
+
+
+# --- Asynkront läge ---
+# Supabase-klienten är synkron, så dess anrop körs i trådar (asyncio.to_thread). Semaforerna
+# begränsar hur många anrop som pågår samtidigt mot varje tjänst.
+
+class PollLimits:
+    def __init__(self):
+        self.supabase = asyncio.Semaphore(POLLER_SUPABASE_CONCURRENCY)
+        self.trafikinfo = asyncio.Semaphore(POLLER_TRAFIKINFO_CONCURRENCY)
+
+async def supabase_call(limits, func, *args):
+    async with limits.supabase:
+        return await asyncio.to_thread(func, *args)
+
+async def fetch_deviations_by_county_async(county_nos, limits):
+    """Som fetch_deviations_by_county, med den asynkrona klienten."""
+    by_county = {county_no: [] for county_no in county_nos}
+    params = {"county": ",".join(map(str, county_nos)), "limit": PAGE_SIZE}
+    requests = 0
     while True:
-        poll()
-        print(f" Väntar {INTERVAL_SECONDS} sekunder...\n")
-        time.sleep(INTERVAL_SECONDS)
\ No newline at end of file
+        requests += 1
+        async with limits.trafikinfo:
+            res = await async_upstream("trafikinfo").get(TRAFIKINFO_URL, params=params)
+        res.raise_for_status()
+        for dev in res.json():
+            for county_no in {int(c) for c in dev.get("CountyNo", [])}:
+                if county_no in by_county:
+                    by_county[county_no].append(dev)
+        next_cursor = res.headers.get("X-Next-Cursor")
+        if not next_cursor:
+            return by_county, requests
+        params["after"] = next_cursor
+
+async def process_deviation_async(county_no, dev, subscribers, timer):
+    dev_id = dev["Id"]
+    if dev_id in sent_index:
+        return
+    # Prenumeranterna hämtas en gång per län och cykel, och bara om något ska skickas.
+    with timer.stage("subscribers"):
+        recipients = await subscribers()
+    if not recipients:
+        return
+    with timer.stage("enqueue"):
+        await asyncio.to_thread(enqueue_notification, dev, county_no, len(recipients))
+
+async def process_county_async(county_no, deviations, limits, timer):
+    subscribers_task = None
+
+    def subscribers():
+        nonlocal subscribers_task
+        if subscribers_task is None:
+            subscribers_task = asyncio.ensure_future(supabase_call(limits, get_subscribers, county_no))
+        return asyncio.shield(subscribers_task)
+
+    results = await asyncio.gather(
+        *(process_deviation_async(county_no, dev, subscribers, timer) for dev in deviations if dev.get("Id")),
+        return_exceptions=True,
+    )
+    for error in (r for r in results if isinstance(r, Exception)):
+        print(f" Fel vid polling av län {county_no}: {error}")
+
+async def poll_async(limits, scheduler):
+    """En pollcykel där de aktuella länen och deras händelser behandlas parallellt inom PollLimits."""
+    county_nos = scheduler.take_due()
+    if not county_nos:
+        return
+    timer = CycleTimer()
+    print(f"📡 Hämtar data för {len(county_nos)} län: {', '.join(map(str, county_nos))} (async)...")
+    try:
+        with timer.stage("fetch"):
+            deviations_by_county, requests = await fetch_deviations_by_county_async(county_nos, limits)
+    except Exception as e:
+        scheduler.record_failure(county_nos)
+        print(f" Fel vid polling: {e}")
+        return
+    scheduler.record_poll(deviations_by_county, requests)
+
+    try:
+        with timer.stage("dedupe"):
+            await supabase_call(limits, refresh_sent_index, deviations_by_county)
+    except Exception as e:
+        print(f" Fel vid polling: {e}")
+        return
+
+    await asyncio.gather(*(
+        process_county_async(county_no, deviations, limits, timer)
+        for county_no, deviations in deviations_by_county.items()
+    ))
+    timer.report()
+    await asyncio.to_thread(report_outbox)
+
+async def dispatch_job_async(job, limits):
+    """Som dispatch_job, med den asynkrona klienten."""
+    payload = job["payload"]
+    if not payload.get("sent") and not payload.get("jobUrl"):
+        send_res = await async_upstream("notification_api").post(SEND_SMS_URL, json=send_request_body(payload),
+                                                                 headers=send_headers(), operation="send_sms_for_deviation")
+        accept_send_response(payload, send_res)
+    deadline = time.monotonic() + POLLER_JOB_TIMEOUT_SECONDS
+    delay = JOB_FIRST_POLL_SECONDS
+    while not payload.get("sent"):
+        if time.monotonic() > deadline:
+            raise DispatchError(f"Utskicksjobbet är inte klart efter {POLLER_JOB_TIMEOUT_SECONDS:.0f} s")
+        await asyncio.sleep(delay)
+        delay = min(POLLER_JOB_POLL_SECONDS, delay * 2)
+        status_res = await async_upstream("notification_api").get(payload["jobUrl"], headers=send_headers(),
+                                                                  operation="notification_job")
+        accept_job_status(payload, status_res)
+    await supabase_call(limits, record_notification, payload)
+
+async def dispatch_worker_async(limits):
+    while True:
+        job = await asyncio.to_thread(outbox.lease)
+        if job is None:
+            await asyncio.sleep(POLLER_DISPATCH_IDLE_SECONDS)
+            continue
+        try:
+            await dispatch_job_async(job, limits)
+        except Exception as e:
+            await asyncio.to_thread(finish_job, job, e)
+        else:
+            await asyncio.to_thread(finish_job, job)
+
+async def run_async():
+    # En och samma event-loop för alla cykler, så att de asynkrona klienternas anslutningar återanvänds.
+    limits = PollLimits()
+    scheduler = CountyScheduler(COUNTIES, INTERVAL_SECONDS)
+    next_report = time.monotonic() + POLLER_STATS_SECONDS
+    await asyncio.to_thread(load_sent_index)
+    # Referenserna behålls så att arbetarnas tasks inte städas bort.
+    workers = [asyncio.create_task(dispatch_worker_async(limits)) for _ in range(POLLER_SMS_CONCURRENCY)]
+    while True:
+        await poll_async(limits, scheduler)
+        if time.monotonic() >= next_report:
+            report_schedule(scheduler)
+            next_report = time.monotonic() + POLLER_STATS_SECONDS
+        wait = scheduler.seconds_until_due()
+        print(f" Väntar {wait:.0f} sekunder...\n")
+        await asyncio.sleep(wait)
+
+def run():
+    scheduler = CountyScheduler(COUNTIES, INTERVAL_SECONDS)
+    next_report = time.monotonic() + POLLER_STATS_SECONDS
+    load_sent_index()
+    start_dispatch_workers()
+    while True:
+        poll(scheduler)
+        if time.monotonic() >= next_report:
+            report_schedule(scheduler)
+            next_report = time.monotonic() + POLLER_STATS_SECONDS
+        wait = scheduler.seconds_until_due()
+        print(f" Väntar {wait:.0f} sekunder...\n")
+        time.sleep(wait)
+
+if __name__ == "__main__":
+    print(f" Startar trafiknotis-poller ({POLLER_MODE})")
+    if POLLER_MODE == "async":
+        asyncio.run(run_async())
+    else:
+        run()
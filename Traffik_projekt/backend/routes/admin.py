@@ -5,6 +5,7 @@ import stripe
 import os
 
 from models.auth_utils import require_authenticated, require_role
+from models.metrics import time_upstream
 
 admin_blueprint = Blueprint('admin', __name__, url_prefix= '/api/admin')
 
@@ -19,10 +20,11 @@ def admin_login():
 
     try:
         # Logga in med Supabase Auth
-        result = supabase.auth.sign_in_with_password({
-            "email": email,
-            "password": password
-        })
+        with time_upstream("supabase", "auth.sign_in_with_password"):
+            result = supabase.auth.sign_in_with_password({
+                "email": email,
+                "password": password
+            })
 
         session = result.session
         user = result.user
@@ -441,10 +443,11 @@ def create_reseller():
             return jsonify({"error": "Domänen finns redan i systemet."}), 400
         
         #Skapar inlogg för ny reseller i supabase auth.
-        auth_result = supabase.auth.sign_up({
-            "email": email,
-            "password": password
-        })
+        with time_upstream("supabase", "auth.sign_up"):
+            auth_result = supabase.auth.sign_up({
+                "email": email,
+                "password": password
+            })
 
         user = auth_result.user
         if not user: 
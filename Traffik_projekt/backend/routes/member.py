@@ -1,5 +1,6 @@
 from flask import Blueprint, request, jsonify
 from models.supabase_client import supabase
+from models.metrics import instrument_supabase, time_upstream
 from supabase import create_client, Client
 import os
 from flask_cors import cross_origin
@@ -44,10 +45,11 @@ def signup():
             return jsonify({"error": f"Ingen reseller med id {reseller_id} hittades"}), 400
 
         # Skapa Supabase-användare
-        result = supabase.auth.sign_up({
-            "email": email,
-            "password": password
-        })
+        with time_upstream("supabase", "auth.sign_up"):
+            result = supabase.auth.sign_up({
+                "email": email,
+                "password": password
+            })
 
         user = result.user
         if not user:
@@ -85,10 +87,11 @@ def login():
     password = data.get("password")
 
     try:
-        result = supabase.auth.sign_in_with_password({
-            "email": email,
-            "password": password
-        })
+        with time_upstream("supabase", "auth.sign_in_with_password"):
+            result = supabase.auth.sign_in_with_password({
+                "email": email,
+                "password": password
+            })
 
         session = result.session
         user = result.user
@@ -114,12 +117,13 @@ def forgot_password():
     email = data.get("email")
 
     try:
-        supabase.auth.reset_password_for_email(
-            email,
-            {
-                "redirect_to": "http://127.0.0.1:5500/Traffik_projekt/frontend/src/index.html#/reset-password"
-            }
-        )
+        with time_upstream("supabase", "auth.reset_password_for_email"):
+            supabase.auth.reset_password_for_email(
+                email,
+                {
+                    "redirect_to": "http://127.0.0.1:5500/Traffik_projekt/frontend/src/index.html#/reset-password"
+                }
+            )
         return jsonify({"message": "Återställningslänk skickad till din e-post."}), 200
     except Exception as e:
         return jsonify({"error": str(e)}), 400
@@ -139,15 +143,17 @@ def reset_password():
     try:
         url = os.getenv("SUPABASE_URL")
         key = os.getenv("SUPABASE_SERVICE_ROLE_KEY")
-        user_client: Client = create_client(url, key)
+        user_client: Client = instrument_supabase(create_client(url, key))
 
         # Sätt session med både access och refresh token
-        user_client.auth.set_session(
-            access_token=access_token,
-            refresh_token=refresh_token
-        )
-
-        res = user_client.auth.update_user({"password": new_password})
+        with time_upstream("supabase", "auth.set_session"):
+            user_client.auth.set_session(
+                access_token=access_token,
+                refresh_token=refresh_token
+            )
+
+        with time_upstream("supabase", "auth.update_user"):
+            res = user_client.auth.update_user({"password": new_password})
         return jsonify({"message": "Lösenordet har uppdaterats!"}), 200
 
     except Exception as e:
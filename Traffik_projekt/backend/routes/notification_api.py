@@ -1,17 +1,20 @@
 from datetime import timezone
 from flask import Blueprint, request, jsonify
 from supabase import create_client
-import requests
 import os
 import random
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
+from models.metrics import instrument_supabase
+from models.upstream import upstream
+from models.notification_jobs import NotificationJobs, DONE, FAILED
 
 notification_api = Blueprint("notification_api", __name__, url_prefix="/api")
 
 # Supabase-anslutning
 SUPABASE_URL = os.getenv("SUPABASE_URL")
 SUPABASE_KEY = os.getenv("SUPABASE_KEY")
-supabase = create_client(SUPABASE_URL, SUPABASE_KEY)
+supabase = instrument_supabase(create_client(SUPABASE_URL, SUPABASE_KEY))
 
 # Externa tjänster
 TRAFIKVERKET_API = os.getenv("TRAFIKVERKET_PROXY_URL")
@@ -19,6 +22,178 @@ SMS_SERVER_URL = os.getenv("RENDER_SMS_URL")
 EMAIL_SERVER_URL = os.getenv("RENDER_EMAIL_URL")
 API_KEY = os.getenv("X_API_KEY")  # Hämtas från .env
 
+# PostgREST (Supabase) returnerar som mest så här många rader per fråga.
+SUPABASE_PAGE_SIZE = 1000
+
+# Mottagare per anrop till SMS- respektive mailservern, och hur många anrop som görs samtidigt.
+NOTIFY_SMS_BATCH_SIZE = int(os.getenv("NOTIFY_SMS_BATCH_SIZE", "100"))
+NOTIFY_EMAIL_BATCH_SIZE = int(os.getenv("NOTIFY_EMAIL_BATCH_SIZE", "50"))
+NOTIFY_SEND_CONCURRENCY = int(os.getenv("NOTIFY_SEND_CONCURRENCY", "4"))
+
+# Utskicken körs som bakgrundsjobb; routerna svarar 202 med jobbets id.
+notification_jobs = NotificationJobs()
+
+
+def fetch_all(build_query):
+    """Kör frågan från build_query() sida för sida och returnerar alla rader."""
+    rows = []
+    start = 0
+    while True:
+        res = build_query().range(start, start + SUPABASE_PAGE_SIZE - 1).execute()
+        rows.extend(res.data)
+        if len(res.data) < SUPABASE_PAGE_SIZE:
+            return rows
+        start += SUPABASE_PAGE_SIZE
+
+
+def resolve_recipients(location_id, dev_id, channel, contact_field):
+    """
+    Aktiva prenumeranter på platsen som har `contact_field` ("phone" eller "email") och inte
+    redan fått notisen för dev_id i kanalen: [{"user_id", contact_field, "failed"}, ...].
+    "failed" är True om ett tidigare utskick till användaren misslyckades (raden finns redan).
+
+    Görs med två frågor (plus sidindelning per 1000 rader), oberoende av antalet prenumeranter:
+    prenumerationerna med användarnas kontaktuppgift (inbäddad users!inner) och de befintliga
+    notiserna för händelsen i kanalen. Att utesluta redan notifierade användare (anti-join) görs
+    här i Python; i en enda fråga skulle det kräva en databasfunktion eller vy, som schemat
+    inte har.
+    """
+    subscriptions = fetch_all(lambda: supabase.table("subscriptions")
+                              .select(f"user_id, users!inner({contact_field})")
+                              .eq("location_id", location_id).eq("active", True).order("user_id"))
+    notified, failed = set(), set()
+    for row in fetch_all(lambda: supabase.table("notifications").select("user_id, status")
+                         .eq("external_id", dev_id).eq("channel", channel).order("user_id")):
+        (failed if row.get("status") == "failed" else notified).add(row["user_id"])
+
+    recipients = []
+    for sub in subscriptions:
+        user_id = sub["user_id"]
+        user = sub.get("users") or {}
+        if isinstance(user, list):  # Om relationen inte är många-till-en returneras en lista.
+            user = user[0] if user else {}
+        contact = user.get(contact_field)
+        if not contact or user_id in notified:
+            continue
+        notified.add(user_id)  # En användare med flera prenumerationer på platsen får ett utskick.
+        recipients.append({"user_id": user_id, contact_field: contact, "failed": user_id in failed})
+    return recipients
+
+
+def record_notifications(recipients, dev_id, channel, status="sent"):
+    """
+    Loggar utskicket för mottagarna med status "sent" eller "failed". Användare som redan har
+    en misslyckad rad får den uppdaterad, övriga läggs till med en insert, så att det blir en
+    rad per användare, händelse och kanal.
+    """
+    retried = [r["user_id"] for r in recipients if r.get("failed")]
+    new = [r for r in recipients if not r.get("failed")]
+    if retried and status != "failed":
+        supabase.table("notifications").update({"status": status}) \
+            .eq("external_id", dev_id).eq("channel", channel).in_("user_id", retried).execute()
+    if new:
+        supabase.table("notifications").insert([
+            {"user_id": r["user_id"], "external_id": dev_id, "channel": channel, "status": status}
+            for r in new
+        ]).execute()
+
+
+def send_in_batches(service, url, recipients, contact_field, build_payload, dev_id, channel, batch_size,
+                    on_batch=None):
+    """
+    Delar upp mottagarna i grupper om batch_size och skickar grupperna parallellt (högst
+    NOTIFY_SEND_CONCURRENCY åt gången). build_payload(adresser) ger anropets JSON. Varje grupp
+    loggas i notifications för sig när den är klar, så ett fel i en grupp stoppar inte de
+    andra och ett omförsök av hela utskicket skickar bara till dem som inte fått notisen.
+    on_batch(skickade, misslyckade) anropas efter varje grupp.
+    Returnerar (antal skickade, antal misslyckade, [felmeddelanden]).
+    """
+    headers = {
+        "Content-Type": "application/json",
+        "X-API-KEY": API_KEY
+    }
+    batches = [recipients[i:i + batch_size] for i in range(0, len(recipients), max(1, batch_size))]
+
+    def record_batch(batch, status):
+        # Ett fel i loggningen får inte avbryta de andra grupperna, och en skickad grupp räknas
+        # som skickad även om raderna inte kunde skrivas.
+        try:
+            record_notifications(batch, dev_id, channel, status=status)
+        except Exception as e:
+            print(f"Kunde inte logga {channel}-utskick ({status}) för {len(batch)} mottagare av {dev_id}:", e)
+
+    def send_batch(batch):
+        payload = build_payload([r[contact_field] for r in batch])
+        try:
+            # Ett utskick är inte idempotent, så omförsök görs bara om anslutningen aldrig kom upp.
+            res = upstream(service).post(url, json=payload, headers=headers, operation="send")
+            res.raise_for_status()
+        except Exception as e:
+            print(f"Fel vid {channel}-utskick till {len(batch)} mottagare:", e)
+            record_batch(batch, "failed")
+            result = 0, len(batch), str(e)
+        else:
+            record_batch(batch, "sent")
+            result = len(batch), 0, None
+        if on_batch:
+            on_batch(result[0], result[1])
+        return result
+
+    with ThreadPoolExecutor(max_workers=max(1, min(NOTIFY_SEND_CONCURRENCY, len(batches)))) as pool:
+        results = list(pool.map(send_batch, batches))
+    sent = sum(r[0] for r in results)
+    failed = sum(r[1] for r in results)
+    return sent, failed, [r[2] for r in results if r[2]]
+
+
+# Kanal -> (tjänst i upstream, url, kontaktfält, gruppstorlek, svar när ingen ska ha notisen, svar när den är skickad)
+CHANNELS = {
+    "sms": ("sms", SMS_SERVER_URL, "phone", NOTIFY_SMS_BATCH_SIZE,
+            "Alla har redan fått detta sms eller saknar telefonnummer", "Skickade till {count} mottagare"),
+    "email": ("email", EMAIL_SERVER_URL, "email", NOTIFY_EMAIL_BATCH_SIZE,
+              "Alla har redan fått mail eller saknar e-post", "Skickade mail till {count} mottagare"),
+}
+
+
+def deliver_notifications(job_id, channel, dev_id, location_id, build_payload):
+    """
+    Bakgrundsjobbet för ett utskick: hämtar mottagarna och skickar i grupper, med förloppet i
+    notification_jobs. Jobbet blir "failed" om någon grupp misslyckades; ett nytt anrop för
+    händelsen skickar då bara till dem som inte fått notisen.
+    """
+    service, url, contact_field, batch_size, nobody_message, sent_message = CHANNELS[channel]
+    recipients = resolve_recipients(location_id, dev_id, channel, contact_field)
+    print(f"Mottagare för {dev_id} ({channel}):", len(recipients))
+    notification_jobs.update(job_id, resolved=len(recipients))
+
+    if not recipients:
+        notification_jobs.update(job_id, status=DONE, message=nobody_message)
+        return
+
+    sent, failed, errors = send_in_batches(
+        service, url, recipients, contact_field, build_payload, dev_id, channel, batch_size,
+        on_batch=lambda sent, failed: notification_jobs.add_progress(job_id, sent, failed)
+    )
+    if failed:
+        notification_jobs.update(job_id, status=FAILED,
+                                 error=f"{failed} av {sent + failed} mottagare fick inget utskick: {'; '.join(errors[:5])}"[:1000])
+    else:
+        notification_jobs.update(job_id, status=DONE, message=sent_message.format(count=sent))
+
+
+def enqueue_delivery(channel, dev_id, county_no, location_id, build_payload):
+    """Lägger upp (eller återanvänder) jobbet och svarar 202 med dess id."""
+    job, created = notification_jobs.create(channel, dev_id, county_no)
+    if created:
+        notification_jobs.submit(job["id"], deliver_notifications, channel, dev_id, location_id, build_payload)
+    else:
+        print(f"Utskick för {dev_id} ({channel}) pågår redan som jobb {job['id']}")
+    status_url = f"{notification_api.url_prefix}/notification-jobs/{job['id']}"
+    response = jsonify({"jobId": job["id"], "status": job["status"], "statusUrl": status_url})
+    response.headers["Location"] = status_url
+    return response, 202
+
+
 @notification_api.route("/send_sms_for_deviation", methods=["POST", "OPTIONS"])
 def send_sms_for_deviation():
     print(" Route: /api/send_sms_for_deviation REACHED")
@@ -54,13 +229,6 @@ def send_sms_for_deviation():
 
         print("Hittad plats:", location_id)
 
-        # Hämta aktiva prenumeranter
-        subscriptions = supabase.table("subscriptions").select("user_id") \
-            .eq("location_id", location_id).eq("active", True).execute()
-
-        if not subscriptions.data:
-            return jsonify({"message": "Inga aktiva prenumeranter"}), 200
-
         # Förbered sms-text
         header = deviation.get("Header", "Trafikstörning") or "Trafikstörning"
         message_text = deviation.get("Message", "")
@@ -82,63 +250,16 @@ def send_sms_for_deviation():
             f"Läs mer: {link}"
         )
 
-        # Hämta mottagare
-        recipients = []
-        for sub in subscriptions.data:
-            user_id = sub["user_id"]
-
-            # Kontrollera dubblett
-            existing_notification = supabase.table("notifications").select("id") \
-                .eq("user_id", user_id).eq("external_id", dev_id).eq("channel", "sms").execute()
-            if existing_notification.data:
-                continue
-
-            user_data = supabase.table("users").select("phone").eq("user_id", user_id).execute()
-            if not user_data.data:
-                continue
-
-            phone = user_data.data[0].get("phone")
-            if phone:
-                recipients.append({
-                    "user_id": user_id,
-                    "phone": phone
-                })
-
-        print("📲 Mottagare:", recipients)
-
-        if not recipients:
-            return jsonify({"message": "Alla har redan fått detta sms eller saknar telefonnummer"}), 200
-
-        # Skicka sms
+        # Mottagarna hämtas och sms:en skickas i grupper av ett bakgrundsjobb
         sms_payload = {
-            "to": [r["phone"] for r in recipients],
             "message": composed_message,
             "from": "TrafikInfo",
             "shortLinks": True
         }
 
-        headers = {
-            "Content-Type": "application/json",
-            "X-API-KEY": API_KEY
-        }
-
         print("Payload till HelloSMS:", sms_payload)
-        sms_res = requests.post(SMS_SERVER_URL, json=sms_payload, headers=headers)
-        sms_res.raise_for_status()
-
-        # Logga varje sms som skickats
-        for r in recipients:
-            supabase.table("notifications").insert({
-                "user_id": r["user_id"],
-                "external_id": dev_id,
-                "channel": "sms",
-                "status": "sent"
-            }).execute()
-
-        return jsonify({
-            "message": f"Skickade till {len(recipients)} mottagare",
-            "count": len(recipients)
-        }), 200
+        return enqueue_delivery("sms", dev_id, county_no, location_id,
+                                lambda numbers: {"to": numbers, **sms_payload})
 
     except Exception as e:
         print("Fel i sms-utskick:", e)
@@ -177,40 +298,6 @@ def send_email_for_deviation():
 
         print("Hittad plats:", location_id)
 
-        # Hämta alla aktiva prenumeranter för länet
-        subscriptions = supabase.table("subscriptions").select("user_id") \
-            .eq("location_id", location_id).eq("active", True).execute()
-
-        if not subscriptions.data:
-            return jsonify({"message": "Inga aktiva e-postprenumeranter"}), 200
-
-        recipients = []
-        for sub in subscriptions.data:
-            user_id = sub["user_id"]
-
-            # Kontrollera att notifikation inte redan skickats
-            existing_notification = supabase.table("notifications").select("id") \
-                .eq("user_id", user_id).eq("external_id", dev_id).eq("channel", "email").execute()
-            if existing_notification.data:
-                continue
-
-            # Hämta e-postadress
-            user_data = supabase.table("users").select("email").eq("user_id", user_id).execute()
-            if not user_data.data:
-                continue
-
-            email = user_data.data[0].get("email")
-            if email:
-                recipients.append({
-                    "user_id": user_id,
-                    "email": email
-                })
-
-        print(" Mottagare:", recipients)
-
-        if not recipients:
-            return jsonify({"message": "Alla har redan fått mail eller saknar e-post"}), 200
-
         # Hitta rätt länsnamn för rubrik
         county_map = {str(row["county_no"]): row["region"] for row in location_data.data}
         county_name = county_map.get(str(county_no), f"län {county_no}")
@@ -226,7 +313,6 @@ def send_email_for_deviation():
             f"Läs mer: https://trafikinfo.trafikverket.se"
         )
         payload = {
-            "to": [r["email"] for r in recipients],
             "subject": subject,
             "message": message,  # plaintext fallback
             "html_message": f"""
@@ -245,34 +331,24 @@ def send_email_for_deviation():
             """
         }
 
-        headers = {
-            "Content-Type": "application/json",
-            "X-API-KEY": API_KEY
-        }
-
-        print(" Payload till mailserver:", payload)
-        email_res = requests.post(EMAIL_SERVER_URL, json=payload, headers=headers)
-        email_res.raise_for_status()
-
-        #  Logga utskick
-        for r in recipients:
-            supabase.table("notifications").insert({
-                "user_id": r["user_id"],
-                "external_id": dev_id,
-                "channel": "email",
-                "status": "sent"
-            }).execute()
-
-        return jsonify({
-            "message": f"Skickade mail till {len(recipients)} mottagare",
-            "count": len(recipients)
-        }), 200
+        # Mottagarna hämtas och mailen skickas i grupper av ett bakgrundsjobb
+        print(" Ämne till mailserver:", subject)
+        return enqueue_delivery("email", dev_id, county_no, location_id,
+                                lambda addresses: {"to": addresses, **payload})
 
     except Exception as e:
         print(" Fel i e-postutskick:", e)
         return jsonify({"error": "Fel vid mail-utskick", "details": str(e)}), 500
 
 
+@notification_api.route("/notification-jobs/<job_id>", methods=["GET"])
+def get_notification_job(job_id):
+    job = notification_jobs.get(job_id)
+    if job is None:
+        return jsonify({"error": f"Inget jobb med id {job_id}"}), 404
+    return jsonify(job), 200
+
+
 @notification_api.route("/notifications", methods=["GET"])
 def list_notifications():
     try:
@@ -5,13 +5,24 @@
 
 import os
 import logging
-from flask import Blueprint, jsonify, request # Importerar nödvändiga moduler från Flask för att skapa webb-API.
-import requests # Används för att göra HTTP-anrop till externa API:er (Trafikverket).
+import time
+from flask import Blueprint, Response, jsonify, request # Importerar nödvändiga moduler från Flask för att skapa webb-API.
+import httpx # Undantagstyper för HTTP-anrop till externa API:er (Trafikverket).
 from dotenv import load_dotenv # För att ladda miljövariabler från en .env-fil.
-from pyproj import Transformer # För koordinattransformationer (om nödvändigt, t.ex. SWEREF99TM till WGS84).
-from pyproj.exceptions import CRSError # Specifik felhantering för pyproj.
-import re # För reguljära uttryck, används för att parsa WKT-strängar.
 import json # För att hantera JSON-data.
+from models.traffic_cache import SnapshotCache # Delad TTL-cache med single-flight.
+from models.traffic_store import BackgroundListener, traffic_store # Minneslager som fylls av bakgrundsinhämtningen.
+from models.reprojection import fill_wgs84_from_sweref # Batch-omprojicering SWEREF99TM -> WGS84.
+from models.geometry import build_feature_collection, geometry_cache, snapshot_geometry_keys # WKT-parsning och GeoJSON.
+from models.spatial_index import SnapshotSpatialIndex, filter_response_by_bbox, parse_bbox # bbox-uppslag.
+from models.clustering import ClusterIndex, snapshot_cluster_points # Förberäknade kluster per zoomnivå.
+from models.traffic_ingester import DEVIATION_INCLUDES # Standardfälten (samma som inhämtningen).
+from models.conditional_get import conditional_response, response_etag # ETag / If-None-Match.
+from models.traffic_ingester import TRAFFIC_INGEST_INTERVAL_SECONDS # Hur ofta traffic_store uppdateras.
+from models.upstream import upstream # Delad anslutningspool med timeouts och omförsök.
+from models.field_projection import build_flat_response, deviation_includes, resolve_fields, with_geometry # profile=/fields=.
+from models.change_log import changes_payload, traffic_change_log # Ändringar sedan en tidigare version.
+from models.traffic_stream import traffic_stream # SSE-strömmen med ändringar.
 
 # Ladda miljövariabler från .env-filen.
 # Detta gör att känslig information som API-nycklar kan hanteras säkert utan att de hardkodas i koden.
@@ -30,16 +41,6 @@ TRAFIKVERKET_API_KEY = os.getenv("TRAFIKVERKET_API_KEY")
 # Trafikverkets API-URL för dataförfrågningar.
 TRAFIKVERKET_API_URL = "https://api.trafikinfo.trafikverket.se/v2/data.json"
 
-# Initierar en koordinattransformator från SWEREF99TM (EPSG:3006) till WGS84 (EPSG:4326).
-# Detta kan vara nödvändigt om Trafikverket returnerar koordinater i SWEREF99TM och frontend behöver WGS84.
-# `always_xy=True` säkerställer att utdata alltid är (longitud, latitud).
-try:
-    transformer_sweref_to_wgs84 = Transformer.from_crs("EPSG:3006", "EPSG:4326", always_xy=True)
-except CRSError as e:
-    # Loggar ett fel om transformatorn inte kan skapas (t.ex. om CRS-definitioner saknas).
-    logging.error(f"Could not create pyproj Transformer: {e}")
-    transformer_sweref_to_wgs84 = None # Sätter till None om det misslyckas.
-
 # Mappningar mellan länsnamn och deras motsvarande nummer enligt Trafikverket.
 COUNTY_NAME_TO_NUMBER = {
     'Blekinge': 10, 'Dalarna': 20, 'Gotland': 9, 'Gävleborg': 21,
@@ -55,71 +56,81 @@ COUNTY_NUMBER_TO_NAME = {v: k for k, v in COUNTY_NAME_TO_NUMBER.items()}
 # Loggar att filen har laddats.
 logging.info("traffic.py loaded!")
 
-# Helperfunktion för att parsa WKT (Well-Known Text) POINT-strängar.
-# WKT är ett textbaserat format för att representera geografiska objekt.
-def parse_wgs84_point(wkt_string):
+# --- Cache för trafikinformation ---
+# Hur länge (sekunder) en hämtad ögonblicksbild räknas som färsk.
+TRAFFIC_CACHE_TTL_SECONDS = float(os.getenv("TRAFFIC_CACHE_TTL_SECONDS", "60"))
+# Hur länge efter TTL en gammal ögonblicksbild får serveras medan en ny hämtas i bakgrunden.
+TRAFFIC_CACHE_STALE_SECONDS = float(os.getenv("TRAFFIC_CACHE_STALE_SECONDS", "300"))
+# Delad cache för alla förfrågningar i processen, nyckel = (länsnummer, meddelandetyper).
+traffic_snapshot_cache = SnapshotCache(TRAFFIC_CACHE_TTL_SECONDS, TRAFFIC_CACHE_STALE_SECONDS)
+# Urval ur traffic_store och deras ETag. Nyckeln innehåller lagrets version,
+# så en ny inhämtning ger automatiskt nya nycklar och de gamla trängs ut.
+store_response_cache = SnapshotCache(ttl_seconds=float("inf"), max_entries=128)
+# Färdigkodade svar per ETag. Ett län som inte ändrats mellan två inhämtningar får samma
+# ETag och återanvänder därmed samma kodade kropp. Posterna har ändå en begränsad livstid,
+# så att en kropp aldrig kan leva kvar längre än så även om ETag:en inte skulle ändras.
+TRAFFIC_BODY_CACHE_TTL_SECONDS = float(os.getenv("TRAFFIC_BODY_CACHE_TTL_SECONDS", "600"))
+store_body_cache = SnapshotCache(ttl_seconds=TRAFFIC_BODY_CACHE_TTL_SECONDS, max_entries=128)
+
+# Rensar parsade geometrier för deviations som inte längre finns (eller har ny VersionTime).
+traffic_store.add_listener(lambda old, new: geometry_cache.retain(snapshot_geometry_keys(new)))
+# Rumsligt index för bbox-frågor (uppdateras inkrementellt) och klusterhierarkin för
+# /api/traffic-clusters (byggs om per version). Båda byggs i en bakgrundstråd, så att en ny
+# version – eller snapshot-filen vid start – kan användas direkt. Tills indexet är ikapp
+# filtreras bbox-frågor genom att gå igenom alla objekt, och klustren visar förra versionen.
+traffic_spatial_index = SnapshotSpatialIndex(geometry_cache)
+traffic_clusters = ClusterIndex()
+
+def _build_indexes(snapshot):
+    traffic_spatial_index.update(None, snapshot)
+    traffic_clusters.load(snapshot_cluster_points(snapshot, geometry_cache), version=snapshot.version)
+
+traffic_store.add_listener(BackgroundListener(_build_indexes, "traffic-indexes"))
+# Ändringsloggen för /api/traffic-info/changes.
+traffic_store.add_listener(traffic_change_log.update)
+
+# Svarsformat som stöds av /api/traffic-info och deras Content-Type.
+RESPONSE_FORMATS = {
+    'trafikverket': 'application/json',   # Trafikverkets råa RESPONSE.RESULT-struktur (standard).
+    'geojson': 'application/geo+json',    # Kompakt FeatureCollection med numeriska koordinater.
+    'flat': 'application/json',           # Platt {"deviations": [...], "cameras": [...]} med valda fält.
+}
+
+def render_traffic_response(response_data, response_format, projection=None):
     """
-    Parsar en WKT POINT-sträng (t.ex. "POINT (lon lat)") och returnerar koordinaterna
-    som en lista [lat, lon] som Leaflet (och många andra kartbibliotek) förväntar sig.
-    Validerar även koordinaternas intervall.
+    Kodar ett svar i Trafikverkets format till JSON i begärt format.
+    `projection` är (deviation-fält, kamera-fält) från resolve_fields, eller None för alla fält.
     """
-    if not wkt_string or not isinstance(wkt_string, str):
-        return None
-    # Använder reguljära uttryck för att hitta numeriska värden inom parenteserna.
-    match = re.search(r'POINT\s*\(\s*(-?\d+\.?\d*)\s+(-?\d+\.?\d*)\s*\)', wkt_string.strip(), re.IGNORECASE)
-    if match:
-        try:
-            lon = float(match.group(1)) # Longitud är det första värdet i WKT POINT.
-            lat = float(match.group(2)) # Latitud är det andra värdet.
-            # Validerar att koordinaterna ligger inom giltiga intervall.
-            if -90 <= lat <= 90 and -180 <= lon <= 180:
-                return [lat, lon]  # Returnerar [lat, lon] som Leaflet behöver.
-            else:
-                logging.warning(f"Parsed WGS84 coordinates out of bounds: Lat {lat}, Lon {lon}")
-                return None
-        except ValueError:
-            logging.warning(f"Could not convert WGS84 POINT coordinates to float: {wkt_string}")
-            return None
-        except Exception as e:
-            logging.error(f"Unexpected error parsing WGS84 POINT {wkt_string}: {e}")
-            return None
-    else:
-        # Loggar en varning om strängen inte matchar förväntat format.
-        if wkt_string.strip() and not wkt_string.strip().upper().startswith("POINT"):
-            logging.warning(f"WGS84 WKT string did not match expected POINT format: {wkt_string}")
-        return None
+    if response_format == 'geojson':
+        deviation_fields, camera_fields = projection or (None, None)
+        response_data = build_feature_collection(response_data, deviation_fields=deviation_fields, camera_fields=camera_fields)
+    elif response_format == 'flat':
+        response_data = build_flat_response(response_data, *(projection or resolve_fields('expanded')))
+    return json.dumps(response_data, ensure_ascii=False, separators=(',', ':'))
 
-# --- Endpoint för trafikinformation ---
-# Definerar en route för API-anropet '/api/traffic-info' som accepterar GET-förfrågningar.
-@traffic_blueprint.route('/api/traffic-info', methods=['GET'])
-def get_traffic_info():
+def normalize_message_types(message_type_value_filter):
     """
-    Hämtar trafikinformation från Trafikverkets API baserat på filter från frontend.
-    Filtrerar på län och meddelandetyper.
+    Gör om en kommaseparerad sträng med meddelandetyper till en sorterad tuple utan dubbletter,
+    så att t.ex. 'Roadwork,Accident' och 'Accident, Roadwork' ger samma cachenyckel.
     """
-    # Kontrollerar om API-nyckeln är konfigurerad.
-    if not TRAFIKVERKET_API_KEY:
-        logging.error("Trafikverket API key not configured.")
-        return jsonify({"error": "Server configuration error"}), 500
-
-    # Hämtar filterparametrar från förfrågan.
-    county_name_filter = request.args.get('county') # Länsnamn (t.ex. 'Stockholm').
-    # Konverterar länsnamn till länsnummer med hjälp av mappningen.
-    county_number_filter = COUNTY_NAME_TO_NUMBER.get(county_name_filter) if county_name_filter else None
-    # Meddelandetyper, standard är 'Accident,Roadwork'.
-    message_type_value_filter = request.args.get('messageTypeValue', 'Accident,Roadwork')
+    if not message_type_value_filter:
+        return ()
+    return tuple(sorted({mt.strip() for mt in message_type_value_filter.split(',') if mt.strip()}))
 
+def build_traffic_query(county_number_filter, message_types, projection=None):
+    """
+    Bygger XML-frågan till Trafikverket för ett län (eller hela Sverige) och givna meddelandetyper.
+    Med `projection` hämtas bara de fält som klienten har bett om.
+    """
     # --- Bygg filter för Situation Query (trafikhändelser som olyckor, vägarbeten) ---
     situation_filter_elements = []
     # Lägger till filter för län om ett sådant valts.
     if county_number_filter is not None:
         situation_filter_elements.append(f'<EQ name="Deviation.CountyNo" value="{county_number_filter}" />')
     # Lägger till filter för meddelandetyper.
-    if message_type_value_filter:
-        message_types = [mt.strip() for mt in message_type_value_filter.split(',') if mt.strip()]
-        if message_types:
-            in_value_string = ','.join(message_types)
-            situation_filter_elements.append(f'<IN name="Deviation.MessageTypeValue" value="{in_value_string}" />')
+    if message_types:
+        in_value_string = ','.join(message_types)
+        situation_filter_elements.append(f'<IN name="Deviation.MessageTypeValue" value="{in_value_string}" />')
 
     # Bygger upp XML-filtret för Situation-frågan.
     situation_filter_xml = "<AND>\n <EXISTS name=\"Deviation\" value=\"true\" />" # Kräver att 'Deviation' existerar.
@@ -127,99 +138,286 @@ def get_traffic_info():
         situation_filter_xml += "\n" + "\n".join([" " + fe for fe in situation_filter_elements])
     situation_filter_xml += "\n </AND>"
 
-    # --- Bygg filter för Camera Queries (fartkameror) ---
-    # Fartkameror filtreras direkt på länsnummer.
-    if county_number_filter is not None:
-        trafficsafetycamera_filter_xml = f'<FILTER>\n <EQ name="CountyNo" value="{county_number_filter}" />\n </FILTER>'
-    else:
-        trafficsafetycamera_filter_xml = "<FILTER />" # Om inget län valts, hämta alla kameror.
-
-    # Den fullständiga XML-frågan som skickas till Trafikverkets API.
-    # Den innehåller två separata QUERY-block: ett för "Situation" (trafikhändelser)
-    # och ett för "TrafficSafetyCamera" (fartkameror).
-    xml_query = f"""
+    # --- Vilka fält som hämtas: alla som standard, annars bara de som projektionen behöver ---
+    situation_includes = deviation_includes(projection[0]) if projection is not None else DEVIATION_INCLUDES
+    situation_includes_xml = "\n".join(f"        <INCLUDE>{field}</INCLUDE>" for field in situation_includes)
+
+    # Den fullständiga XML-frågan som skickas till Trafikverkets API. Fartkamerorna ingår inte;
+    # de hämtas separat en gång per dygn (se models/camera_dataset.py).
+    return f"""
 <REQUEST>
     <LOGIN authenticationkey="{TRAFIKVERKET_API_KEY}" />
     <QUERY objecttype="Situation" namespace="Road.TrafficInfo" schemaversion="1.5" orderby="Deviation.CreationTime DESC">
         <FILTER>
             {situation_filter_xml}
         </FILTER>
-        <INCLUDE>Deviation.Id</INCLUDE>
-        <INCLUDE>Deviation.Header</INCLUDE>
-        <INCLUDE>Deviation.CreationTime</INCLUDE>
-        <INCLUDE>Deviation.CountyNo</INCLUDE>
-        <INCLUDE>Deviation.Geometry.Point.WGS84</INCLUDE>
-        <INCLUDE>Deviation.Geometry.Point.SWEREF99TM</INCLUDE>
-        <INCLUDE>Deviation.Geometry.Line.WGS84</INCLUDE>
-        <INCLUDE>Deviation.Geometry.Line.SWEREF99TM</INCLUDE>
-        <INCLUDE>Deviation.LocationDescriptor</INCLUDE>
-        <INCLUDE>Deviation.RoadNumber</INCLUDE>
-        <INCLUDE>Deviation.RoadName</INCLUDE>
-        <INCLUDE>Deviation.PositionalDescription</INCLUDE>
-        <INCLUDE>Deviation.MessageType</INCLUDE>
-        <INCLUDE>Deviation.MessageTypeValue</INCLUDE>
-        <INCLUDE>Deviation.IconId</INCLUDE>
-        <INCLUDE>Deviation.StartTime</INCLUDE>
-        <INCLUDE>Deviation.EndTime</INCLUDE>
-        <INCLUDE>Deviation.Message</INCLUDE>
-        <INCLUDE>Deviation.AffectedDirection</INCLUDE>
-        <INCLUDE>Deviation.SeverityText</INCLUDE>
-        <INCLUDE>Deviation.TemporaryLimit</INCLUDE>
-        <INCLUDE>Deviation.ValidUntilFurtherNotice</INCLUDE>
-        <INCLUDE>Deviation.WebLink</INCLUDE>
-        <INCLUDE>Deviation.NumberOfLanesRestricted</INCLUDE>
-        <INCLUDE>Deviation.TrafficRestrictionType</INCLUDE>
-        <INCLUDE>Deviation.VersionTime</INCLUDE>
-    </QUERY>
-    <QUERY objecttype="TrafficSafetyCamera" namespace="Road.Infrastructure" schemaversion="1">
-        {trafficsafetycamera_filter_xml}
-        <INCLUDE>Id</INCLUDE>
-        <INCLUDE>Name</INCLUDE>
-        <INCLUDE>Geometry.WGS84</INCLUDE>
-        <INCLUDE>Geometry.SWEREF99TM</INCLUDE>
-        <INCLUDE>CountyNo</INCLUDE>
-        <INCLUDE>IconId</INCLUDE>
-        <INCLUDE>Bearing</INCLUDE>
+{situation_includes_xml}
     </QUERY>
 </REQUEST>
 """
 
+def fetch_traffic_data(county_number_filter, message_types, projection=None):
+    """
+    Hämtar trafikhändelser och fartkameror från Trafikverket och returnerar det parsade JSON-svaret.
+    Kastar httpx.HTTPError vid nätverks- eller HTTP-fel.
+    """
+    xml_query = build_traffic_query(county_number_filter, message_types, projection)
+
+    # Skickar POST-förfrågan till Trafikverkets API med den konstruerade XML-frågan.
+    # Frågan läser bara data, så den får göras om vid tillfälliga fel (retry=True).
+    response = upstream('trafikverket').post(
+        TRAFIKVERKET_API_URL,
+        content=xml_query.encode('utf-8'), # XML-data måste vara UTF-8 kodad.
+        headers={'Content-Type': 'text/xml'}, # Anger att innehållstypen är XML.
+        operation='Situation',
+        retry=True
+    )
+    response.raise_for_status() # Kastar ett HTTPError för dåliga svar (4xx eller 5xx).
+
+    # Parsar svaret från Trafikverket som JSON.
+    response_data = response.json()
+
+    # Frågan innehåller bara SWEREF99TM; WGS84 (som frontend använder) räknas fram i ett svep.
+    deviations = []
+    for result in response_data.get('RESPONSE', {}).get('RESULT', []):
+        for situation in result.get('Situation', []):
+            deviations.extend(situation.get('Deviation', []))
+    fill_wgs84_from_sweref(deviations, [])
+
+    # Fartkamerorna läggs till ur minnet (kamera-datamängden), i samma form som Trafikverkets svar.
+    response_data.setdefault('RESPONSE', {}).setdefault('RESULT', []).append(
+        {'TrafficSafetyCamera': traffic_store.query_cameras(county_number_filter)}
+    )
+
+    # Försöker logga en del av svaret för debugging.
     try:
-        # Skickar POST-förfrågan till Trafikverkets API med den konstruerade XML-frågan.
-        response = requests.post(
-            TRAFIKVERKET_API_URL,
-            data=xml_query.encode('utf-8'), # XML-data måste vara UTF-8 kodad.
-            headers={'Content-Type': 'text/xml'} # Anger att innehållstypen är XML.
-        )
-        response.raise_for_status() # Kastar ett HTTPError för dåliga svar (4xx eller 5xx).
+        situation_data = response_data.get('RESPONSE', {}).get('RESULT', [{}])[0].get('Situation', None)
+        if situation_data:
+            logging.debug(f"API Response - Situation/Deviations Data:\n{json.dumps(situation_data, indent=2, ensure_ascii=False)}")
+        else:
+            logging.debug("API Response did not contain 'Situation' data in the expected location.")
+            logging.debug(f"Full API Response:\n{json.dumps(response_data, indent=2, ensure_ascii=False)}")
+    except (IndexError, KeyError, TypeError) as e:
+        logging.warning(f"Could not extract Situation data for logging: {e}")
+        logging.debug(f"Full API Response:\n{json.dumps(response_data, indent=2, ensure_ascii=False)}")
 
-        # Parsar svaret från Trafikverket som JSON.
-        response_data = response.json()
+    logging.info(f"Successfully fetched data from Trafikverket (county={county_number_filter}, types={','.join(message_types)}).")
+    return response_data
 
-        # Försöker logga en del av svaret för debugging.
+def _store_selection(county_number_filter, message_types, snapshot, variant):
+    """Plockar ut ett urval ur traffic_store och räknar fram dess ETag."""
+    response_data = traffic_store.build_response(county_number_filter, message_types, snapshot=snapshot)
+    return response_etag(response_data, variant), response_data
+
+# --- Endpoint för trafikinformation ---
+# Definerar en route för API-anropet '/api/traffic-info' som accepterar GET-förfrågningar.
+@traffic_blueprint.route('/api/traffic-info', methods=['GET'])
+def get_traffic_info():
+    """
+    Returnerar trafikinformation baserat på filter från frontend.
+    Filtrerar på län och meddelandetyper. Svarar ur traffic_store när bakgrundsinhämtningen
+    har kört; annars hämtas datan från Trafikverket och cachas per (län, meddelandetyper).
+    Med profile=banner|expanded eller fields=Header,MessageType,... returneras bara de fälten,
+    som standard i det platta formatet (format=flat).
+    """
+    # Hämtar filterparametrar från förfrågan.
+    county_name_filter = request.args.get('county') # Länsnamn (t.ex. 'Stockholm').
+    # Konverterar länsnamn till länsnummer med hjälp av mappningen.
+    county_number_filter = COUNTY_NAME_TO_NUMBER.get(county_name_filter) if county_name_filter else None
+    # Meddelandetyper, standard är 'Accident,Roadwork'.
+    message_types = normalize_message_types(request.args.get('messageTypeValue', 'Accident,Roadwork'))
+    # Fältprojektion: en fördefinierad profil eller en egen kommaseparerad fältlista (valfritt).
+    projection = None
+    if request.args.get('profile') or request.args.get('fields'):
+        try:
+            projection = resolve_fields(request.args.get('profile'), request.args.get('fields'))
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+    # Svarsformat: 'trafikverket' (standard), 'geojson' eller 'flat' (standard med projektion).
+    response_format = request.args.get('format', 'flat' if projection else 'trafikverket').lower()
+    if response_format not in RESPONSE_FORMATS:
+        return jsonify({"error": f"Unsupported format '{response_format}'"}), 400
+    if projection and response_format == 'trafikverket':
+        return jsonify({"error": "profile/fields require format=flat or format=geojson"}), 400
+    # Kartans synliga område: 'minLon,minLat,maxLon,maxLat' (valfritt).
+    bbox = None
+    if request.args.get('bbox'):
         try:
-            situation_data = response_data.get('RESPONSE', {}).get('RESULT', [{}])[0].get('Situation', None)
-            if situation_data:
-                logging.debug(f"API Response - Situation/Deviations Data:\n{json.dumps(situation_data, indent=2, ensure_ascii=False)}")
+            bbox = parse_bbox(request.args['bbox'])
+        except ValueError as e:
+            return jsonify({"error": f"Invalid bbox: {e}"}), 400
+
+    # Normalfallet: svara direkt ur minneslagret som bakgrundsinhämtningen håller uppdaterat.
+    # Svaret får en ETag och 304 skickas om klienten redan har samma data.
+    if traffic_store.ready:
+        snapshot = traffic_store.snapshot
+        variant = (county_number_filter, message_types, response_format, projection)
+        if bbox is not None:
+            # Viewport-svar skiljer sig mellan nästan alla förfrågningar och cachas därför inte.
+            if traffic_spatial_index.version == snapshot.version:
+                deviation_ids, camera_ids = traffic_spatial_index.query(bbox)
+                response_data = traffic_store.build_response(
+                    county_number_filter, message_types, snapshot=snapshot,
+                    deviation_ids=deviation_ids, camera_ids=camera_ids
+                )
             else:
-                logging.debug("API Response did not contain 'Situation' data in the expected location.")
-                logging.debug(f"Full API Response:\n{json.dumps(response_data, indent=2, ensure_ascii=False)}")
-        except (IndexError, KeyError, TypeError) as e:
-            logging.warning(f"Could not extract Situation data for logging: {e}")
-            logging.debug(f"Full API Response:\n{json.dumps(response_data, indent=2, ensure_ascii=False)}")
+                # Indexet byggs fortfarande om för den här versionen.
+                response_data = filter_response_by_bbox(
+                    traffic_store.build_response(county_number_filter, message_types, snapshot=snapshot),
+                    bbox, geometry_cache
+                )
+            etag = response_etag(response_data, variant + (bbox,))
+            render = lambda: render_traffic_response(response_data, response_format, projection)
+        else:
+            (etag, response_data), _, _ = store_response_cache.get(
+                (snapshot.version,) + variant,
+                lambda: _store_selection(county_number_filter, message_types, snapshot, variant)
+            )
+            render = lambda: store_body_cache.get(
+                etag, lambda: render_traffic_response(response_data, response_format, projection)
+            )[0]
+        data_age = time.time() - snapshot.created_at
+        response = conditional_response(
+            etag, render, RESPONSE_FORMATS[response_format],
+            max_age=TRAFFIC_INGEST_INTERVAL_SECONDS, stale_seconds=TRAFFIC_INGEST_INTERVAL_SECONDS, age=data_age
+        )
+        response.headers['X-Cache'] = 'STORE'
+        response.headers['X-Cache-Age'] = f"{data_age:.1f}"
+        # Token för att senare hämta bara ändringarna via /api/traffic-info/changes.
+        response.headers['X-Change-Token'] = traffic_change_log.token(snapshot.version)
+        return response
 
-        logging.info("Successfully fetched data from Trafikverket.")
-        # Returnerar den hämtade JSON-datan till frontend.
-        return jsonify(response_data)
+    # Reservväg innan första inhämtningen är klar: hämta från Trafikverket via den delade cachen.
+    # Kontrollerar om API-nyckeln är konfigurerad.
+    if not TRAFIKVERKET_API_KEY:
+        logging.error("Trafikverket API key not configured.")
+        return jsonify({"error": "Server configuration error"}), 500
 
-    except requests.exceptions.RequestException as e:
+    try:
+        # bbox-filtrering och GeoJSON behöver geometrin även om klienten inte bett om den.
+        upstream_projection = projection
+        if projection and (bbox is not None or response_format == 'geojson'):
+            upstream_projection = with_geometry(projection)
+        # Hämtar från cachen. Vid miss görs (högst) en hämtning per nyckel åt gången.
+        response_data, cache_status, cache_age = traffic_snapshot_cache.get(
+            (county_number_filter, message_types, upstream_projection),
+            lambda: fetch_traffic_data(county_number_filter, message_types, upstream_projection)
+        )
+        if bbox is not None:
+            response_data = filter_response_by_bbox(response_data, bbox, geometry_cache)
+
+        # Returnerar den hämtade JSON-datan till frontend, med cacheinformation i svarshuvudena.
+        response = conditional_response(
+            response_etag(response_data, (county_number_filter, message_types, response_format, projection, bbox)),
+            lambda: render_traffic_response(response_data, response_format, projection),
+            RESPONSE_FORMATS[response_format],
+            max_age=TRAFFIC_CACHE_TTL_SECONDS, stale_seconds=TRAFFIC_CACHE_STALE_SECONDS, age=cache_age
+        )
+        response.headers['X-Cache'] = cache_status
+        response.headers['X-Cache-Age'] = f"{cache_age:.1f}"
+        return response
+
+    except httpx.HTTPError as e:
         # Hanterar fel som uppstår under HTTP-förfrågan (t.ex. nätverksproblem, HTTP-felkoder).
         err_msg = f"Error fetching data from Trafikverket: {e}"
-        status_code = e.response.status_code if e.response is not None else "N/A"
-        resp_text = e.response.text if e.response is not None else "No response body"
+        # Bara HTTPStatusError har ett svar; nätverksfel och timeouts saknar det.
+        error_response = e.response if isinstance(e, httpx.HTTPStatusError) else None
+        status_code = error_response.status_code if error_response is not None else "N/A"
+        resp_text = error_response.text if error_response is not None else "No response body"
         logging.error(f"{err_msg} - Status: {status_code} - Response: {resp_text[:500]}")
         return jsonify({"error": "Failed to fetch traffic data from Trafikverket API."}), 500
     except Exception as e:
         # Hanterar oväntade fel som kan uppstå under exekveringen.
         logging.error(f"An unexpected error occurred in get_traffic_info: {e}", exc_info=True)
-        return jsonify({"error": "An internal server error occurred."}), 500
\ No newline at end of file
+        return jsonify({"error": "An internal server error occurred."}), 500
+
+
+# --- Endpoint för ändringar sedan en tidigare version ---
+@traffic_blueprint.route('/api/traffic-info/changes', methods=['GET'])
+def get_traffic_changes():
+    """
+    Returnerar de deviations som lagts till, ändrats eller tagits bort sedan `since` (en token
+    från X-Change-Token eller ett tidigare svar), med samma county- och messageTypeValue-filter
+    som /api/traffic-info, samt en ny token:
+
+        {"token": ..., "full": false, "added": [...], "updated": [...], "removed": [Id, ...]}
+
+    En deviation som inte längre matchar filtret räknas som borttagen. Saknas `since`, eller är
+    den för gammal för ändringsloggen, svaras med full=true: "added" innehåller då alla
+    deviations och "cameras" alla fartkameror, och klienten ska ersätta det den har.
+    """
+    county_name_filter = request.args.get('county')
+    county_number_filter = COUNTY_NAME_TO_NUMBER.get(county_name_filter) if county_name_filter else None
+    message_types = normalize_message_types(request.args.get('messageTypeValue', 'Accident,Roadwork'))
+
+    snapshot, changes = traffic_change_log.changes_since(request.args.get('since'))
+    if snapshot is None or not traffic_store.ready:
+        return jsonify({"error": "Traffic data not loaded yet"}), 503
+
+    result = changes_payload(traffic_store, snapshot, changes, county_number_filter, message_types)
+    result["token"] = traffic_change_log.token(snapshot.version)
+
+    body = json.dumps(result, ensure_ascii=False, separators=(',', ':'))
+    response = Response(body, mimetype='application/json')
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
+
+
+# --- SSE-ström med ändringar ---
+@traffic_blueprint.route('/api/traffic-info/stream', methods=['GET'])
+def stream_traffic_changes():
+    """
+    Server-Sent Events med samma filter som /api/traffic-info/changes:
+
+        GET /api/traffic-info/stream?county=Stockholm&messageTypeValue=Accident,Roadwork[&since=<token>]
+
+    Händelser: "ready" (ingen since), "changes" (samma form som /api/traffic-info/changes) och
+    "reset" (full=true, token okänd eller för gammal). Vid återanslutning skickar webbläsaren
+    Last-Event-ID, som används i stället för since. Svarar 503 om datan inte är laddad än eller
+    om strömmen är full (se TrafficStream.capacity); kartan hämtar då ändringarna via
+    /api/traffic-info/changes.
+    """
+    county_name_filter = request.args.get('county')
+    county_number_filter = COUNTY_NAME_TO_NUMBER.get(county_name_filter) if county_name_filter else None
+    message_types = normalize_message_types(request.args.get('messageTypeValue', 'Accident,Roadwork'))
+
+    if traffic_change_log.changes_since(None)[0] is None or not traffic_store.ready:
+        return jsonify({"error": "Traffic data not loaded yet"}), 503
+
+    since = request.headers.get('Last-Event-ID') or request.args.get('since')
+    opened = traffic_stream.open(
+        since, county_number_filter, message_types, multithread=request.environ.get('wsgi.multithread', False)
+    )
+    if opened is None:
+        return jsonify({"error": "Traffic stream unavailable"}), 503
+
+    response = Response(traffic_stream.events(*opened), mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'  # Stäng av buffring i nginx-liknande proxyer.
+    return response
+
+
+# --- Endpoint för förklustrade punkter ---
+@traffic_blueprint.route('/api/traffic-clusters', methods=['GET'])
+def get_traffic_clusters():
+    """
+    Returnerar förberäknade kluster för en zoomnivå (och valfritt kartområde) som en GeoJSON
+    FeatureCollection. Varje kluster har antal per kategori: accident, roadwork, camera och other.
+    Enskilda punkter har cluster=false samt id och kind ('deviation' eller 'camera').
+    """
+    try:
+        zoom = int(request.args.get('zoom', ''))
+    except ValueError:
+        return jsonify({"error": "zoom is required and must be an integer"}), 400
+    try:
+        bbox = parse_bbox(request.args['bbox']) if request.args.get('bbox') else (-180.0, -90.0, 180.0, 90.0)
+    except ValueError as e:
+        return jsonify({"error": f"Invalid bbox: {e}"}), 400
+
+    if traffic_clusters.version is None:
+        # Klustren byggs från traffic_store, som inte har fått någon data än.
+        return jsonify({"error": "Traffic data not loaded yet"}), 503
+
+    features = traffic_clusters.get_clusters(bbox, zoom)
+    body = json.dumps({"type": "FeatureCollection", "features": features}, ensure_ascii=False, separators=(',', ':'))
+    return Response(body, mimetype='application/geo+json')
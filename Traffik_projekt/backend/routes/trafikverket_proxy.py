@@ -1,22 +1,95 @@
 # routes/trafikverket_proxy.py
 from flask import Blueprint, request, jsonify
+import base64
+import json
 import os
-import requests
+import time
+from models.traffic_store import parse_trafikverket_time, traffic_store
+from models.traffic_ingester import TRAFFIC_INGEST_INTERVAL_SECONDS
+from models.conditional_get import conditional_response, dataset_etag
+from models.upstream import upstream
 
 trafikverket_proxy = Blueprint("trafikverket_proxy", __name__)
 
 TRV_API_KEY = os.getenv("TRV_API_KEY")
 TRV_API_URL = "https://api.trafikinfo.trafikverket.se/v2/data.json"
+# Tidsfönster för händelserna: de som startat senaste dygnet (GT-filtret i frågan nedan).
+TRAFIKINFO_WINDOW_SECONDS = 24 * 60 * 60
 
-@trafikverket_proxy.route("/trafikinfo")
-def trafikinfo():
-    county = request.args.get("county")  # t.ex. 24
-    xml_payload = f"""
+# Sidstorlek för paginering: standard och max för limit=.
+TRAFIKINFO_DEFAULT_LIMIT = 100
+TRAFIKINFO_MAX_LIMIT = 500
+
+
+def parse_counties(value):
+    """
+    Tolkar county-parametern: "24" -> [24], "1,3,24" -> [1, 3, 24], tom -> None (hela landet).
+    Kastar ValueError vid ogiltiga län.
+    """
+    if not value:
+        return None
+    return sorted({int(part) for part in value.split(",") if part.strip()}) or None
+
+
+def parse_message_types(value):
+    """Kommaseparerade MessageTypeValue som en sorterad tuple, eller None (alla typer)."""
+    types = sorted({part.strip() for part in (value or "").split(",") if part.strip()})
+    return tuple(types) or None
+
+
+def _sort_key(deviation):
+    # Samma ordning som traffic_store (CreationTime, nyast först) med Id som avgörare vid lika tid,
+    # så att ordningen är total och en markör pekar ut en entydig plats i listan.
+    return deviation.get("CreationTime") or "", deviation.get("Id") or ""
+
+
+def encode_cursor(deviation):
+    """Markör för sidan efter `deviation`: base64 av [CreationTime, Id]."""
+    return base64.urlsafe_b64encode(json.dumps(list(_sort_key(deviation))).encode("utf-8")).decode("ascii")
+
+
+def decode_cursor(cursor):
+    """Tolkar en markör från encode_cursor. Kastar ValueError om den är ogiltig."""
+    try:
+        creation_time, dev_id = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+    except Exception:
+        raise ValueError("Invalid cursor")
+    return str(creation_time), str(dev_id)
+
+
+def paginate(deviations, limit, after=None):
+    """
+    Returnerar (sida, markör för nästa sida eller None). `deviations` ska vara sorterade
+    nyast först enligt _sort_key; `after` är en avkodad markör.
+    """
+    if after is not None:
+        deviations = [d for d in deviations if _sort_key(d) < after]
+    page = deviations[:limit]
+    next_cursor = encode_cursor(page[-1]) if len(deviations) > limit else None
+    return page, next_cursor
+
+
+def build_trafikinfo_query(county_nos=None, message_types=None):
+    """
+    Situation-frågan för /trafikinfo med län, meddelandetyper och tidsfönster i FILTER,
+    så att Trafikverket bara skickar det som efterfrågas.
+    """
+    days, remainder = divmod(int(TRAFIKINFO_WINDOW_SECONDS), 24 * 60 * 60)
+    window = f"-{days}.{remainder // 3600:02d}:{remainder % 3600 // 60:02d}:00"  # t.ex. -1.00:00:00
+    filters = [f'<GT name="Deviation.StartTime" value="$dateadd({window})" />']
+    if county_nos:
+        filters.append(f'<IN name="Deviation.CountyNo" value="{",".join(map(str, county_nos))}" />')
+    if message_types:
+        filters.append(f'<IN name="Deviation.MessageTypeValue" value="{",".join(message_types)}" />')
+    filter_xml = "\n            ".join(filters)
+    return f"""
     <REQUEST>
       <LOGIN authenticationkey="{TRV_API_KEY}" />
       <QUERY objecttype="Situation" schemaversion="1.5">
         <FILTER>
-          <GT name="Deviation.StartTime" value="$dateadd(-1.00:00:00)" />
+          <AND>
+            {filter_xml}
+          </AND>
         </FILTER>
         <INCLUDE>Deviation.Id</INCLUDE>
         <INCLUDE>Deviation.Header</INCLUDE>
@@ -26,23 +99,109 @@ def trafikinfo():
         <INCLUDE>Deviation.RoadName</INCLUDE>
         <INCLUDE>Deviation.MessageTypeValue</INCLUDE>
         <INCLUDE>Deviation.Geometry.WGS84</INCLUDE>
+        <INCLUDE>Deviation.StartTime</INCLUDE>
+        <INCLUDE>Deviation.CreationTime</INCLUDE>
+        <INCLUDE>Deviation.VersionTime</INCLUDE>
       </QUERY>
     </REQUEST>
     """.strip()
 
+
+def _matches(deviation, county_nos, message_types, started_after=None):
+    # Filtret i frågan väljer situationer; en situation kan ha deviations i andra län eller av
+    # andra typer, så varje deviation kontrolleras även här.
+    if county_nos and not {int(c) for c in deviation.get("CountyNo", [])} & set(county_nos):
+        return False
+    if message_types and deviation.get("MessageTypeValue") not in message_types:
+        return False
+    if started_after is None:
+        return True
+    # Samma regel som traffic_store.query_deviations: utan StartTime räknas händelsen inte
+    # som startad inom fönstret.
+    start_time = parse_trafikverket_time(deviation.get("StartTime"))
+    return start_time is not None and start_time > started_after
+
+
+@trafikverket_proxy.route("/trafikinfo")
+def trafikinfo():
+    """
+    Händelser som startat senaste dygnet, nyast först.
+
+    county: ett län (t.ex. 24) eller flera kommaseparerade (t.ex. 1,3,24), så att pollern kan
+    hämta alla län i ett anrop och dela upp svaret på CountyNo själv.
+    messageTypeValue: kommaseparerade typer (t.ex. Accident,Roadwork), standard alla.
+    limit / after: sidstorlek och markör. Finns fler händelser skickas markören för nästa
+    sida i X-Next-Cursor.
+    """
+    try:
+        county_nos = parse_counties(request.args.get("county"))
+    except ValueError:
+        return jsonify({"error": "Ogiltigt county"}), 400
+    message_types = parse_message_types(request.args.get("messageTypeValue"))
+    try:
+        limit = int(request.args.get("limit", TRAFIKINFO_DEFAULT_LIMIT))
+        after = decode_cursor(request.args["after"]) if request.args.get("after") else None
+    except ValueError:
+        return jsonify({"error": "Ogiltigt limit eller after"}), 400
+    if not 1 <= limit <= TRAFIKINFO_MAX_LIMIT:
+        return jsonify({"error": f"limit måste vara 1–{TRAFIKINFO_MAX_LIMIT}"}), 400
+    variant = ("trafikinfo", tuple(county_nos or ()), message_types, limit, after)
+    started_after = time.time() - TRAFIKINFO_WINDOW_SECONDS
+
+    # Svara ur minneslagret när bakgrundsinhämtningen har kört.
+    if traffic_store.ready:
+        snapshot = traffic_store.snapshot
+        if county_nos is not None and len(county_nos) == 1:
+            deviations = traffic_store.query_deviations(
+                county_no=county_nos[0], message_types=message_types, started_after=started_after, snapshot=snapshot
+            )
+        else:
+            deviations = [
+                d for d in traffic_store.query_deviations(
+                    message_types=message_types, started_after=started_after, snapshot=snapshot
+                )
+                if _matches(d, county_nos, None)  # Typ och tidsfönster är redan filtrerade.
+            ]
+        page, next_cursor = paginate(deviations, limit, after)
+        # 304 om klienten redan har samma händelser (samma Id:n och senaste VersionTime).
+        response = conditional_response(
+            dataset_etag(page, variant=variant),
+            lambda: json.dumps(page, ensure_ascii=False),
+            "application/json",
+            max_age=TRAFFIC_INGEST_INTERVAL_SECONDS,
+            stale_seconds=TRAFFIC_INGEST_INTERVAL_SECONDS,
+            age=time.time() - snapshot.created_at
+        )
+        if next_cursor:
+            response.headers["X-Next-Cursor"] = next_cursor
+        return response
+
     try:
-        res = requests.post(TRV_API_URL, data=xml_payload, headers={"Content-Type": "application/xml"})
+        res = upstream("trafikverket").post(
+            TRV_API_URL, content=build_trafikinfo_query(county_nos, message_types),
+            headers={"Content-Type": "application/xml"}, operation="Situation", retry=True
+        )
         res.raise_for_status()
         result = res.json()
 
         deviations = []
         for r in result.get("RESPONSE", {}).get("RESULT", []):
             for situation in r.get("Situation", []):
-                for deviation in situation.get("Deviation", []):
-                    if not county or str(county) in map(str, deviation.get("CountyNo", [])):
-                        deviations.append(deviation)
+                deviations.extend(
+                    d for d in situation.get("Deviation", []) if _matches(d, county_nos, message_types, started_after)
+                )
+        deviations.sort(key=_sort_key, reverse=True)
 
-        return jsonify(deviations[:10])  # returnera max 10
+        page, next_cursor = paginate(deviations, limit, after)
+        response = conditional_response(
+            dataset_etag(page, variant=variant),
+            lambda: json.dumps(page, ensure_ascii=False),
+            "application/json",
+            max_age=TRAFFIC_INGEST_INTERVAL_SECONDS
+        )
+        if next_cursor:
+            response.headers["X-Next-Cursor"] = next_cursor
+        return response
     except Exception as e:
         print(" Trafikverket proxy error:", e)
-        return jsonify({"error": "Fel vid hämtning", "details": str(e)}), 500
\ No newline at end of file
+        return jsonify({"error": "Fel vid hämtning", "details": str(e)}), 500
@@ -0,0 +1,64 @@
+# tests/bench_incremental_sync.py
+
+# Jämför full hämtning med inkrementell synk (change id) mot den lokala Trafikverket-stubben.
+# Skriver ut mottagna bytes samt parse- och appliceringstid per cykel för båda lägena.
+#
+#   python tests/trafikverket_stub.py synthetic /tmp/trv_recording
+#   python tests/bench_incremental_sync.py /tmp/trv_recording
+
+import argparse
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from models import traffic_ingester
+from models.traffic_ingester import TrafficIngester
+from models.traffic_store import DeviationStore
+from tests.trafikverket_stub import Recording, TrafikverketStub
+
+
+def run(mode, recording, cycles):
+    stub = TrafikverketStub(recording).start()
+    traffic_ingester.TRAFIKVERKET_API_URL = stub.url
+    store = DeviationStore()
+    ingester = TrafficIngester(store, interval_seconds=0, mode=mode)
+
+    rows = []
+    try:
+        for _ in range(cycles):
+            ingester.run_once()
+            rows.append(ingester.last_cycle)
+    finally:
+        stub.stop()
+
+    print(f"\n== {mode} ==")
+    print(f"{'cykel':>5} {'typ':>7} {'objekt':>7} {'bytes':>10} {'parse ms':>9} {'apply ms':>9}")
+    for i, row in enumerate(rows, 1):
+        print(
+            f"{i:>5} {row['kind']:>7} {row['objects']:>7} {row['bytes']:>10} "
+            f"{row['parse_seconds'] * 1000:>9.1f} {row['apply_seconds'] * 1000:>9.1f}"
+        )
+    # Första cykeln är alltid en full hämtning; jämför de efterföljande.
+    steady = rows[1:] or rows
+    avg_bytes = sum(r["bytes"] for r in steady) / len(steady)
+    avg_parse = sum(r["parse_seconds"] for r in steady) / len(steady) * 1000
+    print(f"Snitt efter första cykeln: {avg_bytes:.0f} bytes, {avg_parse:.1f} ms parse, "
+          f"{len(store.snapshot.deviations)} deviations i lagret")
+    return avg_bytes, avg_parse
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("recording", help="Katalog skapad av trafikverket_stub.py")
+    parser.add_argument("--cycles", type=int, default=None, help="Antal cykler (standard: alla delta + 1)")
+    args = parser.parse_args()
+
+    recording = Recording(args.recording)
+    cycles = args.cycles or len(recording.deltas) + 1
+
+    full_bytes, full_parse = run("full", recording, cycles)
+    delta_bytes, delta_parse = run("incremental", recording, cycles)
+
+    print(f"\nBesparing per cykel: {full_bytes - delta_bytes:.0f} bytes "
+          f"({(1 - delta_bytes / full_bytes) * 100:.1f} %), {full_parse - delta_parse:.1f} ms parse")
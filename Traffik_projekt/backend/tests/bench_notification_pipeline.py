@@ -0,0 +1,315 @@
+# tests/bench_notification_pipeline.py
+
+# Mäter hela notiskedjan lokalt: inspelade Trafikverket-svar spelas upp N gånger snabbare än
+# realtid (trafikverket_stub.py), Flask-appen hämtar dem med inhämtningen och serverar
+# /trafikinfo, poller.py upptäcker nya händelser och skickar dem via /api/send_sms_for_deviation
+# till en lokal SMS/e-postserver. Supabase ersätts av postgrest_stub.py.
+#
+# Skriver ut latensen från att pollern upptäcker en händelse till att SMS:et är skickat
+# (p50/p95/p99), tiden från att händelsen publicerades till att den upptäcktes, samt antalet
+# förfrågningar mot varje tjänst per pollcykel.
+#
+#   python tests/trafikverket_stub.py synthetic /tmp/trv_recording
+#   python tests/bench_notification_pipeline.py /tmp/trv_recording --speed 20
+#
+# Pollerns och inhämtningens intervall skalas med --speed; nätverks- och SMS-latens gör det inte.
+
+import argparse
+import asyncio
+import json
+import logging
+import math
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from tests.postgrest_stub import PostgrestStub
+from tests.trafikverket_stub import Recording, TrafikverketStub
+
+# Giltigt format för supabase-py; stubben kontrollerar inte nyckeln.
+STUB_SUPABASE_KEY = "eyJhbGciOiJIUzI1NiJ9.eyJyb2xlIjoic2VydmljZV9yb2xlIn0.stub"
+COUNTIES = range(1, 26)
+
+
+class MessageServerStub:
+    """
+    Tar emot SMS (/sms) och e-post (/email) som HelloSMS- och mailservern, med valfri
+    fördröjning. Andelen failure_rate av anropen besvaras med 503.
+    """
+
+    def __init__(self, host="127.0.0.1", port=0, latency_seconds=0.0, failure_rate=0.0):
+        self.latency_seconds = latency_seconds
+        self.failure_rate = failure_rate
+        self.requests = Counter()   # sökväg -> antal
+        self.failures = Counter()   # sökväg -> antal besvarade med 503
+        self.recipients = Counter()  # sökväg -> antal mottagare
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+                if stub.latency_seconds:
+                    time.sleep(stub.latency_seconds)
+                stub.requests[self.path] += 1
+                if random.random() < stub.failure_rate:
+                    stub.failures[self.path] += 1
+                    self.send_response(503)
+                    self.send_header("Content-Length", "0")
+                    self.end_headers()
+                    return
+                stub.recipients[self.path] += len(body.get("to", []))
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", "2")
+                self.end_headers()
+                self.wfile.write(b"{}")
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        self.url = f"http://{host}:{self.server.server_address[1]}"
+
+    def start(self):
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self
+
+
+def deviation_ids(body):
+    """Deviation-Id:n i ett Situation-svar (borttagna situationer räknas inte)."""
+    ids = []
+    for result in json.loads(body).get("RESPONSE", {}).get("RESULT", []):
+        for situation in result.get("Situation", []):
+            if not situation.get("Deleted"):
+                ids.extend(d["Id"] for d in situation.get("Deviation", []) if d.get("Id"))
+    return ids
+
+
+def seed(postgrest, recording, subscribers_per_county, notify_existing):
+    """Län, användare och prenumerationer; händelserna i helsvaret räknas som redan notifierade."""
+    postgrest.tables["location"] = [
+        {"location_id": county_no, "county_no": county_no, "region": f"Län {county_no}"} for county_no in COUNTIES
+    ]
+    users, subscriptions = [], []
+    for county_no in COUNTIES:
+        for i in range(subscribers_per_county):
+            user_id = f"user-{county_no}-{i}"
+            users.append({"user_id": user_id, "phone": f"+4670{county_no:02d}{i:05d}", "email": f"{user_id}@example.com"})
+            subscriptions.append({"user_id": user_id, "location_id": county_no, "active": True})
+    postgrest.tables["users"] = users
+    postgrest.tables["subscriptions"] = subscriptions
+    postgrest.tables["notifications"] = []
+    if not notify_existing:
+        postgrest.insert("notifications", [{"external_id": dev_id} for dev_id in deviation_ids(recording.full)])
+
+
+def configure_environment(args, trv_url, postgrest_url, messages_url, workdir):
+    """Miljövariabler som läses när app och poller importeras. Redan satta värden behålls."""
+    speed = args.speed
+    defaults = {
+        "SUPABASE_URL": postgrest_url,
+        "SUPABASE_KEY": STUB_SUPABASE_KEY,
+        "SUPABASE_SERVICE_ROLE_KEY": STUB_SUPABASE_KEY,
+        "TRAFIKVERKET_API_KEY": "stub",
+        "TRAFIKVERKET_API_URL": trv_url,
+        "TRAFFIC_INGEST_INTERVAL_SECONDS": str(60 / speed),
+        "TRAFFIC_STORE_SNAPSHOT_PATH": "",
+        "TRAFFIC_CAMERA_SNAPSHOT_PATH": os.path.join(workdir, "cameras.json"),
+        "TRAFFIC_STREAM_ENABLED": "false",
+        # Notis-routes: RENDER_SMS_URL/RENDER_EMAIL_URL är SMS- och mailservern.
+        "RENDER_SMS_URL": f"{messages_url}/sms",
+        "RENDER_EMAIL_URL": f"{messages_url}/email",
+        "X_API_KEY": "stub",
+        "POLLER_MODE": args.mode,
+        "POLLER_OUTBOX_PATH": os.path.join(workdir, "outbox.sqlite3"),
+        "NOTIFY_JOBS_PATH": os.path.join(workdir, "notification_jobs.sqlite3"),
+        "POLLER_JOB_POLL_SECONDS": "0.1",
+        "POLLER_MIN_INTERVAL_SECONDS": str(120 / speed),
+        "POLLER_MAX_INTERVAL_SECONDS": str(1800 / speed),
+        "POLLER_REQUEST_BUDGET_PER_HOUR": str(int(60 * speed)),
+        "POLLER_OUTBOX_RETRY_SECONDS": str(30 / speed),
+        "POLLER_RUSH_HOURS": "",
+        "POLLER_STATS_SECONDS": str(10 ** 9),
+    }
+    for name, value in defaults.items():
+        os.environ.setdefault(name, value)
+
+
+def percentile(values, p):
+    """Närmaste rang; None för en tom lista."""
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(p / 100 * len(ordered)) - 1)]
+
+
+def format_seconds(value):
+    return "-" if value is None else f"{value:.3f}s"
+
+
+def run(args):
+    recording = Recording(args.recording)
+    workdir = tempfile.mkdtemp(prefix="bench_pipeline_")
+    trv = TrafikverketStub(recording, speed=args.speed)
+    postgrest = PostgrestStub(latency_seconds=args.supabase_latency).start()
+    messages = MessageServerStub(latency_seconds=args.sms_latency, failure_rate=args.sms_failure_rate).start()
+    seed(postgrest, recording, args.subscribers, args.notify_existing)
+    configure_environment(args, trv.url, postgrest.url, messages.url, workdir)
+
+    # Publiceringstid per händelse: helsvaret vid start, varje delta vid offset / speed.
+    published_offset = {dev_id: 0.0 for dev_id in deviation_ids(recording.full)}
+    for offset, body in recording.deltas:
+        for dev_id in deviation_ids(body):
+            published_offset.setdefault(dev_id, offset / args.speed)
+
+    detected, dispatched, cycles = {}, {}, []
+    lock = threading.Lock()
+
+    def on_write(table, rows):
+        # Första SMS-gruppen som loggas som skickad (insert, eller update av en misslyckad rad).
+        now = time.monotonic()
+        if table == "notifications":
+            with lock:
+                for row in rows:
+                    if row.get("channel") == "sms" and row.get("status") == "sent":
+                        dispatched.setdefault(row["external_id"], now)
+
+    postgrest.listeners.append(on_write)
+
+    # Appens och pollerns utskrifter går till loggen under hela körningen (deras trådar lever
+    # kvar till processen avslutas); resultatet skrivs till den ursprungliga stdout.
+    out = sys.stdout
+    sys.stdout = open(args.log, "w", encoding="utf-8") if args.log else open(os.devnull, "w")
+    # Före importen, så att appens egen basicConfig (DEBUG till stderr) inte får effekt.
+    logging.basicConfig(level=logging.INFO, stream=sys.stdout, format="%(asctime)s - %(levelname)s - %(message)s")
+    trv.start()
+    # Importeras först nu, eftersom modulerna läser miljövariablerna ovan när de laddas.
+    from werkzeug.serving import make_server
+    import app as flask_app
+    import poller
+    from models.traffic_store import traffic_store
+    from routes import trafikverket_proxy
+
+    # Inspelningar kan vara äldre än /trafikinfo-fönstret (senaste dygnet).
+    trafikverket_proxy.TRAFIKINFO_WINDOW_SECONDS = 10 * 365 * 24 * 60 * 60
+    flask_requests = Counter()
+    wsgi_app = flask_app.app.wsgi_app
+
+    def counting_wsgi_app(environ, start_response):
+        path = environ.get("PATH_INFO", "")
+        # Statusfrågorna räknas tillsammans, oavsett jobb-id.
+        flask_requests["/api/notification-jobs" if path.startswith("/api/notification-jobs/") else path] += 1
+        return wsgi_app(environ, start_response)
+
+    flask_app.app.wsgi_app = counting_wsgi_app
+    server = make_server("127.0.0.1", 0, flask_app.app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base_url = f"http://127.0.0.1:{server.server_port}"
+
+    poller.TRAFIKINFO_URL = f"{base_url}/trafikinfo"
+    poller.SEND_SMS_URL = f"{base_url}/api/send_sms_for_deviation"
+    poller.INTERVAL_SECONDS = 600 / args.speed
+
+    def counters():
+        return {
+            "trafikverket": trv.request_count,
+            "trafikinfo": flask_requests["/trafikinfo"],
+            "send_sms": flask_requests["/api/send_sms_for_deviation"],
+            "job_status": flask_requests["/api/notification-jobs"],
+            "supabase": postgrest.request_count(),
+            "sms": messages.requests["/sms"],
+            "email": messages.requests["/email"],
+        }
+
+    enqueue_notification, report_outbox = poller.enqueue_notification, poller.report_outbox
+
+    def timed_enqueue(dev, county_no, subscriber_count):
+        with lock:
+            detected.setdefault(dev["Id"], time.monotonic())
+        return enqueue_notification(dev, county_no, subscriber_count)
+
+    def sampled_report_outbox():
+        cycles.append(counters())
+        return report_outbox()
+
+    poller.enqueue_notification = timed_enqueue
+    poller.report_outbox = sampled_report_outbox
+
+    deadline = time.monotonic() + 30
+    while not traffic_store.ready and time.monotonic() < deadline:
+        time.sleep(0.05)
+    start_counters = counters()
+    cycles.append(start_counters)
+    if args.mode == "async":
+        target = lambda: asyncio.run(poller.run_async())
+    else:
+        target = poller.run
+    threading.Thread(target=target, name="poller", daemon=True).start()
+
+    last_release = max((offset for offset, _ in recording.deltas), default=0.0) / args.speed
+    stop_at = trv.started + last_release + args.drain
+    while time.monotonic() < stop_at:
+        time.sleep(0.1)
+    end_counters = counters()
+    server.shutdown()
+
+    lines = report(args, trv, postgrest, messages, published_offset, detected, dispatched, cycles,
+                   start_counters, end_counters)
+    out.write("\n".join(lines) + "\n")
+    out.flush()
+
+
+def report(args, trv, postgrest, messages, published_offset, detected, dispatched, cycles, start_counters, end_counters):
+    dispatch_latency = [dispatched[dev_id] - at for dev_id, at in detected.items() if dev_id in dispatched]
+    detect_latency = [
+        at - (trv.started + published_offset[dev_id]) for dev_id, at in detected.items() if dev_id in published_offset
+    ]
+    lines = [f"\n== Notiskedjan ({args.mode}, {args.speed:g}x, {args.subscribers} prenumeranter/län) =="]
+    lines.append(f"Upptäckta händelser: {len(detected)}, skickade: {len(dispatched)}, "
+          f"ej skickade vid slutet: {len(set(detected) - set(dispatched))}")
+    lines.append(f"{'':24} {'p50':>9} {'p95':>9} {'p99':>9} {'max':>9}")
+    for name, values in (("upptäckt -> SMS skickat", dispatch_latency), ("publicerad -> upptäckt", detect_latency)):
+        lines.append(f"{name:24} " + " ".join(
+            f"{format_seconds(percentile(values, p)):>9}" for p in (50, 95, 99, 100)
+        ))
+
+    # Cykel 0 är läget innan pollern startade; varje följande post är slutet på en pollcykel.
+    names = list(start_counters)
+    lines.append(f"\nFörfrågningar per pollcykel ({len(cycles) - 1} cykler):")
+    lines.append(f"{'cykel':>5} " + " ".join(f"{name:>12}" for name in names))
+    for i in range(1, len(cycles)):
+        lines.append(f"{i:>5} " + " ".join(f"{cycles[i][name] - cycles[i - 1][name]:>12}" for name in names))
+    totals = {name: end_counters[name] - start_counters[name] for name in names}
+    poll_cycles = max(1, len(cycles) - 1)
+    lines.append(f"{'snitt':>5} " + " ".join(f"{totals[name] / poll_cycles:>12.1f}" for name in names))
+    lines.append(f"{'totalt':>5} " + " ".join(f"{totals[name]:>12}" for name in names))
+    lines.append("\nSupabase per tabell: " + ", ".join(
+        f"{method} {table}: {count}" for (method, table), count in sorted(postgrest.requests.items())
+    ))
+    lines.append(f"SMS-mottagare: {messages.recipients['/sms']}, e-postmottagare: {messages.recipients['/email']}")
+    lines.append(f"SMS-anrop: {messages.requests['/sms']}, varav misslyckade: {messages.failures['/sms']}")
+    return lines
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Mät latensen i notiskedjan mot lokala stubbar.")
+    parser.add_argument("recording", help="Katalog skapad av trafikverket_stub.py")
+    parser.add_argument("--speed", type=float, default=10.0, help="Uppspelningshastighet (standard 10x realtid)")
+    parser.add_argument("--mode", choices=["async", "sync"], default="async", help="Pollerns läge")
+    parser.add_argument("--subscribers", type=int, default=3, help="Prenumeranter per län")
+    parser.add_argument("--supabase-latency", type=float, default=0.01, help="Fördröjning per Supabase-svar (s)")
+    parser.add_argument("--sms-latency", type=float, default=0.2, help="Fördröjning per SMS/e-postutskick (s)")
+    parser.add_argument("--sms-failure-rate", type=float, default=0.0,
+                        help="Andel SMS/e-postanrop som besvaras med 503")
+    parser.add_argument("--drain", type=float, default=10.0, help="Sekunder att vänta efter sista deltat")
+    parser.add_argument("--notify-existing", action="store_true",
+                        help="Notifiera även händelserna i helsvaret (standard: de räknas som redan skickade)")
+    parser.add_argument("--log", help="Fil för appens och pollerns utskrifter (standard: kastas)")
+    run(parser.parse_args())
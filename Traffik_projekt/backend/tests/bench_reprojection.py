@@ -0,0 +1,126 @@
+# tests/bench_reprojection.py
+
+# Mikrobenchmark: omprojicering SWEREF99TM -> WGS84 punkt för punkt jämfört med ett enda
+# vektoriserat Transformer.transform-anrop över en hel lands datamängd.
+#
+#   python tests/bench_reprojection.py                      # syntetisk datamängd
+#   python tests/bench_reprojection.py /tmp/trv_recording   # inspelning från trafikverket_stub.py
+#
+# Före mätningen kontrolleras att batchen klarar WKT som NumPy inte kan parsa i ett svep
+# (MULTILINESTRING, trasiga värden) och ger samma resultat som punkt för punkt.
+
+import argparse
+import copy
+import json
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from models.reprojection import fill_wgs84_from_sweref, transformer_sweref_to_wgs84, _wkt_coordinates
+
+
+def synthetic_dataset(deviations, cameras, line_vertices):
+    def sweref_point():
+        return random.uniform(300000, 900000), random.uniform(6150000, 7650000)
+
+    devs = []
+    for i in range(deviations):
+        x, y = sweref_point()
+        line = ", ".join(f"{x + k * 40:.2f} {y + k * 25:.2f}" for k in range(line_vertices))
+        devs.append({
+            "Id": f"DEV_{i}",
+            "Geometry": {
+                "Point": {"SWEREF99TM": f"POINT ({x:.2f} {y:.2f})"},
+                "Line": {"SWEREF99TM": f"LINESTRING ({line})"} if i % 2 == 0 else None,
+            },
+        })
+    cams = [{"Id": f"CAM_{i}", "Geometry": {"SWEREF99TM": "POINT (%.2f %.2f)" % sweref_point()}} for i in range(cameras)]
+    return devs, cams
+
+
+def recorded_dataset(directory):
+    with open(os.path.join(directory, "manifest.json"), encoding="utf-8") as f:
+        manifest = json.load(f)
+    results = []
+    for name in (manifest["full"], manifest.get("cameras")):
+        if name:
+            with open(os.path.join(directory, name), encoding="utf-8") as f:
+                results.extend(json.load(f)["RESPONSE"]["RESULT"])
+    devs, cams = [], []
+    for result in results:
+        for situation in result.get("Situation", []):
+            devs.extend(situation.get("Deviation", []))
+        cams.extend(result.get("TrafficSafetyCamera", []))
+    # Ta bort WGS84 så att allt behöver räknas om, som när frågan bara innehåller SWEREF99TM.
+    for obj in devs + cams:
+        geometry = obj.get("Geometry") or {}
+        for part in (geometry.get("Point"), geometry.get("Line"), geometry):
+            if part:
+                part.pop("WGS84", None)
+    return devs, cams
+
+
+def per_point(deviations, cameras):
+    """Referens: ett transform-anrop per koordinatpar."""
+    parts = []
+    for deviation in deviations:
+        geometry = deviation.get("Geometry") or {}
+        parts.extend(p for p in (geometry.get("Point"), geometry.get("Line")) if p and p.get("SWEREF99TM"))
+    parts.extend(c["Geometry"] for c in cameras if (c.get("Geometry") or {}).get("SWEREF99TM"))
+    for part in parts:
+        coordinates = [transformer_sweref_to_wgs84.transform(x, y) for x, y in _wkt_coordinates(part["SWEREF99TM"])]
+        part["WGS84"] = ", ".join(f"{lon:.6f} {lat:.6f}" for lon, lat in coordinates)
+    return len(parts)
+
+
+def check_irregular_wkt():
+    """Batchen får inte avbrytas av en MULTILINESTRING eller ett trasigt värde bland vanliga geometrier."""
+    deviations = [
+        {"Geometry": {"Point": {"SWEREF99TM": "POINT (674032.4 6580821.6)"},
+                      "Line": {"SWEREF99TM": "MULTILINESTRING ((674032.4 6580821.6, 674100 6580900), (675000 6581000, 675100 6581100))"}}},
+        {"Geometry": {"Point": {"SWEREF99TM": "POINT (674032.4 x6580821.6)"}}},
+    ]
+    cameras = [{"Geometry": {"SWEREF99TM": "POINT (500000 6600000)"}}]
+    filled = fill_wgs84_from_sweref(deviations, cameras)
+    assert filled == 3, filled
+    line = deviations[0]["Geometry"]["Line"]["WGS84"]
+    assert line.startswith("MULTILINESTRING ((") and line.count("(") == 3, line
+    assert "WGS84" not in deviations[1]["Geometry"]["Point"], deviations[1]
+    expected = transformer_sweref_to_wgs84.transform(500000, 6600000)
+    assert cameras[0]["Geometry"]["WGS84"] == "POINT (%.6f %.6f)" % expected, cameras[0]
+    print("Kontroll av MULTILINESTRING och trasiga värden: OK")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("recording", nargs="?", help="Katalog skapad av trafikverket_stub.py")
+    parser.add_argument("--deviations", type=int, default=6000)
+    parser.add_argument("--cameras", type=int, default=1500)
+    parser.add_argument("--line-vertices", type=int, default=20)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    check_irregular_wkt()
+    if args.recording:
+        deviations, cameras = recorded_dataset(args.recording)
+    else:
+        deviations, cameras = synthetic_dataset(args.deviations, args.cameras, args.line_vertices)
+    vertices = sum(
+        len(_wkt_coordinates(p["SWEREF99TM"]))
+        for obj in deviations + cameras
+        for p in ((obj.get("Geometry") or {}).get("Point"), (obj.get("Geometry") or {}).get("Line"), obj.get("Geometry"))
+        if p and p.get("SWEREF99TM")
+    )
+    print(f"{len(deviations)} deviations, {len(cameras)} kameror, {vertices} koordinatpar")
+
+    for name, func in (("per punkt", per_point), ("batch", fill_wgs84_from_sweref)):
+        best = float("inf")
+        for _ in range(args.repeat):
+            devs, cams = copy.deepcopy(deviations), copy.deepcopy(cameras)
+            started = time.perf_counter()
+            func(devs, cams)
+            best = min(best, time.perf_counter() - started)
+        print(f"{name:>10}: {best * 1000:8.1f} ms")
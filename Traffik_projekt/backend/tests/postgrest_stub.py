@@ -0,0 +1,261 @@
+# tests/postgrest_stub.py
+
+# Lokal ersättare för Supabase REST (PostgREST) med tabeller i minnet. Täcker det som
+# backend och poller använder: select med kolumnlista och inbäddade tabeller (t.ex.
+# "user_id, users!inner(phone)"), filtren eq/neq/gt/gte/lt/lte/in/is och or, order, limit/offset,
+# insert (en rad eller flera), update, delete och rpc-funktioner som registreras i Python. Räknar förfrågningar per metod och tabell, och kan fördröja varje
+# svar för att efterlikna nätverkstiden mot Supabase.
+#
+#   stub = PostgrestStub(latency_seconds=0.02).start()
+#   stub.tables["location"] = [{"location_id": 1, "county_no": 1, "region": "Stockholm"}]
+#   os.environ["SUPABASE_URL"] = stub.url
+
+import json
+import threading
+import time
+from collections import Counter
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl, urlsplit
+
+OPERATORS = {"eq", "neq", "gt", "gte", "lt", "lte", "in", "is"}
+RESERVED_PARAMS = {"select", "order", "limit", "offset", "columns", "on_conflict"}
+
+
+def _text(value):
+    """Värdet som PostgREST skriver det i en URL (True -> "true")."""
+    if isinstance(value, bool):
+        return "true" if value else "false"
+    return "" if value is None else str(value)
+
+
+def _comparable(value):
+    """Tid, tal eller text, så att gt/lt jämför tidsstämplar och tal rätt."""
+    text = _text(value)
+    try:
+        return 0, datetime.fromisoformat(text).timestamp()
+    except ValueError:
+        pass
+    try:
+        return 0, float(text)
+    except ValueError:
+        return 1, text
+
+
+def _split_in_list(value):
+    # in.(a,"b,c") -> ["a", "b,c"]
+    items, current, quoted = [], "", False
+    for char in value.strip()[1:-1]:
+        if char == '"':
+            quoted = not quoted
+        elif char == "," and not quoted:
+            items.append(current)
+            current = ""
+        else:
+            current += char
+    if current or items:
+        items.append(current)
+    return items
+
+
+def _split_select(value):
+    # "user_id, users!inner(phone, email)" -> ["user_id", "users!inner(phone, email)"]
+    items, current, depth = [], "", 0
+    for char in value:
+        if char == "," and depth == 0:
+            items.append(current.strip())
+            current = ""
+            continue
+        depth += {"(": 1, ")": -1}.get(char, 0)
+        current += char
+    if current.strip():
+        items.append(current.strip())
+    return items
+
+
+def _matches_any(row, expression):
+    # or=(status.is.null,status.neq.failed): minst ett av villkoren ska gälla.
+    for condition in _split_in_list(expression):
+        column, _, condition_expression = condition.partition(".")
+        if _matches(row, column, condition_expression):
+            return True
+    return False
+
+
+def _matches(row, column, expression):
+    operator, _, operand = expression.partition(".")
+    if operator not in OPERATORS:
+        raise ValueError(f"Unsupported operator: {expression}")
+    value = row.get(column)
+    if operator == "is":
+        return _text(value).lower() == operand.lower() or (value is None and operand == "null")
+    if operator == "in":
+        return _text(value) in _split_in_list(operand)
+    if operator == "eq":
+        return _text(value).lower() == operand.lower() if isinstance(value, bool) else _text(value) == operand
+    if operator == "neq":
+        # Som i SQL: NULL matchar inte neq (använd is.null för att ta med dem).
+        return value is not None and _text(value) != operand
+    if value is None:
+        return False
+    left, right = _comparable(value), _comparable(operand)
+    return {"gt": left > right, "gte": left >= right, "lt": left < right, "lte": left <= right}[operator]
+
+
+class PostgrestStub:
+    """
+    HTTP-server som svarar som /rest/v1 i Supabase. `tables` är {tabell: [rad, ...]} och kan
+    fyllas i före start; `functions` är {namn: func(params) -> svar} för /rest/v1/rpc/<namn>.
+
+    Inbäddade tabeller kopplas många-till-en via `foreign_keys`, {(tabell, inbäddad):
+    (kolumn, kolumn i inbäddad)}. Standard är samma kolumn på båda sidor, uppkallad efter den
+    inbäddade tabellen i singular (users -> user_id).
+    """
+
+    def __init__(self, host="127.0.0.1", port=0, latency_seconds=0.0):
+        self.tables = {}
+        self.functions = {}
+        self.foreign_keys = {}
+        self.latency_seconds = latency_seconds
+        self.requests = Counter()  # (metod, tabell) -> antal
+        self.listeners = []        # func(tabell, rader) anropas efter varje insert och update
+        self._lock = threading.Lock()
+        self._next_id = 1
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def _handle(self):
+                length = int(self.headers.get("Content-Length", 0))
+                body = json.loads(self.rfile.read(length)) if length else None
+                status, payload = stub.respond(self.command, self.path, body, self.headers.get("Prefer", ""))
+                data = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            do_GET = do_POST = do_PATCH = do_DELETE = _handle
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        self.url = f"http://{host}:{self.server.server_address[1]}"
+
+    def start(self):
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+
+    def insert(self, table, rows):
+        """Lägger in rader direkt, utan att räknas som förfrågan (för testdata)."""
+        with self._lock:
+            return self._insert(table, rows)
+
+    def request_count(self, table=None):
+        return sum(n for (_, name), n in self.requests.items() if table is None or name == table)
+
+    def respond(self, method, path, body, prefer):
+        if self.latency_seconds:
+            time.sleep(self.latency_seconds)
+        url = urlsplit(path)
+        parts = url.path.strip("/").split("/")
+        if parts[:2] != ["rest", "v1"] or len(parts) < 3:
+            return 404, {"message": f"Unknown path {url.path}"}
+        params = parse_qsl(url.query, keep_blank_values=True)
+
+        if parts[2] == "rpc":
+            name = parts[3] if len(parts) > 3 else ""
+            self.requests[(method, f"rpc/{name}")] += 1
+            if name not in self.functions:
+                return 404, {"message": f"Unknown function {name}"}
+            return 200, self.functions[name](body or {})
+
+        table = parts[2]
+        self.requests[(method, table)] += 1
+        try:
+            with self._lock:
+                if method == "POST":
+                    rows = self._insert(table, body)
+                elif method == "GET":
+                    return 200, self._select(table, params)
+                elif method == "PATCH":
+                    rows = self._update(table, params, body or {})
+                elif method == "DELETE":
+                    rows = self._delete(table, params)
+                else:
+                    return 405, {"message": f"Unsupported method {method}"}
+        except ValueError as e:
+            return 400, {"message": str(e)}
+        if method in ("POST", "PATCH"):
+            for listener in self.listeners:
+                listener(table, rows)
+        return (201 if method == "POST" else 200), (rows if "return=representation" in prefer else [])
+
+    def _filter(self, table, params):
+        rows = self.tables.get(table, [])
+        for column, expression in params:
+            if column in RESERVED_PARAMS:
+                continue
+            if column == "or":
+                rows = [row for row in rows if _matches_any(row, expression)]
+            else:
+                rows = [row for row in rows if _matches(row, column, expression)]
+        return rows
+
+    def _select(self, table, params):
+        rows = self._filter(table, params)
+        options = dict(params)
+        for order in reversed([o for o in options.get("order", "").split(",") if o]):
+            column, _, direction = order.partition(".")
+            rows = sorted(rows, key=lambda row: _comparable(row.get(column)), reverse=direction.startswith("desc"))
+        offset = int(options.get("offset", 0))
+        limit = int(options["limit"]) if "limit" in options else None
+        columns, indexes = _split_select(options.get("select", "*")), {}
+        projected = (self._project(table, row, columns, indexes) for row in rows)
+        # Rader utan träff i en !inner-tabell tas bort före offset/limit, som i PostgREST.
+        projected = [row for row in projected if row is not None]
+        return projected[offset:offset + limit if limit is not None else None]
+
+    def _project(self, table, row, columns, indexes):
+        result = dict(row) if "*" in columns else {}
+        for column in columns:
+            if "(" not in column:
+                if column != "*":
+                    result[column] = row.get(column)
+                continue
+            name, _, inner = column[:-1].partition("(")
+            embedded, _, hint = name.partition("!")
+            local, remote = self.foreign_keys.get((table, embedded), (f"{embedded.rstrip('s')}_id",) * 2)
+            if (embedded, remote) not in indexes:
+                indexes[(embedded, remote)] = {r.get(remote): r for r in reversed(self.tables.get(embedded, []))}
+            match = indexes[(embedded, remote)].get(row.get(local))
+            if match is None and hint == "inner":
+                return None
+            result[embedded] = self._project(embedded, match, _split_select(inner), indexes) if match is not None else None
+        return result
+
+    def _insert(self, table, body):
+        now = datetime.now(timezone.utc).isoformat()
+        rows = []
+        for row in body if isinstance(body, list) else [body]:
+            row = {"id": self._next_id, "created_at": now, **row}
+            self._next_id += 1
+            rows.append(row)
+        self.tables.setdefault(table, []).extend(rows)
+        return [dict(row) for row in rows]
+
+    def _update(self, table, params, values):
+        rows = self._filter(table, params)
+        for row in rows:
+            row.update(values)
+        return [dict(row) for row in rows]
+
+    def _delete(self, table, params):
+        rows = self._filter(table, params)
+        ids = {id(row) for row in rows}
+        self.tables[table] = [row for row in self.tables.get(table, []) if id(row) not in ids]
+        return [dict(row) for row in rows]
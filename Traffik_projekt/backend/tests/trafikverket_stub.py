@@ -0,0 +1,282 @@
+# tests/trafikverket_stub.py
+
+# Lokal ersättare för Trafikverkets API som spelar upp inspelade svar.
+# Används för att mäta inhämtningen (se bench_incremental_sync.py) och hela notiskedjan
+# (se bench_notification_pipeline.py) utan riktig API-nyckel.
+#
+# En inspelning är en katalog med:
+#   manifest.json  - {"full": "full.json", "cameras": "cameras.json", "deltas": [{"file": "delta_0001.json", "offset_seconds": 60.0}, ...]}
+#   full.json      - svaret på en Situation-fråga med changeid="0"
+#   delta_*.json   - svaren på efterföljande frågor med föregående LASTCHANGEID
+#   cameras.json   - svaret på TrafficSafetyCamera-frågan (valfri)
+#
+# Kör direkt för att spela in från riktiga API:et:
+#   python tests/trafikverket_stub.py record <katalog> --cycles 10 --interval 60
+# eller skapa en syntetisk inspelning:
+#   python tests/trafikverket_stub.py synthetic <katalog> --situations 3000 --cycles 10
+
+import argparse
+import json
+import os
+import random
+import re
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+CHANGE_ID_PATTERN = re.compile(r'objecttype="Situation"[^>]*changeid="([^"]*)"')
+CAMERA_QUERY_PATTERN = re.compile(r'objecttype="TrafficSafetyCamera"')
+
+
+def _last_change_id(body):
+    for result in json.loads(body).get("RESPONSE", {}).get("RESULT", []):
+        if "TrafficSafetyCamera" not in result:
+            return result.get("INFO", {}).get("LASTCHANGEID")
+    return None
+
+
+class Recording:
+    """Läser in en inspelningskatalog och indexerar svaren på det LASTCHANGEID som föregår dem."""
+
+    def __init__(self, directory):
+        with open(os.path.join(directory, "manifest.json"), encoding="utf-8") as f:
+            manifest = json.load(f)
+        with open(os.path.join(directory, manifest["full"]), "rb") as f:
+            self.full = f.read()
+        self.cameras = None
+        if manifest.get("cameras"):
+            with open(os.path.join(directory, manifest["cameras"]), "rb") as f:
+                self.cameras = f.read()
+        self.deltas = []
+        for entry in manifest.get("deltas", []):
+            with open(os.path.join(directory, entry["file"]), "rb") as f:
+                self.deltas.append((entry.get("offset_seconds", 0.0), f.read()))
+
+        # Svaret på changeid=X är deltat som spelades in direkt efter det svar som gav LASTCHANGEID=X.
+        self.next_delta = {}
+        self.delta_offset = {}  # changeid -> offset_seconds för deltat som följer
+        previous_change_id = _last_change_id(self.full)
+        for offset, body in self.deltas:
+            self.next_delta[previous_change_id] = body
+            self.delta_offset[previous_change_id] = offset
+            previous_change_id = _last_change_id(body) or previous_change_id
+        self.last_change_id = previous_change_id
+
+    def empty_delta(self, change_id):
+        return json.dumps({
+            "RESPONSE": {"RESULT": [{"INFO": {"LASTCHANGEID": change_id}}, {"INFO": {"LASTCHANGEID": change_id}}]}
+        }).encode("utf-8")
+
+
+class TrafikverketStub:
+    """
+    Enkel HTTP-server som svarar som Trafikverkets data.json-endpoint.
+    Okända change id:n avvisas med 400 så att reservvägen (full omsynkning) kan testas.
+
+    Med `speed` spelas inspelningen upp i realtid gånger `speed`: ett delta lämnas ut först när
+    dess offset_seconds / speed har gått sedan start(), innan dess svarar stubben med ett tomt
+    delta. Utan `speed` lämnas nästa delta ut direkt vid varje fråga.
+    """
+
+    def __init__(self, recording, host="127.0.0.1", port=0, speed=None):
+        self.recording = recording
+        self.speed = speed
+        self.started = None
+        self.request_count = 0
+        self.bytes_sent = 0
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers.get("Content-Length", 0))).decode("utf-8")
+                status, payload = stub.respond(body)
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+                stub.request_count += 1
+                stub.bytes_sent += len(payload)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        self.url = f"http://{host}:{self.server.server_address[1]}/v2/data.json"
+
+    def respond(self, body):
+        if CAMERA_QUERY_PATTERN.search(body):
+            cameras = self.recording.cameras or b'{"RESPONSE": {"RESULT": [{"TrafficSafetyCamera": []}]}}'
+            return 200, cameras
+        match = CHANGE_ID_PATTERN.search(body)
+        change_id = match.group(1) if match else None
+        if change_id in (None, "0"):
+            return 200, self.recording.full
+        if change_id in self.recording.next_delta:
+            if self.speed and self.elapsed() * self.speed < self.recording.delta_offset[change_id]:
+                return 200, self.recording.empty_delta(change_id)
+            return 200, self.recording.next_delta[change_id]
+        if change_id == self.recording.last_change_id:
+            return 200, self.recording.empty_delta(change_id)
+        return 400, b'{"RESPONSE": {"RESULT": [{"ERROR": {"MESSAGE": "Invalid changeid"}}]}}'
+
+    def elapsed(self):
+        return time.monotonic() - self.started if self.started is not None else 0.0
+
+    def start(self):
+        self.started = time.monotonic()
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+
+
+def record(directory, cycles, interval):
+    """Spelar in kamerorna och en full omsynkning följd av `cycles` delta-svar från riktiga API:et."""
+    import requests
+    from models import traffic_ingester
+    from models.camera_dataset import build_camera_query
+
+    os.makedirs(directory, exist_ok=True)
+
+    def post(query):
+        response = requests.post(
+            traffic_ingester.TRAFIKVERKET_API_URL,
+            data=query.encode("utf-8"),
+            headers={"Content-Type": "text/xml"},
+            timeout=60,
+        )
+        response.raise_for_status()
+        return response.content
+
+    body = post(build_camera_query())
+    with open(os.path.join(directory, "cameras.json"), "wb") as f:
+        f.write(body)
+    print(f"cameras.json: {len(body)} bytes")
+
+    started = time.monotonic()
+    body = post(traffic_ingester.build_ingest_query("0"))
+    with open(os.path.join(directory, "full.json"), "wb") as f:
+        f.write(body)
+    manifest = {"full": "full.json", "cameras": "cameras.json", "deltas": []}
+    situation_change_id = _last_change_id(body) or "0"
+    print(f"full.json: {len(body)} bytes")
+
+    for i in range(1, cycles + 1):
+        time.sleep(interval)
+        body = post(traffic_ingester.build_ingest_query(situation_change_id))
+        name = f"delta_{i:04d}.json"
+        with open(os.path.join(directory, name), "wb") as f:
+            f.write(body)
+        manifest["deltas"].append({"file": name, "offset_seconds": round(time.monotonic() - started, 3)})
+        situation_change_id = _last_change_id(body) or situation_change_id
+        print(f"{name}: {len(body)} bytes")
+
+    with open(os.path.join(directory, "manifest.json"), "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2)
+
+
+def _synthetic_deviation(dev_id, county_no, now):
+    lon, lat = random.uniform(11.0, 23.0), random.uniform(55.3, 68.5)
+    message_type = random.choice(["Accident", "Roadwork", "MaintenanceWorks", "ConstructionWork"])
+    stamp = time.strftime("%Y-%m-%dT%H:%M:%S.000+02:00", time.localtime(now))
+    return {
+        "Id": dev_id,
+        "Header": f"Händelse {dev_id}",
+        "CreationTime": stamp,
+        "VersionTime": stamp,
+        "StartTime": stamp,
+        "CountyNo": [county_no],
+        "MessageType": message_type,
+        "MessageTypeValue": message_type,
+        "Message": "Syntetisk trafikhändelse för mätning. " * 3,
+        "RoadNumber": f"E{random.randint(1, 99)}",
+        "IconId": "roadwork" if message_type != "Accident" else "accident",
+        "Geometry": {
+            "Point": {
+                "WGS84": f"POINT ({lon:.6f} {lat:.6f})",
+                "SWEREF99TM": f"POINT ({random.uniform(300000, 900000):.2f} {random.uniform(6100000, 7600000):.2f})",
+            },
+        },
+    }
+
+
+def synthetic(directory, situations, cameras, cycles, changes_per_cycle, interval):
+    """Skapar en syntetisk inspelning med realistisk storlek på helsvar och delta."""
+    os.makedirs(directory, exist_ok=True)
+    now = time.time()
+    counties = [1, 3, 4, 5, 6, 7, 8, 9, 10, 12, 13, 14, 17, 18, 19, 20, 21, 22, 23, 24, 25]
+    state = {}
+    for i in range(situations):
+        sid = f"SE_STA_TRISSID_1_{i}"
+        state[sid] = {"Id": sid, "Deviation": [_synthetic_deviation(f"SE_STA_TRISSID_1_{i}_1", random.choice(counties), now)]}
+    camera_list = [
+        {
+            "Id": f"CAM_{i}", "Name": f"Kamera {i}", "CountyNo": random.choice(counties), "IconId": "trafficSafetyCamera",
+            "Bearing": random.randint(0, 359), "Geometry": {"WGS84": f"POINT ({random.uniform(11, 23):.6f} {random.uniform(55.3, 68.5):.6f})"},
+        }
+        for i in range(cameras)
+    ]
+
+    def write(name, body):
+        with open(os.path.join(directory, name), "w", encoding="utf-8") as f:
+            json.dump(body, f, ensure_ascii=False)
+
+    def write_situations(name, situation_objects, change_id):
+        write(name, {"RESPONSE": {"RESULT": [{"Situation": situation_objects, "INFO": {"LASTCHANGEID": change_id}}]}})
+
+    change_id = 7000000000000000000
+    write("cameras.json", {"RESPONSE": {"RESULT": [{"TrafficSafetyCamera": camera_list}]}})
+    write_situations("full.json", list(state.values()), str(change_id))
+    manifest = {"full": "full.json", "cameras": "cameras.json", "deltas": []}
+    next_index = situations
+    for cycle in range(1, cycles + 1):
+        changed = []
+        for sid in random.sample(sorted(state), min(changes_per_cycle, len(state))):
+            if random.random() < 0.3:
+                del state[sid]
+                changed.append({"Id": sid, "Deleted": True})
+            else:
+                state[sid]["Deviation"][0]["Header"] += " (uppdaterad)"
+                changed.append(state[sid])
+        for _ in range(max(1, changes_per_cycle // 3)):
+            sid = f"SE_STA_TRISSID_1_{next_index}"
+            next_index += 1
+            state[sid] = {"Id": sid, "Deviation": [_synthetic_deviation(f"{sid}_1", random.choice(counties), now)]}
+            changed.append(state[sid])
+        change_id += 1
+        name = f"delta_{cycle:04d}.json"
+        write_situations(name, changed, str(change_id))
+        manifest["deltas"].append({"file": name, "offset_seconds": cycle * interval})
+
+    with open(os.path.join(directory, "manifest.json"), "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2)
+    print(f"Syntetisk inspelning skapad i {directory} ({situations} situationer, {cycles} delta).")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Spela in eller skapa svar för Trafikverket-stubben.")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    rec = sub.add_parser("record", help="Spela in från riktiga API:et (kräver TRAFIKVERKET_API_KEY).")
+    rec.add_argument("directory")
+    rec.add_argument("--cycles", type=int, default=10)
+    rec.add_argument("--interval", type=float, default=60.0)
+
+    syn = sub.add_parser("synthetic", help="Skapa en syntetisk inspelning.")
+    syn.add_argument("directory")
+    syn.add_argument("--situations", type=int, default=3000)
+    syn.add_argument("--cameras", type=int, default=1200)
+    syn.add_argument("--cycles", type=int, default=10)
+    syn.add_argument("--changes", type=int, default=15)
+    syn.add_argument("--interval", type=float, default=60.0)
+
+    args = parser.parse_args()
+    if args.command == "record":
+        record(args.directory, args.cycles, args.interval)
+    else:
+        synthetic(args.directory, args.situations, args.cameras, args.cycles, args.changes, args.interval)
@@ -176,13 +176,74 @@ export function useTrafficMap(apiUrl, countyListSource, initialCountyNumberToNam
                 throw new Error(`HTTP error! status: ${response.status}`);
             }
             const backendResponse = await response.json(); // Parsar JSON-svaret.
-            return { success: true, data: backendResponse, message: "Data hämtad." };
+            // Token för att senare bara hämta ändringarna (saknas innan backend har laddat datan).
+            const changeToken = response.headers.get('X-Change-Token');
+            return { success: true, data: backendResponse, changeToken, message: "Data hämtad." };
         } catch (error) {
             console.error(`${logPrefix} Error fetching traffic info:`, error);
-            return { success: false, data: null, message: "Kunde inte hämta trafikinformation från servern." };
+            return { success: false, data: null, changeToken: null, message: "Kunde inte hämta trafikinformation från servern." };
         }
     };
 
+    /**
+     * Hämtar bara de händelser som ändrats sedan `changeToken` (från /api/traffic-info/changes).
+     * @param {string} selectedCountyValue - Valt län, samma som för fetchTrafficDataFromServer.
+     * @param {string} changeToken - Token från förra hämtningen.
+     * @returns {object} { success, changes } där changes är { token, full, added, updated, removed, cameras? }.
+     */
+    const fetchTrafficChangesFromServer = async (selectedCountyValue, changeToken) => {
+        const logPrefix = `[FetchChanges][County: ${selectedCountyValue || 'All'}]`;
+        const params = new URLSearchParams();
+        if (selectedCountyValue) {
+            params.append('county', selectedCountyValue);
+        }
+        params.append('messageTypeValue', 'Accident,Roadwork,MaintenanceWorks,ConstructionWork,RoadResurfacing,TrafficSafetyCamera');
+        params.append('since', changeToken);
+        const url = `${apiUrl}/changes?${params.toString()}`;
+        try {
+            const response = await fetch(url);
+            if (!response.ok) {
+                console.error(`${logPrefix} HTTP error! status: ${response.status}`);
+                return { success: false, changes: null };
+            }
+            return { success: true, changes: await response.json() };
+        } catch (error) {
+            console.error(`${logPrefix} Error fetching traffic changes:`, error);
+            return { success: false, changes: null };
+        }
+    };
+
+    /**
+     * Lägger in ändringar från /api/traffic-info/changes i ett tidigare svar och returnerar ett nytt
+     * svar i samma format (RESPONSE.RESULT), så att renderMarkersOnMap kan användas som vanligt.
+     * Vid full=true ersätts alla händelser och fartkameror.
+     */
+    const applyTrafficChanges = (backendData, changes) => {
+        const results = backendData?.RESPONSE?.RESULT || [];
+        const deviations = new Map();
+        let cameras = [];
+        if (!changes.full) {
+            results.forEach(r => {
+                (Array.isArray(r.Situation) ? r.Situation : (r.Situation ? [r.Situation] : [])).forEach(s => {
+                    (Array.isArray(s?.Deviation) ? s.Deviation : (s?.Deviation ? [s.Deviation] : [])).forEach(d => deviations.set(d.Id, d));
+                });
+                if (r.TrafficSafetyCamera) cameras = r.TrafficSafetyCamera;
+            });
+        } else {
+            cameras = changes.cameras || [];
+        }
+        changes.removed.forEach(id => deviations.delete(id));
+        changes.added.concat(changes.updated).forEach(d => deviations.set(d.Id, d));
+        return {
+            RESPONSE: {
+                RESULT: [
+                    { Situation: [{ Deviation: Array.from(deviations.values()) }] },
+                    { TrafficSafetyCamera: cameras }
+                ]
+            }
+        };
+    };
+
     // NYTT: Funktion för att generera popup-innehåll baserat på iframe-läget.
     // Detta tillåter att visa mer detaljerad information i "expanded"-läge.
     /**
@@ -518,6 +579,8 @@ export function useTrafficMap(apiUrl, countyListSource, initialCountyNumberToNam
         initMap,
         centerMapOnCounty,
         fetchTrafficDataFromServer,
+        fetchTrafficChangesFromServer,
+        applyTrafficChanges,
         renderMarkersOnMap,
         getMapInstance // NYTT: Exponerar getMapInstance.
     };
@@ -5,6 +5,11 @@
 // Denna funktion innehåller all logik för att interagera med kartan (Leaflet) och hämta trafikdata.
 import { useTrafficMap } from "./Map.js";
 
+// URL till SSE-strömmen med trafikändringar (/api/traffic-info/stream i backend/routes/traffic.py).
+// Med null, eller om strömmen inte kan öppnas (t.ex. 503 när servern har max antal strömmar),
+// hämtas ändringarna i stället via /api/traffic-info/changes en gång i minuten.
+const TRAFFIC_STREAM_URL = "https://trafik-q8va.onrender.com/api/traffic-info/stream";
+
 // Exporterar Vue-komponentens definition.
 export default {
     name: 'MapView', // Namnet på komponenten. Används för debugging och i Vue DevTools.
@@ -26,6 +31,7 @@ export default {
         const filterShowRoadworks = ref(true); // Filter för att visa vägarbeten på kartan. Standard: true (visa).
         const filterShowCameras = ref(true); // Filter för att visa fartkameror på kartan. Standard: true (visa).
         const lastBackendResponse = ref(null); // Lagrar den senast hämtade trafikdatan från backend.
+        const changeToken = ref(null); // Token för att bara hämta ändringar sedan förra hämtningen.
                                               // Används för att rendera om markörer när filter ändras.
         const currentIframeMode = ref('banner'); // Håller reda på iframe-läget ('banner' eller 'expanded').
                                                 // Startar i 'banner' som per senaste ändring (värdsidan sätter initialt läge).
@@ -74,6 +80,8 @@ export default {
             initMap, // Funktion för att initiera kartan.
             centerMapOnCounty, // Funktion för att centrera kartan på ett specifikt län.
             fetchTrafficDataFromServer, // Funktion för att hämta trafikdata från backend.
+            fetchTrafficChangesFromServer, // Funktion för att hämta bara ändringarna sedan förra hämtningen.
+            applyTrafficChanges, // Funktion för att lägga in ändringarna i den sparade datan.
             renderMarkersOnMap, // Funktion för att rendera markörer på kartan.
             getMapInstance // Funktion för att få tillgång till Leaflet-kartinstansen.
         } = useTrafficMap(
@@ -89,9 +97,11 @@ export default {
          */
         const fetchAndRenderNewData = async (countyValue) => {
             trafficStatusMessage.value = "Hämtar trafikinformation..."; // Uppdaterar statusmeddelandet.
-            const { success, data, message: fetchMessage } = await fetchTrafficDataFromServer(countyValue); // Anropar backend.
+            const { success, data, changeToken: token, message: fetchMessage } = await fetchTrafficDataFromServer(countyValue); // Anropar backend.
             if (success && data) { // Om hämtningen lyckades och data returnerades.
                 lastBackendResponse.value = data; // Sparar den råa datan.
+                changeToken.value = token; // Sparar token för den automatiska uppdateringen.
+                openTrafficStream(countyValue); // Tar emot ändringar via SSE från och med denna token.
                 const renderStatus = renderMarkersOnMap( // Renderar markörerna med de aktuella filtren.
                     data,
                     filterShowAccidents.value,
@@ -102,6 +112,8 @@ export default {
                 trafficStatusMessage.value = renderStatus.message; // Uppdaterar statusmeddelandet baserat på render-resultatet.
             } else { // Om hämtningen misslyckades.
                 lastBackendResponse.value = null; // Nollställer den sparade datan.
+                changeToken.value = null;
+                closeTrafficStream();
                 trafficStatusMessage.value = fetchMessage || "Kunde inte hämta trafikinformation."; // Visar felmeddelande.
                  // Om data inte kunde hämtas, och ett län är valt, försök centrera på det länet ändå.
                 // Om inget län är valt (t.ex. "Alla län"), centrera på "Alla län".
@@ -109,6 +121,63 @@ export default {
             }
         };
         
+        /**
+         * Automatisk uppdatering: hämtar bara ändringarna sedan förra hämtningen och lägger in dem
+         * i den sparade datan. Utan token (t.ex. innan backend har laddat datan) hämtas allt på nytt.
+         */
+        const refreshTrafficData = async () => {
+            // Strömmen skickar ändringarna själv så länge den är ansluten (eller återansluter).
+            if (trafficEventSource && trafficEventSource.readyState !== EventSource.CLOSED) return;
+            const countyValue = selectedCounty.value;
+            if (!lastBackendResponse.value || !changeToken.value) {
+                fetchAndRenderNewData(countyValue);
+                return;
+            }
+            const { success, changes } = await fetchTrafficChangesFromServer(countyValue, changeToken.value);
+            // Ignorera svaret om länet har bytts under tiden (då har en ny fullständig hämtning gjorts).
+            if (!success || countyValue !== selectedCounty.value) return;
+            changeToken.value = changes.token;
+            if (!changes.full && !changes.added.length && !changes.updated.length && !changes.removed.length) return;
+            lastBackendResponse.value = applyTrafficChanges(lastBackendResponse.value, changes);
+            applyFiltersAndReRender();
+        };
+        let refreshTimer = null; // Id för setInterval, så att den kan stoppas i onUnmounted.
+
+        // --- Start: SSE-ström med ändringar ---
+        let trafficEventSource = null; // Öppen EventSource, eller null.
+
+        const closeTrafficStream = () => {
+            if (trafficEventSource) {
+                trafficEventSource.close();
+                trafficEventSource = null;
+            }
+        };
+
+        /**
+         * Öppnar SSE-strömmen för det valda länet från och med den senaste token.
+         * Webbläsaren återansluter själv och skickar då Last-Event-ID, så inga ändringar missas.
+         * @param {string} countyValue - Värdet för det valda länet.
+         */
+        const openTrafficStream = (countyValue) => {
+            closeTrafficStream();
+            if (!TRAFFIC_STREAM_URL || !window.EventSource || !changeToken.value) return;
+            const params = new URLSearchParams();
+            if (countyValue) params.append('county', countyValue);
+            params.append('messageTypeValue', 'Accident,Roadwork,MaintenanceWorks,ConstructionWork,RoadResurfacing,TrafficSafetyCamera');
+            params.append('since', changeToken.value);
+            trafficEventSource = new EventSource(`${TRAFFIC_STREAM_URL}?${params.toString()}`);
+            const onChanges = (event) => {
+                const changes = JSON.parse(event.data);
+                changeToken.value = changes.token;
+                if (!lastBackendResponse.value) return;
+                lastBackendResponse.value = applyTrafficChanges(lastBackendResponse.value, changes);
+                applyFiltersAndReRender();
+            };
+            trafficEventSource.addEventListener('changes', onChanges); // Tillagda, ändrade och borttagna händelser.
+            trafficEventSource.addEventListener('reset', onChanges); // Hela datamängden (token för gammal).
+        };
+        // --- Slut: SSE-ström med ändringar ---
+
         /**
          * Tillämpar de aktuella filtren och renderar om markörerna med den senast hämtade datan.
          * Anropas när filter-checkboxar ändras.
@@ -306,7 +375,8 @@ export default {
             window.addEventListener('message', handleHostMessage);
             // Lägger till en global klicklyssnare för att stänga filter-dropdown.
             document.addEventListener('click', handleClickOutsideFilterDropdown);
-            // setInterval(() => fetchAndRenderNewData(selectedCounty.value), 5 * 60 * 1000); // Kan återaktiveras senare för automatisk uppdatering.
+            // Automatisk uppdatering varje minut. Bara ändringarna hämtas (se refreshTrafficData).
+            refreshTimer = setInterval(refreshTrafficData, 60 * 1000);
         });
 
         // onUnmounted körs när komponenten avmonteras från DOM (när den tas bort från sidan).
@@ -314,6 +384,8 @@ export default {
         onUnmounted(() => {
             window.removeEventListener('message', handleHostMessage);
             document.removeEventListener('click', handleClickOutsideFilterDropdown);
+            clearInterval(refreshTimer);
+            closeTrafficStream();
         });
 
         /**